@@ -0,0 +1,45 @@
+"""add job queue columns
+
+Revision ID: 5c1e7a9d2b4f
+Revises: 963ff8fb657b
+Create Date: 2026-10-18 10:12:31.418207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import geoalchemy2
+import sqlmodel  
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a9d2b4f'
+down_revision = '963ff8fb657b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('job', sa.Column('priority', sa.Integer(), server_default='0', nullable=False), schema='customer')
+    op.add_column('job', sa.Column('task', postgresql.JSONB(astext_type=sa.Text()), nullable=True), schema='customer')
+    op.add_column('job', sa.Column('worker_id', sa.Text(), nullable=True), schema='customer')
+    op.add_column('job', sa.Column('lease_expires_at', sa.DateTime(timezone=True), nullable=True), schema='customer')
+    op.add_column('job', sa.Column('attempts', sa.Integer(), server_default='0', nullable=False), schema='customer')
+    # Index of the queued jobs in the order they are claimed
+    op.create_index(
+        'ix_customer_job_queue',
+        'job',
+        [sa.text('priority DESC'), 'created_at'],
+        unique=False,
+        schema='customer',
+        postgresql_where=sa.text("task IS NOT NULL AND status_simple IN ('pending', 'running')"),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_customer_job_queue', table_name='job', schema='customer')
+    op.drop_column('job', 'attempts', schema='customer')
+    op.drop_column('job', 'lease_expires_at', schema='customer')
+    op.drop_column('job', 'worker_id', schema='customer')
+    op.drop_column('job', 'task', schema='customer')
+    op.drop_column('job', 'priority', schema='customer')
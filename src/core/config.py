@@ -35,10 +35,43 @@ class Settings(BaseSettings):
     ASYNC_CLIENT_READ_TIMEOUT: Optional[float] = (
         30.0  # Read timeout for async http client
     )
-    CRUD_NUM_RETRIES: Optional[int] = 30  # Number of times to retry calling an endpoint
-    CRUD_RETRY_INTERVAL: Optional[int] = 3  # Number of seconds to wait between retries
+    ASYNC_CLIENT_HTTP2: Optional[bool] = True  # Use HTTP/2 for HTTPS connections
+    ASYNC_CLIENT_COMPRESSION: Optional[bool] = True  # Accept compressed responses
+    ASYNC_CLIENT_MAX_CONNECTIONS: Optional[int] = 100
+    ASYNC_CLIENT_MAX_KEEPALIVE_CONNECTIONS: Optional[int] = 20
+    ASYNC_CLIENT_KEEPALIVE_EXPIRY: Optional[float] = 60.0
+    ASYNC_CLIENT_UPSTREAM_MAX_CONNECTIONS: Optional[Dict[str, int]] = {
+        "routing": 50,
+        "r5": 50,
+        "geoapi": 20,
+        "assets": 20,
+    }  # Max number of connections per upstream service
+    CRUD_RETRY_INTERVAL: Optional[int] = 3  # Max number of seconds between polls
+    CRUD_POLL_INITIAL_INTERVAL: Optional[float] = (
+        0.05  # Number of seconds to wait before polling an endpoint the first time
+    )
 
     HEATMAP_GRAVITY_MAX_SENSITIVITY: int = 1000000
+    HEATMAP_OPPORTUNITY_STAGING_CONCURRENCY: Optional[int] = (
+        4  # Max number of opportunity layers staged concurrently on separate connections
+    )
+    HEATMAP_RESULT_CACHE_MAX_ENTRIES: Optional[int] = (
+        1000  # Max number of cached heatmap results per worker, 0 disables the cache
+    )
+    HEATMAP_IN_PROCESS_ENGINE: Optional[bool] = (
+        False  # Compute gravity and closest-average heatmaps in Python
+    )
+    HEATMAP_MATRIX_CACHE_DIR: Optional[str] = None
+
+    @validator("HEATMAP_MATRIX_CACHE_DIR", pre=True)
+    def heatmap_matrix_cache_dir(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
+        if v is None:
+            return f'{values.get("DATA_DIR")}/traveltime_matrix'
+        return v
+
+    JSOLINE_PROCESS_POOL_SIZE: Optional[int] = (
+        2  # Number of worker processes used for contouring, 0 runs it in a thread
+    )
 
     SENTRY_DSN: Optional[HttpUrl] = None
     POSTGRES_SERVER: str
@@ -87,6 +120,23 @@ class Settings(BaseSettings):
     def r5_api_url(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
         return f'http://{values.get("R5_HOST")}:{values.get("R5_API_PORT")}/api'
 
+    R5_MAX_PARALLEL_REQUESTS_PER_HOST: Optional[int] = (
+        4  # Max number of concurrent requests sent to a single R5 host
+    )
+    R5_CACHE_DIR: Optional[str] = None
+
+    @validator("R5_CACHE_DIR", pre=True)
+    def r5_cache_dir(cls, v: Optional[str], values: Dict[str, Any]) -> Any:
+        if v is None:
+            return f'{values.get("DATA_DIR")}/r5_cache'
+        return v
+
+    R5_CACHE_MAX_SIZE: Optional[int] = (
+        2 * 1024**3  # Max size of the R5 travel time grid cache in bytes, 0 disables it
+    )
+    R5_REGION_MAPPING_REFRESH_INTERVAL: Optional[int] = (
+        300  # Number of seconds after which the in-memory region mapping is reloaded
+    )
     R5_AUTHORIZATION: str = None
 
     @validator("R5_AUTHORIZATION", pre=True)
@@ -123,6 +173,55 @@ class Settings(BaseSettings):
     CELERY_TASK_TIME_LIMIT: Optional[int] = 60  # seconds
     RUN_AS_BACKGROUND_TASK: Optional[bool] = True
     MAX_NUMBER_PARALLEL_JOBS: Optional[int] = 6
+    JOB_STATUS_EVENTS_MAX_QUEUE_SIZE: Optional[int] = (
+        100  # Job status events buffered per subscriber
+    )
+    JOB_STATUS_EVENTS_KEEPALIVE_INTERVAL: Optional[int] = (
+        15  # Seconds between keep-alive comments of idle event streams
+    )
+    NOTIFICATION_LISTENER_MAX_BACKOFF: Optional[int] = (
+        60  # Max seconds between attempts to reconnect a notification listener
+    )
+    NOTIFICATION_LISTENER_CHECK_INTERVAL: Optional[int] = (
+        30  # Seconds between checks of an idle notification listener connection
+    )
+    JOB_PROFILING_ENABLED: Optional[bool] = False  # Profile the jobs of tools
+    JOB_PROFILING_EXPLAIN: Optional[bool] = (
+        False  # Store the plans of profiled INSERT ... SELECT statements, run twice
+    )
+    JOB_PROFILING_MAX_ENTRIES: Optional[int] = (
+        50  # Max number of statements, requests and functions stored per job
+    )
+    JOB_PROFILING_MAX_NAME_LENGTH: Optional[int] = (
+        1000  # Max length of the normalized statements stored
+    )
+    JOB_QUEUE_ENABLED: Optional[bool] = False  # Run jobs in worker processes
+    JOB_QUEUE_WORKER_CONCURRENCY: Optional[int] = 4  # Jobs run at once per worker
+    JOB_QUEUE_POLL_INTERVAL: Optional[float] = 1.0  # Seconds between polls when idle
+    JOB_QUEUE_LEASE_DURATION: Optional[int] = 60  # Seconds a claimed job is leased
+    JOB_QUEUE_HEARTBEAT_INTERVAL: Optional[int] = 20  # Seconds between lease renewals
+    JOB_QUEUE_MAX_ATTEMPTS: Optional[int] = 3  # Claims of a job before it is failed
+    JOB_QUEUE_MAX_JOBS_PER_USER: Optional[int] = 3  # Running jobs per user
+    JOB_QUEUE_MAX_JOBS_PER_TYPE: Optional[Dict[str, int]] = {
+        "heatmap_gravity_active_mobility": 4,
+        "heatmap_gravity_motorized_mobility": 4,
+        "heatmap_closest_average_active_mobility": 4,
+        "heatmap_closest_average_motorized_mobility": 4,
+        "heatmap_connectivity_active_mobility": 4,
+        "heatmap_connectivity_motorized_mobility": 4,
+    }  # Running jobs per job type across all workers
+    JOB_QUEUE_PRIORITY: Optional[Dict[str, int]] = {
+        "catchment_area_active_mobility": 10,
+        "catchment_area_pt": 10,
+        "catchment_area_car": 10,
+        "nearby_station_access": 10,
+        "heatmap_gravity_active_mobility": -10,
+        "heatmap_gravity_motorized_mobility": -10,
+        "heatmap_closest_average_active_mobility": -10,
+        "heatmap_closest_average_motorized_mobility": -10,
+        "heatmap_connectivity_active_mobility": -10,
+        "heatmap_connectivity_motorized_mobility": -10,
+    }  # Priority per job type, higher priorities are claimed first
     TESTING: Optional[bool] = False
     MAX_FOLDER_COUNT: Optional[int] = 100
 
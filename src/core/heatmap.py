@@ -0,0 +1,616 @@
+import math
+import os
+import shutil
+import uuid
+from typing import List
+
+import numpy as np
+from numba import njit
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_INVERSE_TABLE,
+    TRAVELTIME_MATRIX_TABLE,
+    ImpedanceFunctionType,
+)
+
+IMPEDANCE_FUNCTION_CODE = {
+    ImpedanceFunctionType.gaussian: 0,
+    ImpedanceFunctionType.linear: 1,
+    ImpedanceFunctionType.exponential: 2,
+    ImpedanceFunctionType.power: 3,
+}
+
+
+class TravelTimeMatrix:
+    """Travel time matrix in compressed sparse row format.
+
+    The destinations reachable from origin i are stored in traveltime buckets ordered
+    by traveltime. The buckets of origin i are origin_start[i] <= b < origin_end[i]
+    and the destinations of bucket b are destinations[bucket_offsets[b]:bucket_offsets[b + 1]].
+    Origins and cells are sorted h3 indexes, destinations are indices into cells.
+    """
+
+    FIELDS = (
+        "cells",
+        "origins",
+        "origin_start",
+        "origin_end",
+        "traveltimes",
+        "bucket_offsets",
+        "destinations",
+    )
+
+    def __init__(
+        self,
+        cells: np.ndarray,
+        origins: np.ndarray,
+        origin_start: np.ndarray,
+        origin_end: np.ndarray,
+        traveltimes: np.ndarray,
+        bucket_offsets: np.ndarray,
+        destinations: np.ndarray,
+    ):
+        self.cells = cells
+        self.origins = origins
+        self.origin_start = origin_start
+        self.origin_end = origin_end
+        self.traveltimes = traveltimes
+        self.bucket_offsets = bucket_offsets
+        self.destinations = destinations
+
+    @classmethod
+    def from_rows(
+        cls,
+        orig_ids: np.ndarray,
+        traveltimes: np.ndarray,
+        dest_counts: np.ndarray,
+        dest_ids: np.ndarray,
+    ):
+        """Build the matrix from the rows of a travel time matrix table.
+
+        Each row holds the destinations reachable from an origin at one traveltime,
+        dest_ids contains the destinations of all rows one after another.
+        """
+
+        orig_ids = np.asarray(orig_ids, dtype=np.int64)
+        traveltimes = np.asarray(traveltimes, dtype=np.int16)
+        dest_counts = np.asarray(dest_counts, dtype=np.int64)
+        dest_ids = np.asarray(dest_ids, dtype=np.int64)
+        row_offsets = np.concatenate(([0], np.cumsum(dest_counts)))
+
+        # Order buckets by origin and traveltime
+        order = np.lexsort((traveltimes, orig_ids))
+        orig_ids, traveltimes, dest_counts = (
+            orig_ids[order],
+            traveltimes[order],
+            dest_counts[order],
+        )
+        bucket_offsets = np.concatenate(([0], np.cumsum(dest_counts)))
+        dest_ids = dest_ids[
+            np.repeat(row_offsets[:-1][order] - bucket_offsets[:-1], dest_counts)
+            + np.arange(bucket_offsets[-1])
+        ]
+
+        origins, origin_start = np.unique(orig_ids, return_index=True)
+        origin_end = np.append(origin_start[1:], len(orig_ids))
+        cells, destinations = np.unique(dest_ids, return_inverse=True)
+
+        return cls(
+            cells=cells,
+            origins=origins,
+            origin_start=origin_start.astype(np.int64),
+            origin_end=origin_end.astype(np.int64),
+            traveltimes=traveltimes,
+            bucket_offsets=bucket_offsets,
+            destinations=destinations.astype(np.int32).reshape(-1),
+        )
+
+    @classmethod
+    def concatenate(cls, matrices: List["TravelTimeMatrix"]):
+        """Combine matrices of partitions with disjoint origins."""
+
+        if len(matrices) == 1:
+            return matrices[0]
+
+        cells = np.unique(np.concatenate([matrix.cells for matrix in matrices]))
+        destinations = []
+        bucket_offsets = [np.zeros(1, dtype=np.int64)]
+        origin_start = []
+        origin_end = []
+        n_buckets = 0
+        n_destinations = 0
+        for matrix in matrices:
+            # Map the destinations to the combined cells
+            cell_index = np.searchsorted(cells, matrix.cells).astype(np.int32)
+            destinations.append(cell_index[matrix.destinations])
+            bucket_offsets.append(matrix.bucket_offsets[1:] + n_destinations)
+            origin_start.append(matrix.origin_start + n_buckets)
+            origin_end.append(matrix.origin_end + n_buckets)
+            n_buckets += len(matrix.traveltimes)
+            n_destinations += len(matrix.destinations)
+
+        origins = np.concatenate([matrix.origins for matrix in matrices])
+        order = np.argsort(origins, kind="stable")
+        return cls(
+            cells=cells,
+            origins=origins[order],
+            origin_start=np.concatenate(origin_start)[order],
+            origin_end=np.concatenate(origin_end)[order],
+            traveltimes=np.concatenate([matrix.traveltimes for matrix in matrices]),
+            bucket_offsets=np.concatenate(bucket_offsets),
+            destinations=np.concatenate(destinations),
+        )
+
+    def get_origin_index(self, h3_indexes: np.ndarray) -> np.ndarray:
+        """Get the index of origins, -1 if the cell is not an origin of the matrix."""
+
+        h3_indexes = np.asarray(h3_indexes, dtype=np.int64)
+        if len(self.origins) == 0:
+            return np.full(len(h3_indexes), -1, dtype=np.int64)
+        index = np.searchsorted(self.origins, h3_indexes)
+        index[index == len(self.origins)] = 0
+        return np.where(self.origins[index] == h3_indexes, index, -1)
+
+    def save(self, path: str):
+        """Save the matrix to a directory, replacing an existing one atomically."""
+
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(temp_path)
+        for field in self.FIELDS:
+            np.save(os.path.join(temp_path, f"{field}.npy"), getattr(self, field))
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Matrix was saved concurrently by another worker
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str):
+        """Load a saved matrix using memory maps."""
+
+        return cls(
+            **{
+                field: np.load(os.path.join(path, f"{field}.npy"), mmap_mode="r")
+                for field in cls.FIELDS
+            }
+        )
+
+
+async def fetch_traveltime_matrix_partition(
+    async_session: AsyncSession, routing_type: str, h3_3: int, inverse: bool = False
+) -> TravelTimeMatrix:
+    """Fetch a h3_3 partition of a travel time matrix table.
+
+    The inverse matrix table holds the origins reaching each destination, so its
+    destinations become the origins of the matrix and vice versa.
+    """
+
+    if inverse:
+        table_name = TRAVELTIME_MATRIX_INVERSE_TABLE[routing_type]
+        origin_column, destination_column = "dest_id", "orig_id"
+    else:
+        table_name = TRAVELTIME_MATRIX_TABLE[routing_type]
+        origin_column, destination_column = "orig_id", "dest_id"
+
+    sql_get_matrix = f"""
+        SELECT {origin_column}::bigint, traveltime,
+            COALESCE(ARRAY_LENGTH({destination_column}, 1), 0),
+            ARRAY_TO_STRING({destination_column}::bigint[], ',')
+        FROM {table_name}
+        WHERE h3_3 = {int(h3_3)};
+    """
+    rows = (await async_session.execute(sql_get_matrix)).fetchall()
+    dest_ids = ",".join(row[3] for row in rows if row[2])
+    return TravelTimeMatrix.from_rows(
+        orig_ids=[row[0] for row in rows],
+        traveltimes=[row[1] for row in rows],
+        dest_counts=[row[2] for row in rows],
+        dest_ids=(
+            np.array(dest_ids.split(","), dtype=np.int64)
+            if dest_ids
+            else np.empty(0, dtype=np.int64)
+        ),
+    )
+
+
+async def get_traveltime_matrix_version(
+    async_session: AsyncSession, routing_type: str
+) -> str:
+    """Get the version of a travel time matrix table.
+
+    The version changes when the table is re-created or truncated to load a new
+    matrix, as both assign new storage to the table.
+    """
+
+    sql_get_version = f"""
+        SELECT oid::text || '_' || relfilenode::text
+        FROM pg_class
+        WHERE oid = '{TRAVELTIME_MATRIX_TABLE[routing_type]}'::regclass;
+    """
+    return (await async_session.execute(sql_get_version)).scalar()
+
+
+def delete_traveltime_matrix_versions(path: str, version: str):
+    """Delete the cached partitions of all but the specified matrix version."""
+
+    if not os.path.isdir(path):
+        return
+    for entry in os.scandir(path):
+        if entry.name != version:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+async def get_traveltime_matrix(
+    async_session: AsyncSession,
+    routing_type: str,
+    h3_3: List[int],
+    inverse: bool = False,
+) -> TravelTimeMatrix:
+    """Get the travel time matrix of the origins in the specified h3_3 partitions.
+
+    Partitions are fetched from the database once and memory-mapped from the local
+    disk cache afterwards. The cache is keyed on the version of the matrix table,
+    partitions of previous versions are deleted once a new version is cached. The
+    inverse matrix is keyed on the same version, so it must be checked to be built
+    from the current matrix before.
+    """
+
+    routing_type_path = os.path.join(
+        settings.HEATMAP_MATRIX_CACHE_DIR,
+        str(routing_type) + ("_inverse" if inverse else ""),
+    )
+    version = await get_traveltime_matrix_version(async_session, routing_type)
+    version_path = os.path.join(routing_type_path, version)
+    if not os.path.exists(version_path):
+        delete_traveltime_matrix_versions(routing_type_path, version)
+
+    matrices = []
+    for partition in sorted({int(value) for value in h3_3}):
+        path = os.path.join(version_path, str(partition))
+        if not os.path.exists(path):
+            matrix = await fetch_traveltime_matrix_partition(
+                async_session, routing_type, partition, inverse
+            )
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            matrix.save(path)
+        matrices.append(TravelTimeMatrix.load(path))
+
+    if not matrices:
+        return TravelTimeMatrix.from_rows([], [], [], [])
+    return TravelTimeMatrix.concatenate(matrices)
+
+
+def get_h3_3(h3_indexes: np.ndarray) -> np.ndarray:
+    """Get the h3_3 partition of cells, same as basic.to_short_h3_3 of their parent.
+
+    The partition only depends on the base cell and the first three digits, which a
+    cell shares with its parent at resolution 3.
+    """
+
+    return (np.asarray(h3_indexes, dtype=np.int64) >> 36) & 0xFFFF
+
+
+@njit(cache=True)
+def impedance(
+    function, traveltime, sensitivity, potential, max_traveltime, max_sensitivity
+):
+    """Impedance weighted potential of an opportunity, same as in the SQL query."""
+
+    relative_traveltime = traveltime / max_traveltime
+    relative_sensitivity = sensitivity / max_sensitivity
+    if function == 0:
+        weight = math.exp(-(relative_traveltime**2) / relative_sensitivity)
+    elif function == 1:
+        weight = 1 - relative_traveltime
+    elif function == 2:
+        weight = math.exp(-relative_sensitivity * relative_traveltime)
+    else:
+        weight = relative_traveltime ** (-relative_sensitivity)
+    return weight * potential
+
+
+@njit(cache=True, nogil=True)
+def compute_gravity(
+    origin_start,
+    origin_end,
+    traveltimes,
+    bucket_offsets,
+    destinations,
+    n_cells,
+    opportunity_origin,
+    opportunity_group,
+    opportunity_max_traveltime,
+    group_sensitivity,
+    group_potential,
+    function,
+    max_traveltime,
+    max_sensitivity,
+):
+    """
+    Sum the impedance weighted potential of all opportunities reaching each cell.
+
+    Opportunities are ordered by group. The cells of a group (e.g. the cells covered
+    by a polygon) are treated as one opportunity using the minimum traveltime.
+    """
+
+    accessibility = np.zeros(n_cells, dtype=np.float64)
+    reached = np.zeros(n_cells, dtype=np.bool_)
+    stamp = np.full(n_cells, -1, dtype=np.int64)
+    best_traveltime = np.zeros(n_cells, dtype=np.float64)
+    touched = np.empty(n_cells, dtype=np.int64)
+
+    n_opportunities = len(opportunity_origin)
+    i = 0
+    while i < n_opportunities:
+        group = opportunity_group[i]
+        n_touched = 0
+        while i < n_opportunities and opportunity_group[i] == group:
+            origin = opportunity_origin[i]
+            max_opportunity_traveltime = opportunity_max_traveltime[i]
+            i += 1
+            if origin < 0:
+                continue
+            for bucket in range(origin_start[origin], origin_end[origin]):
+                traveltime = traveltimes[bucket]
+                if traveltime > max_opportunity_traveltime:
+                    break
+                for k in range(bucket_offsets[bucket], bucket_offsets[bucket + 1]):
+                    cell = destinations[k]
+                    if stamp[cell] != group:
+                        stamp[cell] = group
+                        best_traveltime[cell] = traveltime
+                        touched[n_touched] = cell
+                        n_touched += 1
+                    elif traveltime < best_traveltime[cell]:
+                        best_traveltime[cell] = traveltime
+
+        for j in range(n_touched):
+            cell = touched[j]
+            reached[cell] = True
+            accessibility[cell] += impedance(
+                function,
+                best_traveltime[cell],
+                group_sensitivity[group],
+                group_potential[group],
+                max_traveltime,
+                max_sensitivity,
+            )
+
+    return reached, accessibility
+
+
+def heatmap_gravity(
+    matrix: TravelTimeMatrix,
+    opportunity_h3_index: np.ndarray,
+    opportunity_group: np.ndarray,
+    opportunity_max_traveltime: np.ndarray,
+    group_sensitivity: np.ndarray,
+    group_potential: np.ndarray,
+    impedance_function: ImpedanceFunctionType,
+    max_traveltime: float,
+    max_sensitivity: float,
+):
+    """
+    Compute the gravity based heatmap for a set of opportunities.
+
+    :param opportunity_h3_index: The h3 index of each opportunity cell.
+    :param opportunity_group: The group (opportunity) each opportunity cell belongs to.
+    :param opportunity_max_traveltime: The max traveltime of each opportunity cell.
+    :param group_sensitivity: The sensitivity of each group.
+    :param group_potential: The potential of each group.
+
+    :return: The h3 indexes of the reached cells and their accessibility.
+    """
+
+    opportunity_group = np.asarray(opportunity_group, dtype=np.int64)
+    order = np.argsort(opportunity_group, kind="stable")
+    reached, accessibility = compute_gravity(
+        np.asarray(matrix.origin_start),
+        np.asarray(matrix.origin_end),
+        np.asarray(matrix.traveltimes),
+        np.asarray(matrix.bucket_offsets),
+        np.asarray(matrix.destinations),
+        len(matrix.cells),
+        matrix.get_origin_index(opportunity_h3_index)[order],
+        opportunity_group[order],
+        np.asarray(opportunity_max_traveltime, dtype=np.float64)[order],
+        np.asarray(group_sensitivity, dtype=np.float64),
+        np.asarray(group_potential, dtype=np.float64),
+        IMPEDANCE_FUNCTION_CODE[impedance_function],
+        float(max_traveltime),
+        float(max_sensitivity),
+    )
+    return np.asarray(matrix.cells)[reached], accessibility[reached]
+
+
+def get_cell_opportunities(cells: np.ndarray, opportunity_h3_index: np.ndarray):
+    """Index the opportunities by the cells they are located in.
+
+    The opportunities located in cells[i] are
+    cell_opportunities[cell_opportunity_offsets[i]:cell_opportunity_offsets[i + 1]],
+    opportunities located outside of the cells are left out.
+    """
+
+    cells = np.asarray(cells, dtype=np.int64)
+    opportunity_h3_index = np.asarray(opportunity_h3_index, dtype=np.int64)
+    if len(cells) == 0:
+        return np.zeros(1, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    opportunity_cell = np.searchsorted(cells, opportunity_h3_index)
+    opportunity_cell[opportunity_cell == len(cells)] = 0
+    located = cells[opportunity_cell] == opportunity_h3_index
+    cell_opportunities = np.flatnonzero(located)[
+        np.argsort(opportunity_cell[located], kind="stable")
+    ]
+    cell_opportunity_offsets = np.concatenate(
+        ([0], np.cumsum(np.bincount(opportunity_cell[located], minlength=len(cells))))
+    )
+    return cell_opportunity_offsets, cell_opportunities
+
+
+@njit(cache=True, nogil=True)
+def compute_reached(
+    origin_start,
+    origin_end,
+    traveltimes,
+    bucket_offsets,
+    destinations,
+    n_cells,
+    opportunity_origin,
+    opportunity_max_traveltime,
+):
+    """Mark the cells reached by any opportunity within its max traveltime."""
+
+    reached = np.zeros(n_cells, dtype=np.bool_)
+    for i in range(len(opportunity_origin)):
+        origin = opportunity_origin[i]
+        if origin < 0:
+            continue
+        for bucket in range(origin_start[origin], origin_end[origin]):
+            if traveltimes[bucket] > opportunity_max_traveltime[i]:
+                break
+            for k in range(bucket_offsets[bucket], bucket_offsets[bucket + 1]):
+                reached[destinations[k]] = True
+    return reached
+
+
+@njit(cache=True, nogil=True)
+def compute_closest_average(
+    cell_origin,
+    origin_start,
+    origin_end,
+    traveltimes,
+    bucket_offsets,
+    destinations,
+    cell_opportunity_offsets,
+    cell_opportunities,
+    opportunity_group,
+    opportunity_max_traveltime,
+    group_category,
+    category_num_destinations,
+):
+    """
+    Average the traveltime to the closest opportunities of each category per cell.
+
+    The origins reaching a cell are walked in the inverse matrix by ascending
+    traveltime, so the first traveltime found for a group (e.g. the cells covered by
+    a polygon) is its minimum. The walk stops once num_destinations opportunities of
+    every category are found.
+    """
+
+    n_categories = len(category_num_destinations)
+    total_num_destinations = category_num_destinations.sum()
+    max_traveltime = opportunity_max_traveltime.max()
+    values = np.full(len(cell_origin), np.nan, dtype=np.float64)
+    found = np.zeros(n_categories, dtype=np.int64)
+    stamp = np.full(len(group_category), -1, dtype=np.int64)
+
+    for i in range(len(cell_origin)):
+        origin = cell_origin[i]
+        if origin < 0:
+            continue
+        found[:] = 0
+        n_found = 0
+        total_traveltime = 0.0
+        for bucket in range(origin_start[origin], origin_end[origin]):
+            traveltime = traveltimes[bucket]
+            if traveltime > max_traveltime or n_found == total_num_destinations:
+                break
+            for k in range(bucket_offsets[bucket], bucket_offsets[bucket + 1]):
+                cell = destinations[k]
+                for j in range(
+                    cell_opportunity_offsets[cell], cell_opportunity_offsets[cell + 1]
+                ):
+                    opportunity = cell_opportunities[j]
+                    group = opportunity_group[opportunity]
+                    category = group_category[group]
+                    if (
+                        stamp[group] == i
+                        or found[category] == category_num_destinations[category]
+                        or traveltime > opportunity_max_traveltime[opportunity]
+                    ):
+                        continue
+                    stamp[group] = i
+                    found[category] += 1
+                    n_found += 1
+                    total_traveltime += traveltime
+        if n_found > 0:
+            values[i] = total_traveltime / n_found
+
+    return values
+
+
+def get_reached_cells(
+    matrix: TravelTimeMatrix,
+    opportunity_h3_index: np.ndarray,
+    opportunity_max_traveltime: np.ndarray,
+) -> np.ndarray:
+    """Get the h3 indexes of the cells reached by any opportunity."""
+
+    reached = compute_reached(
+        np.asarray(matrix.origin_start),
+        np.asarray(matrix.origin_end),
+        np.asarray(matrix.traveltimes),
+        np.asarray(matrix.bucket_offsets),
+        np.asarray(matrix.destinations),
+        len(matrix.cells),
+        matrix.get_origin_index(opportunity_h3_index),
+        np.asarray(opportunity_max_traveltime, dtype=np.float64),
+    )
+    return np.asarray(matrix.cells)[reached]
+
+
+def heatmap_closest_average(
+    inverse_matrix: TravelTimeMatrix,
+    h3_index: np.ndarray,
+    opportunity_h3_index: np.ndarray,
+    opportunity_group: np.ndarray,
+    opportunity_max_traveltime: np.ndarray,
+    group_num_destinations: np.ndarray,
+):
+    """
+    Compute the closest-average heatmap of the specified cells.
+
+    The closest opportunities of a cell are found in the inverse matrix, which must
+    cover the h3_3 partitions of the cells. Groups with the same number of
+    destinations form a category, same as in the SQL query.
+
+    :param h3_index: The h3 indexes of the cells to compute, e.g. the reached cells.
+    :param opportunity_h3_index: The h3 index of each opportunity cell.
+    :param opportunity_group: The group (opportunity) each opportunity cell belongs to.
+    :param opportunity_max_traveltime: The max traveltime of each opportunity cell.
+    :param group_num_destinations: The number of destinations of each group.
+
+    :return: The h3 indexes of the cells reached by any opportunity and their
+        average traveltime.
+    """
+
+    h3_index = np.asarray(h3_index, dtype=np.int64)
+    inverse_cells = np.asarray(inverse_matrix.cells)
+    if len(h3_index) == 0 or len(inverse_cells) == 0:
+        return h3_index[:0], np.empty(0, dtype=np.float64)
+
+    cell_opportunity_offsets, cell_opportunities = get_cell_opportunities(
+        inverse_cells, opportunity_h3_index
+    )
+    category_num_destinations, group_category = np.unique(
+        np.asarray(group_num_destinations, dtype=np.int64), return_inverse=True
+    )
+    values = compute_closest_average(
+        inverse_matrix.get_origin_index(h3_index),
+        np.asarray(inverse_matrix.origin_start),
+        np.asarray(inverse_matrix.origin_end),
+        np.asarray(inverse_matrix.traveltimes),
+        np.asarray(inverse_matrix.bucket_offsets),
+        np.asarray(inverse_matrix.destinations),
+        cell_opportunity_offsets,
+        cell_opportunities,
+        np.asarray(opportunity_group, dtype=np.int64),
+        np.asarray(opportunity_max_traveltime, dtype=np.float64),
+        group_category.astype(np.int64).reshape(-1),
+        category_num_destinations,
+    )
+    found = ~np.isnan(values)
+    return h3_index[found], values[found]
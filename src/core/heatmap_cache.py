@@ -0,0 +1,114 @@
+import hashlib
+import json
+from collections import OrderedDict
+from uuid import UUID
+
+from src.core.config import settings
+from src.core.notification_listener import NotificationListener
+
+
+class HeatmapResultCache:
+    """Process-local cache of heatmap results.
+
+    Entries map a hash of the heatmap inputs to the result layer that was computed
+    for them. Entries are evicted in LRU order and invalidated when one of their
+    layers is updated or deleted, as signalled by the layer_changes notifications.
+    As notifications are missed while the listener is not connected, the cache is
+    bypassed until it reconnects and cleared when it does.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.listener = NotificationListener(
+            "layer_changes", self.handle_notification, on_connect=self.handle_connect
+        )
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def get_key(**inputs) -> str:
+        """Get the cache key of the heatmap inputs."""
+
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def get(self, key: str):
+        """Get the cached result layer of a key, None on a miss."""
+
+        entry = self.entries.get(key)
+        if entry is None or self.listener.interrupted:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, layer_id: UUID, table_name: str, input_layer_ids: list):
+        """Cache the result layer computed for a key."""
+
+        if not self.enabled or self.listener.interrupted:
+            return
+        self.entries[key] = {
+            "layer_id": str(layer_id),
+            "table_name": table_name,
+            "input_layer_ids": {str(layer_id) for layer_id in input_layer_ids},
+        }
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, layer_id: UUID | str):
+        """Remove all entries computed from or resulting in a layer."""
+
+        layer_id = str(UUID(str(layer_id)))
+        for key in [
+            key
+            for key, entry in self.entries.items()
+            if entry["layer_id"] == layer_id or layer_id in entry["input_layer_ids"]
+        ]:
+            del self.entries[key]
+            self.invalidations += 1
+
+    def handle_notification(self, connection, pid, channel, payload: str):
+        """Invalidate the entries of an updated or deleted layer."""
+
+        operation, _, layer_id = payload.partition(":")
+        if operation in ("UPDATE", "DELETE"):
+            self.invalidate(layer_id)
+
+    async def handle_connect(self, connection):
+        """Clear the entries, as layers may have changed while not listening."""
+
+        self.entries.clear()
+
+    def listen(self, dsn: str):
+        """Listen to the layer_changes notifications on a dedicated connection."""
+
+        if not self.enabled:
+            return
+        self.listener.start(dsn)
+
+    async def close(self):
+        await self.listener.close()
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "listening": self.listener.connected,
+        }
+
+
+heatmap_result_cache = HeatmapResultCache(
+    max_entries=settings.HEATMAP_RESULT_CACHE_MAX_ENTRIES
+)
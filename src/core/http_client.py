@@ -0,0 +1,82 @@
+from typing import Dict, Optional
+
+from httpx import URL, AsyncClient, AsyncHTTPTransport, Limits, Timeout
+
+from src.core.config import settings
+from src.core.job_profiler import on_request, on_response
+
+http_client: Optional[AsyncClient] = None
+
+
+def get_upstream_urls() -> Dict[str, Optional[str]]:
+    """Returns the base URLs of the upstream services by name."""
+
+    return {
+        "routing": settings.GOAT_ROUTING_URL,
+        "r5": settings.R5_API_URL,
+        "geoapi": settings.GOAT_GEOAPI_HOST,
+        "assets": settings.ASSETS_URL,
+    }
+
+
+def create_transport(max_connections: int) -> AsyncHTTPTransport:
+    """Create a connection pool with the configured keep-alive and HTTP/2 settings."""
+
+    return AsyncHTTPTransport(
+        http2=settings.ASYNC_CLIENT_HTTP2,
+        limits=Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(
+                max_connections, settings.ASYNC_CLIENT_MAX_KEEPALIVE_CONNECTIONS
+            ),
+            keepalive_expiry=settings.ASYNC_CLIENT_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def create_http_client() -> AsyncClient:
+    """Create an HTTP client with a separate connection pool for each upstream service."""
+
+    mounts = {}
+    for name, url in get_upstream_urls().items():
+        max_connections = settings.ASYNC_CLIENT_UPSTREAM_MAX_CONNECTIONS.get(name)
+        if not url or not max_connections:
+            continue
+        host = URL(url if "://" in url else f"http://{url}").host
+        if host and host != "none":
+            mounts[f"all://{host}"] = create_transport(max_connections)
+
+    return AsyncClient(
+        timeout=Timeout(
+            settings.ASYNC_CLIENT_DEFAULT_TIMEOUT,
+            read=settings.ASYNC_CLIENT_READ_TIMEOUT,
+        ),
+        transport=create_transport(settings.ASYNC_CLIENT_MAX_CONNECTIONS),
+        mounts=mounts,
+        # Follow redirects like the aiohttp session this client replaced
+        follow_redirects=True,
+        headers=(
+            {"Accept-Encoding": "identity"}
+            if not settings.ASYNC_CLIENT_COMPRESSION
+            else None
+        ),
+        event_hooks={"request": [on_request], "response": [on_response]},
+    )
+
+
+def get_http_client() -> AsyncClient:
+    """Returns the HTTP client shared by all requests to other services."""
+
+    global http_client
+    if http_client is None:
+        http_client = create_http_client()
+    return http_client
+
+
+async def close_http_client():
+    """Clean-up network resources used by the HTTP client."""
+
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
@@ -10,7 +10,11 @@ from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.config import settings
+from src.core.job_cancellation import job_cancellation
+from src.core.job_profiler import JobProfiler, current_job_profiler
+from src.core.job_queue import enqueue_job, get_task, running_queued_job
 from src.crud.crud_job import job as crud_job
+from src.crud.crud_job_profile import job_profile as crud_job_profile
 from src.schemas.error import ERROR_MAPPING, JobKilledError, TimeoutError, UnknownError
 from src.schemas.job import JobStatusType
 from src.schemas.layer import LayerType, UserDataTable
@@ -140,6 +144,17 @@ async def run_failure_func(instance, func, *args, **kwargs):
         await delete_created_layers()
 
 
+async def save_job_profile(async_session: AsyncSession, profiler: JobProfiler):
+    """Save the profile of a job without failing the job if it can't be saved."""
+
+    try:
+        await crud_job_profile.save(async_session, profiler)
+    except Exception as e:
+        background_logger.warning(
+            f"Job {str(profiler.job_id)} failed to save its profile: {str(e)}"
+        )
+
+
 def job_init():
     def decorator(func, timeout: int = 1):
         @wraps(func)
@@ -158,12 +173,25 @@ def job_init():
             background_logger.info(f"Job {str(job_id)} started.")
             # Get job id
             job = await crud_job.get(db=async_session, id=job_id)
+            await async_session.refresh(job)
+
+            # Don't run a job that was killed before it started
+            if job.status_simple == JobStatusType.killed.value:
+                background_logger.info(f"Job {str(job_id)} was killed.")
+                return {"status": JobStatusType.killed.value, "msg": "Job was killed."}
+
             job = await crud_job.update(
                 db=async_session,
                 db_obj=job,
                 obj_in={"status_simple": JobStatusType.running.value},
             )
 
+            # Profile the job if enabled for the tool
+            profiler = None
+            if settings.JOB_PROFILING_ENABLED and getattr(self, "profiling", False):
+                profiler = JobProfiler(job_id, explain=settings.JOB_PROFILING_EXPLAIN)
+            token = current_job_profiler.set(profiler)
+
             # Execute function
             try:
                 result = await func(*args, **kwargs)
@@ -188,6 +216,10 @@ def job_init():
                     },
                 )
                 return
+            finally:
+                current_job_profiler.reset(token)
+                if profiler is not None:
+                    await save_job_profile(async_session, profiler)
 
             # Update job status to finished in case it is not killed, timeout or failed
             if result["status"] not in [
@@ -262,9 +294,18 @@ def job_log(job_step_name: str, timeout: int = settings.JOB_TIMEOUT_DEFAULT):
                 background_logger.error(msg_text)
                 return {"status": JobStatusType.killed.value, "msg": msg_text}
 
-            # Execute function
+            # Execute function as a task, which is cancelled if the job is killed
+            step = asyncio.ensure_future(func(*args, **kwargs))
             try:
-                result = await asyncio.wait_for(func(*args, **kwargs), timeout)
+                with job_cancellation.register(job_id, step):
+                    try:
+                        result = await asyncio.wait_for(step, timeout)
+                    except asyncio.CancelledError:
+                        if not job_cancellation.is_cancelled(job_id):
+                            raise
+                        killed = True
+                    else:
+                        killed = False
             except asyncio.TimeoutError:
                 # Roll back the transaction
                 await async_session.rollback()
@@ -298,27 +339,34 @@ def job_log(job_step_name: str, timeout: int = settings.JOB_TIMEOUT_DEFAULT):
                 background_logger.error(f"Job failed with error: {e}")
                 raise e
 
-            # Check if job was killed. The job needs to be expired as it was fetching old data from cache.
-            async_session.expire(job)
-            job = await crud_job.get(db=async_session, id=job_id)
-
-            if job.status_simple == JobStatusType.killed.value:
-                status = JobStatusType.killed.value
+            # Clean up right away if the job was killed while running
+            if killed:
+                await async_session.rollback()
+                await run_failure_func(self, func, *args, **kwargs)
                 msg_text = "Job was killed."
-            # Else use the status provided by the function
+                job = await crud_job.update_status(
+                    async_session=async_session,
+                    job_id=job_id,
+                    status=JobStatusType.killed.value,
+                    msg_text=msg_text,
+                    job_step_name=job_step_name,
+                )
+                background_logger.error(msg_text)
+                return {"status": JobStatusType.killed.value, "msg": msg_text}
+
+            # Use the status provided by the function
+            if result["status"] == JobStatusType.failed.value:
+                status = JobStatusType.failed.value
+                msg_text = result["msg"]
+            elif result["status"] == JobStatusType.finished.value:
+                status = JobStatusType.finished.value
+                msg_text = "Job finished successfully."
             else:
-                if result["status"] == JobStatusType.failed.value:
-                    status = JobStatusType.failed.value
-                    msg_text = result["msg"]
-                elif result["status"] == JobStatusType.finished.value:
-                    status = JobStatusType.finished.value
-                    msg_text = "Job finished successfully."
-                else:
-                    raise ValueError(
-                        f"Invalid status {result['status']} returned by function {func.__name__}."
-                    )
+                raise ValueError(
+                    f"Invalid status {result['status']} returned by function {func.__name__}."
+                )
 
-            # Update job status if successful
+            # Update job status. A job killed in the meantime is returned as killed.
             job = await crud_job.update_status(
                 async_session=async_session,
                 job_id=job_id,
@@ -358,10 +406,20 @@ def run_background_or_immediately(settings):
             else:
                 background_tasks = args[0].background_tasks
 
-            if settings.RUN_AS_BACKGROUND_TASK is False:
+            if settings.RUN_AS_BACKGROUND_TASK is False or running_queued_job.get():
                 return await func(*args, **kwargs)
-            else:
-                return background_tasks.add_task(func, *args, **kwargs)
+
+            # Queue the job for a worker if the worker can rebuild the call
+            if settings.JOB_QUEUE_ENABLED:
+                task = get_task(args[0], func, args[1:], kwargs)
+                if task is not None:
+                    return await enqueue_job(
+                        async_session=args[0].async_session,
+                        job_id=args[0].job_id,
+                        task=task,
+                    )
+
+            return background_tasks.add_task(func, *args, **kwargs)
 
         return wrapper
 
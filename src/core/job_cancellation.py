@@ -0,0 +1,63 @@
+import asyncio
+from contextlib import contextmanager
+from uuid import UUID
+
+from src.schemas.job import JobStatusType
+
+
+class JobCancellation:
+    """Cancellation of the job steps running in this process.
+
+    Job steps are registered while they run. Cancelling a job cancels the tasks of
+    its running steps, which makes asyncpg cancel the statement a step is waiting
+    on in Postgres. Jobs are cancelled when they are killed, as signalled by the
+    job_status notifications.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.cancellations = 0
+
+    @contextmanager
+    def register(self, job_id: UUID | str, task: asyncio.Task):
+        """Register the task of a running job step."""
+
+        job_id = str(UUID(str(job_id)))
+        job = self.jobs.setdefault(job_id, {"tasks": set(), "cancelled": False})
+        job["tasks"].add(task)
+        try:
+            yield
+        finally:
+            job["tasks"].discard(task)
+            if not job["tasks"]:
+                del self.jobs[job_id]
+
+    def cancel(self, job_id: UUID | str) -> bool:
+        """Cancel the running steps of a job, False if none run in this process."""
+
+        job = self.jobs.get(str(UUID(str(job_id))))
+        if job is None:
+            return False
+        if job["cancelled"]:
+            return True
+        job["cancelled"] = True
+        for task in job["tasks"]:
+            task.cancel()
+        self.cancellations += 1
+        return True
+
+    def is_cancelled(self, job_id: UUID | str) -> bool:
+        job = self.jobs.get(str(UUID(str(job_id))))
+        return job is not None and job["cancelled"]
+
+    def handle_event(self, event: dict):
+        """Cancel a job that was killed."""
+
+        if event["status_simple"] == JobStatusType.killed.value:
+            self.cancel(event["id"])
+
+    def stats(self):
+        return {"running": len(self.jobs), "cancellations": self.cancellations}
+
+
+job_cancellation = JobCancellation()
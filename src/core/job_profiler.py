@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import re
+import time
+from contextvars import ContextVar
+from functools import partial
+from uuid import UUID
+
+from src.core.config import settings
+
+# Statements that are explained after they are executed, as they can be rolled back
+EXPLAINABLE_STATEMENT = re.compile(r"^\s*INSERT\s+INTO\s.+\bSELECT\b", re.I | re.S)
+EXPLAIN_SAVEPOINT = "job_profiler_explain"
+
+profiler_logger = logging.getLogger("Job profiler")
+
+
+def normalize_statement(statement: str) -> str:
+    """Normalize a statement so executions differing in their literals are grouped."""
+
+    statement = re.sub(r"'[^']*'", "?", statement)
+    # Table names contain the ID of their user or layer without dashes
+    statement = re.sub(r"(?<![0-9a-z])[0-9a-f]{32}(?![0-9a-z])", "?", statement)
+    statement = re.sub(r"\b\d+(\.\d+)?\b", "?", statement)
+    return re.sub(r"\s+", " ", statement).strip()[
+        : settings.JOB_PROFILING_MAX_NAME_LENGTH
+    ]
+
+
+class JobProfiler:
+    """Resources used by a running job.
+
+    The wall time, rows and the plan of the slowest execution of each statement,
+    the wall time of the requests to each upstream and the CPU time of functions
+    run in executors are aggregated while the job runs.
+    """
+
+    def __init__(self, job_id: UUID, explain: bool = False):
+        self.job_id = job_id
+        self.explain = explain
+        self.start = time.perf_counter()
+        self.statements = {}
+        self.requests = {}
+        self.functions = {}
+
+    def record(
+        self,
+        entries: dict,
+        name: str,
+        wall_time: float,
+        rows: int = None,
+        cpu_time: float = None,
+        plan: dict = None,
+    ):
+        entry = entries.setdefault(
+            name, {"name": name, "count": 0, "wall_time": 0.0, "max_wall_time": 0.0}
+        )
+        entry["count"] += 1
+        entry["wall_time"] += wall_time
+        if plan is not None and wall_time >= entry["max_wall_time"]:
+            entry["plan"] = plan
+        entry["max_wall_time"] = max(entry["max_wall_time"], wall_time)
+        if rows is not None and rows >= 0:
+            entry["rows"] = entry.get("rows", 0) + rows
+        if cpu_time is not None:
+            entry["cpu_time"] = entry.get("cpu_time", 0.0) + cpu_time
+
+    def get_entries(self, entries: dict):
+        """Get the entries with the largest wall time first."""
+
+        return sorted(entries.values(), key=lambda entry: -entry["wall_time"])[
+            : settings.JOB_PROFILING_MAX_ENTRIES
+        ]
+
+    def dict(self):
+        return {
+            "job_id": self.job_id,
+            "wall_time": time.perf_counter() - self.start,
+            "statements": self.get_entries(self.statements),
+            "requests": self.get_entries(self.requests),
+            "functions": self.get_entries(self.functions),
+        }
+
+
+current_job_profiler: ContextVar[JobProfiler | None] = ContextVar(
+    "current_job_profiler", default=None
+)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Start timing a statement of a profiled job."""
+
+    if current_job_profiler.get() is None or context is None:
+        return
+    context.job_profiler_start = time.perf_counter()
+
+
+def explain_statement(conn, statement: str, parameters) -> dict | None:
+    """Get the plan of a statement that was executed, None if it can't be explained.
+
+    The statement is run again by EXPLAIN ANALYZE on a separate cursor, leaving the
+    result of its execution untouched, and rolled back to a savepoint, or in a
+    transaction of its own if the connection is in autocommit mode.
+    """
+
+    cursor = conn.connection.cursor()
+    autocommit = conn.connection.autocommit
+    try:
+        cursor.execute("BEGIN" if autocommit else f"SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        try:
+            cursor.execute(
+                f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}", parameters
+            )
+            plan = cursor.fetchone()[0]
+        finally:
+            if autocommit:
+                cursor.execute("ROLLBACK")
+            else:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}")
+                cursor.execute(f"RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}")
+    except Exception as e:
+        profiler_logger.warning(f"Could not explain statement: {e}")
+        return None
+    finally:
+        cursor.close()
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Record the wall time and rows of a statement of a profiled job."""
+
+    profiler = current_job_profiler.get()
+    start = getattr(context, "job_profiler_start", None)
+    if profiler is None or start is None:
+        return
+    wall_time = time.perf_counter() - start
+
+    rows, plan = cursor.rowcount, None
+    if (
+        profiler.explain
+        and not executemany
+        and EXPLAINABLE_STATEMENT.match(statement) is not None
+        and re.search(r"\bRETURNING\b", statement, re.I) is None
+    ):
+        plan = explain_statement(conn, statement, parameters)
+    profiler.record(
+        profiler.statements,
+        normalize_statement(statement),
+        wall_time,
+        rows=rows,
+        plan=plan,
+    )
+
+
+async def on_request(request):
+    """Start timing a request of a profiled job to an upstream service."""
+
+    if current_job_profiler.get() is not None:
+        request.extensions["job_profiler_start"] = time.perf_counter()
+
+
+async def on_response(response):
+    """Record the wall time until the response of an upstream service arrived."""
+
+    profiler = current_job_profiler.get()
+    start = response.request.extensions.get("job_profiler_start")
+    if profiler is None or start is None:
+        return
+    url = response.request.url
+    profiler.record(
+        profiler.requests,
+        f"{response.request.method} {url.host}{normalize_statement(url.path)}",
+        time.perf_counter() - start,
+    )
+
+
+def measure_cpu_time(func, *args, **kwargs):
+    """Run a function and measure the CPU time it used. Runs in the executor."""
+
+    start = time.thread_time()
+    result = func(*args, **kwargs)
+    return result, time.thread_time() - start
+
+
+async def run_in_executor(executor, func, *args, **kwargs):
+    """Run a function in an executor, recording its CPU time if the job is profiled.
+
+    The executor is a process pool or None for the default thread pool.
+    """
+
+    loop = asyncio.get_running_loop()
+    profiler = current_job_profiler.get()
+    if profiler is None:
+        return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
+
+    start = time.perf_counter()
+    result, cpu_time = await loop.run_in_executor(
+        executor, partial(measure_cpu_time, func, *args, **kwargs)
+    )
+    profiler.record(
+        profiler.functions,
+        func.__name__,
+        time.perf_counter() - start,
+        cpu_time=cpu_time,
+    )
+    return result
@@ -0,0 +1,289 @@
+import importlib
+import inspect
+import json
+from contextvars import ContextVar
+from uuid import UUID
+
+from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.core.job_status import get_notify_status_query
+from src.schemas.error import TimeoutError
+from src.schemas.job import JobStatusType
+
+# Arguments a worker can pass when it rebuilds a tool
+TOOL_INIT_PARAMETERS = {
+    "self",
+    "job_id",
+    "background_tasks",
+    "async_session",
+    "user_id",
+    "project_id",
+    "http_client",
+}
+
+# Key of the advisory lock serializing the claims of all workers
+CLAIM_LOCK_KEY = 872341
+
+# Set while a worker runs a job, so the job is run instead of queued again
+running_queued_job: ContextVar[bool] = ContextVar("running_queued_job", default=False)
+
+
+def get_object_path(obj) -> str:
+    return f"{obj.__module__}:{obj.__qualname__}"
+
+
+def import_object(path: str):
+    module_name, _, qualname = path.partition(":")
+    obj = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        obj = getattr(obj, name)
+    return obj
+
+
+def get_task(instance, func, args: tuple, kwargs: dict) -> dict | None:
+    """Get the task a worker runs for a tool method call.
+
+    Returns None if the call can't be rebuilt by a worker, which is the case if the
+    tool takes other constructor arguments than the ones known to the worker or if
+    the method takes other arguments than pydantic models.
+    """
+
+    if getattr(instance, "job_id", None) is None or args or not kwargs:
+        return None
+    if not all(isinstance(value, BaseModel) for value in kwargs.values()):
+        return None
+    parameters = inspect.signature(type(instance).__init__).parameters
+    if not set(parameters) <= TOOL_INIT_PARAMETERS:
+        return None
+
+    return {
+        "tool": get_object_path(type(instance)),
+        "method": func.__name__,
+        "kwargs": {
+            name: {"model": get_object_path(type(value)), "value": value.json()}
+            for name, value in kwargs.items()
+        },
+    }
+
+
+async def enqueue_job(async_session: AsyncSession, job_id: UUID, task: dict):
+    """Queue a pending job to be run by a worker."""
+
+    await async_session.execute(
+        text(
+            f"""
+            UPDATE {settings.CUSTOMER_SCHEMA}.job
+            SET task = CAST(:task AS jsonb),
+            priority = COALESCE((CAST(:priorities AS jsonb) ->> type)::int, 0)
+            WHERE id = :job_id
+            """
+        ),
+        {
+            "job_id": job_id,
+            "task": json.dumps(task),
+            "priorities": json.dumps(settings.JOB_QUEUE_PRIORITY),
+        },
+    )
+    await async_session.commit()
+
+
+async def claim_job(async_session: AsyncSession, worker_id: str):
+    """Claim the next queued job for a worker.
+
+    Jobs are claimed by priority and then in the order they were created. A job is
+    skipped while its user or job type is at the concurrency limit. Running jobs
+    whose lease expired are claimed again until they run out of attempts, and
+    are failed after that.
+
+    Claims are serialized with a transaction-level advisory lock, so the limits
+    hold across workers. Rows locked by other transactions, e.g. by a job being
+    killed, are skipped.
+    """
+
+    # Run the claim in one transaction instead of the autocommit default
+    await async_session.connection(
+        execution_options={"isolation_level": "READ COMMITTED"}
+    )
+    await async_session.execute(
+        text("SELECT pg_advisory_xact_lock(:key)"), {"key": CLAIM_LOCK_KEY}
+    )
+
+    # Fail jobs that were abandoned too often
+    await async_session.execute(
+        text(
+            f"""
+            WITH updated AS (
+                UPDATE {settings.CUSTOMER_SCHEMA}.job
+                SET status_simple = :failed, msg_simple = :msg_simple,
+                worker_id = NULL, lease_expires_at = NULL
+                WHERE task IS NOT NULL
+                AND status_simple = :running
+                AND lease_expires_at < now()
+                AND attempts >= :max_attempts
+                RETURNING *
+            )
+            {get_notify_status_query()}
+            """
+        ),
+        {
+            "failed": JobStatusType.failed.value,
+            "running": JobStatusType.running.value,
+            "max_attempts": settings.JOB_QUEUE_MAX_ATTEMPTS,
+            "msg_simple": f"{TimeoutError.__name__}: Job was abandoned by its worker.",
+        },
+    )
+
+    result = await async_session.execute(
+        text(
+            f"""
+            UPDATE {settings.CUSTOMER_SCHEMA}.job
+            SET status_simple = :running, worker_id = :worker_id,
+            lease_expires_at = now() + make_interval(secs => :lease_duration),
+            attempts = attempts + 1
+            WHERE id = (
+                SELECT j.id
+                FROM {settings.CUSTOMER_SCHEMA}.job j
+                WHERE j.task IS NOT NULL
+                AND j.attempts < :max_attempts
+                AND (
+                    j.status_simple = :pending
+                    OR (j.status_simple = :running AND j.lease_expires_at < now())
+                )
+                AND (
+                    SELECT COUNT(*)
+                    FROM {settings.CUSTOMER_SCHEMA}.job r
+                    WHERE r.task IS NOT NULL
+                    AND r.status_simple = :running
+                    AND r.lease_expires_at >= now()
+                    AND r.user_id = j.user_id
+                ) < :max_jobs_per_user
+                AND (
+                    (CAST(:max_jobs_per_type AS jsonb) ->> j.type) IS NULL
+                    OR (
+                        SELECT COUNT(*)
+                        FROM {settings.CUSTOMER_SCHEMA}.job r
+                        WHERE r.task IS NOT NULL
+                        AND r.status_simple = :running
+                        AND r.lease_expires_at >= now()
+                        AND r.type = j.type
+                    ) < (CAST(:max_jobs_per_type AS jsonb) ->> j.type)::int
+                )
+                ORDER BY j.priority DESC, j.created_at
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, user_id, project_id, task, attempts
+            """
+        ),
+        {
+            "worker_id": worker_id,
+            "pending": JobStatusType.pending.value,
+            "running": JobStatusType.running.value,
+            "lease_duration": settings.JOB_QUEUE_LEASE_DURATION,
+            "max_attempts": settings.JOB_QUEUE_MAX_ATTEMPTS,
+            "max_jobs_per_user": settings.JOB_QUEUE_MAX_JOBS_PER_USER,
+            "max_jobs_per_type": json.dumps(settings.JOB_QUEUE_MAX_JOBS_PER_TYPE),
+        },
+    )
+    job = result.mappings().fetchone()
+    await async_session.commit()
+
+    return dict(job) if job else None
+
+
+async def renew_lease(async_session: AsyncSession, job_id: UUID, worker_id: str):
+    """Extend the lease of a job held by a worker.
+
+    Returns False if the worker lost the job, e.g. after it was claimed again.
+    """
+
+    result = await async_session.execute(
+        text(
+            f"""
+            UPDATE {settings.CUSTOMER_SCHEMA}.job
+            SET lease_expires_at = now() + make_interval(secs => :lease_duration)
+            WHERE id = :job_id
+            AND worker_id = :worker_id
+            """
+        ),
+        {
+            "job_id": job_id,
+            "worker_id": worker_id,
+            "lease_duration": settings.JOB_QUEUE_LEASE_DURATION,
+        },
+    )
+    await async_session.commit()
+    return result.rowcount > 0
+
+
+async def release_job(
+    async_session: AsyncSession,
+    job_id: UUID,
+    worker_id: str,
+    status: JobStatusType = None,
+    msg_simple: str = None,
+):
+    """Release a job after a worker has run it, optionally setting its status."""
+
+    await async_session.execute(
+        text(
+            f"""
+            WITH updated AS (
+                UPDATE {settings.CUSTOMER_SCHEMA}.job
+                SET worker_id = NULL, lease_expires_at = NULL,
+                status_simple = COALESCE(:status, status_simple),
+                msg_simple = COALESCE(:msg_simple, msg_simple)
+                WHERE id = :job_id
+                AND worker_id = :worker_id
+                RETURNING *
+            )
+            {get_notify_status_query()}
+            WHERE CAST(:status AS text) IS NOT NULL
+            """
+        ),
+        {
+            "job_id": job_id,
+            "worker_id": worker_id,
+            "status": status.value if status else None,
+            "msg_simple": msg_simple,
+        },
+    )
+    await async_session.commit()
+
+
+async def run_task(
+    task: dict,
+    job_id: UUID,
+    async_session: AsyncSession,
+    user_id: UUID,
+    project_id: UUID,
+    http_client=None,
+):
+    """Rebuild the tool of a queued job and run its method."""
+
+    tool_class = import_object(task["tool"])
+    kwargs = {
+        name: import_object(argument["model"]).parse_raw(argument["value"])
+        for name, argument in task["kwargs"].items()
+    }
+    init_kwargs = {
+        "job_id": job_id,
+        "background_tasks": None,
+        "async_session": async_session,
+        "user_id": user_id,
+        "project_id": project_id,
+        "http_client": http_client,
+    }
+    parameters = inspect.signature(tool_class.__init__).parameters
+    tool = tool_class(
+        **{name: value for name, value in init_kwargs.items() if name in parameters}
+    )
+
+    token = running_queued_job.set(True)
+    try:
+        return await getattr(tool, task["method"])(**kwargs)
+    finally:
+        running_queued_job.reset(token)
@@ -0,0 +1,130 @@
+import asyncio
+import json
+from contextlib import contextmanager
+from uuid import UUID
+
+from src.core.config import settings
+from src.core.job_cancellation import job_cancellation
+from src.core.notification_listener import NotificationListener
+from src.schemas.job import JobStatusType
+
+JOB_STATUS_CHANNEL = "job_status"
+# Notification payloads are limited to 8000 bytes, so long messages are truncated
+JOB_STATUS_MSG_MAX_LENGTH = 1000
+
+
+def get_notify_status_query(job_step_name: str = "NULL::text") -> str:
+    """Get the query notifying the status of the jobs in an "updated" CTE."""
+
+    return f"""
+        SELECT pg_notify('{JOB_STATUS_CHANNEL}', json_build_object(
+            'id', id, 'user_id', user_id, 'project_id', project_id, 'type', type,
+            'status_simple', status_simple,
+            'msg_simple', left(msg_simple, {JOB_STATUS_MSG_MAX_LENGTH}),
+            'job_step_name', {job_step_name},
+            'step_status', status -> {job_step_name} ->> 'status'
+        )::text)
+        FROM updated
+    """
+
+
+class JobStatusBroker:
+    """Fan out job status notifications to the subscribers of a process.
+
+    A single connection listens to the job_status notifications, which are sent
+    by CRUDJob on every status transition. Each notification is put on the queue
+    of every subscriber of the job's user, and killed jobs running in the process
+    are cancelled. The streams of the subscribers are ended when the listener loses
+    its connection, as they would miss notifications.
+    """
+
+    def __init__(self, max_queue_size: int):
+        self.max_queue_size = max_queue_size
+        self.subscribers = {}
+        self.listener = NotificationListener(
+            JOB_STATUS_CHANNEL,
+            self.handle_notification,
+            on_connect=self.handle_connect,
+            on_disconnect=self.handle_disconnect,
+        )
+
+    @property
+    def connected(self):
+        return self.listener.connected
+
+    @contextmanager
+    def subscribe(self, user_id: UUID | str):
+        """Get a queue receiving the status notifications of a user's jobs.
+
+        None is put on the queue when the notifications are interrupted.
+        """
+
+        user_id = str(UUID(str(user_id)))
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers[user_id].discard(queue)
+            if not self.subscribers[user_id]:
+                del self.subscribers[user_id]
+
+    def handle_notification(self, connection, pid, channel, payload: str):
+        """Put a job status notification on the queues of its user."""
+
+        event = json.loads(payload)
+        job_cancellation.handle_event(event)
+        for queue in self.subscribers.get(event["user_id"], ()):
+            self.put(queue, event)
+
+    @staticmethod
+    def put(queue: asyncio.Queue, event: dict | None):
+        # Drop the oldest event of subscribers that can't keep up
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    async def handle_connect(self, connection):
+        """Cancel the jobs running in the process that were killed while not listening."""
+
+        job_ids = list(job_cancellation.jobs)
+        if not job_ids:
+            return
+        killed_jobs = await connection.fetch(
+            f"""
+            SELECT id::text
+            FROM {settings.CUSTOMER_SCHEMA}.job
+            WHERE id = ANY($1::uuid[])
+            AND status_simple = $2
+            """,
+            job_ids,
+            JobStatusType.killed.value,
+        )
+        for job in killed_jobs:
+            job_cancellation.cancel(job["id"])
+
+    def handle_disconnect(self):
+        """End the streams of the subscribers, which would miss notifications."""
+
+        for queues in self.subscribers.values():
+            for queue in queues:
+                self.put(queue, None)
+
+    def listen(self, dsn: str):
+        """Listen to the job_status notifications on a dedicated connection."""
+
+        self.listener.start(dsn)
+
+    async def close(self):
+        await self.listener.close()
+
+    def stats(self):
+        return {
+            "users": len(self.subscribers),
+            "subscribers": sum(len(queues) for queues in self.subscribers.values()),
+        }
+
+
+job_status_broker = JobStatusBroker(
+    max_queue_size=settings.JOB_STATUS_EVENTS_MAX_QUEUE_SIZE
+)
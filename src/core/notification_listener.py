@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+import asyncpg
+
+from src.core.config import settings
+
+listener_logger = logging.getLogger("Notification listener")
+
+
+class NotificationListener:
+    """Listener of a notification channel on a dedicated connection.
+
+    The connection is opened in the background and reopened with an exponential
+    backoff when it is lost or stops responding. Notifications sent while the
+    listener is not connected are missed, so on_connect is called with the new
+    connection on every connect to catch up and on_disconnect when it is lost.
+    """
+
+    def __init__(
+        self,
+        channel: str,
+        callback,
+        on_connect=None,
+        on_disconnect=None,
+        min_backoff: float = 1.0,
+        max_backoff: float = None,
+        check_interval: float = None,
+    ):
+        self.channel = channel
+        self.callback = callback
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff or settings.NOTIFICATION_LISTENER_MAX_BACKOFF
+        self.check_interval = (
+            check_interval or settings.NOTIFICATION_LISTENER_CHECK_INTERVAL
+        )
+        self.connection = None
+        self.task = None
+        self.disconnects = 0
+
+    @property
+    def connected(self):
+        return self.connection is not None and not self.connection.is_closed()
+
+    @property
+    def interrupted(self):
+        """Whether the listener was started but is not connected."""
+
+        return self.task is not None and not self.connected
+
+    def start(self, dsn: str):
+        """Start listening in the background."""
+
+        if self.task is None:
+            self.task = asyncio.create_task(self.run(dsn))
+
+    async def connect(self, dsn: str, terminated: asyncio.Event):
+        self.connection = await asyncpg.connect(dsn)
+        self.connection.add_termination_listener(lambda _: terminated.set())
+        await self.connection.add_listener(self.channel, self.callback)
+        if self.on_connect is not None:
+            await self.on_connect(self.connection)
+
+    async def wait_terminated(self, terminated: asyncio.Event):
+        """Wait until the connection is terminated or fails a check."""
+
+        while True:
+            try:
+                await asyncio.wait_for(terminated.wait(), timeout=self.check_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await asyncio.wait_for(
+                    self.connection.execute("SELECT 1"), timeout=self.check_interval
+                )
+            except Exception as e:
+                listener_logger.warning(f"Check of {self.channel} failed: {e}")
+                return
+
+    async def run(self, dsn: str):
+        backoff = self.min_backoff
+        while True:
+            terminated = asyncio.Event()
+            try:
+                await self.connect(dsn, terminated)
+            except Exception as e:
+                listener_logger.warning(
+                    f"Could not listen to {self.channel}, retrying in {backoff} seconds: {e}"
+                )
+                self.terminate_connection()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = self.min_backoff
+            await self.wait_terminated(terminated)
+            listener_logger.warning(f"Lost the connection listening to {self.channel}.")
+            self.terminate_connection()
+            self.disconnects += 1
+            if self.on_disconnect is not None:
+                self.on_disconnect()
+
+    def terminate_connection(self):
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.terminate()
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
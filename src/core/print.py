@@ -4,7 +4,6 @@ import random
 from typing import Dict, List, Union
 from urllib.parse import quote
 
-import aiohttp
 import matplotlib.pyplot as plt
 import pandas as pd
 from cairosvg import svg2png
@@ -15,6 +14,7 @@ from shapely import from_wkb
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.config import settings
+from src.core.http_client import get_http_client
 from src.db.models import Project
 from src.db.models.layer import Layer, LayerType
 from src.schemas.layer import FeatureType
@@ -236,40 +236,40 @@ class PrintMap:
                     }
                 )
 
-        async with aiohttp.ClientSession() as session:
-            # for marker in layer.properties.get("marker"):
-            for marker in markers:
-                icon_url = marker["url"]
-                icon_name = marker["name"]
-                try:
-                    header = (
-                        {"Content-Type": "image/svg+xml"}
-                        if icon_url.endswith(".svg")
-                        else {"Content-Type": "image/png"}
+        http_client = get_http_client()
+        # for marker in layer.properties.get("marker"):
+        for marker in markers:
+            icon_url = marker["url"]
+            icon_name = marker["name"]
+            try:
+                header = (
+                    {"Content-Type": "image/svg+xml"}
+                    if icon_url.endswith(".svg")
+                    else {"Content-Type": "image/png"}
+                )
+                # Get icon
+                response = await http_client.get(icon_url, headers=header)
+                icon = response.content
+
+                # If icon is svg convert to png
+                if icon_url.endswith(".svg"):
+                    icon = svg2png(
+                        bytestring=icon,
+                        output_height=marker_size,
+                        output_width=marker_size,
                     )
-                    # Get icon
-                    response = await session.get(icon_url, headers=header)
-                    icon = await response.read()
-
-                    # If icon is svg convert to png
-                    if icon_url.endswith(".svg"):
-                        icon = svg2png(
-                            bytestring=icon,
-                            output_height=marker_size,
-                            output_width=marker_size,
-                        )
-                    elif not icon_url.endswith(".png"):
-                        raise ValueError("Invalid icon type.")
-                    # Save image to local dir
-                    with open(f"{icon_name}.png", "wb") as f:
-                        f.write(icon)
-                    # # Open the image and get raw pixel data
-                    image = Image.open(io.BytesIO(icon))
-                    icon = image.tobytes()
-                    # Add icon to map
-                    map.addImage(icon_name, icon, marker_size, marker_size, 1.0, True)
-                except Exception as e:
-                    print(f"Error while adding icon to map: {e}")
+                elif not icon_url.endswith(".png"):
+                    raise ValueError("Invalid icon type.")
+                # Save image to local dir
+                with open(f"{icon_name}.png", "wb") as f:
+                    f.write(icon)
+                # # Open the image and get raw pixel data
+                image = Image.open(io.BytesIO(icon))
+                icon = image.tobytes()
+                # Add icon to map
+                map.addImage(icon_name, icon, marker_size, marker_size, 1.0, True)
+            except Exception as e:
+                print(f"Error while adding icon to map: {e}")
         return map
 
     async def create_layer_thumbnail(self, layer: Layer, file_name: str) -> str:
@@ -390,6 +390,7 @@ class PrintMap:
         # Request in recursive loop if layer was already added in geoapi if it does not fail the layer was added
         header = {"Content-Type": "application/json"}
         await async_get_with_retry(
+            http_client=get_http_client(),
             url=f"{settings.GOAT_GEOAPI_HOST}/collections/" + collection_id,
             headers=header,
             num_retries=10,
@@ -559,6 +560,7 @@ class PrintMap:
                 # Request in recursive loop if layer was already added in geoapi if it does not fail the layer was added
                 header = {"Content-Type": "application/json"}
                 await async_get_with_retry(
+                    http_client=get_http_client(),
                     url=f"{settings.GOAT_GEOAPI_HOST}/collections/" + collection_id,
                     headers=header,
                     num_retries=10,
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import mmap
+import os
+import uuid
+
+from src.core.config import settings
+from src.utils import decode_r5_grid
+
+
+class R5GridCache:
+    """Disk cache for R5 travel time grids keyed on the hash of the request payload.
+
+    Cached grids are stored as raw ACCESSGR bytes, one file per request. The least
+    recently used grids are evicted once the size of the cache exceeds its limit.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return bool(self.max_size)
+
+    def get_key(self, request_payload: dict) -> str:
+        """Hash the normalized request payload."""
+
+        normalized_payload = json.dumps(
+            request_payload, sort_keys=True, separators=(",", ":"), default=str
+        )
+        return hashlib.sha256(normalized_payload.encode()).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def get(self, key: str):
+        """Return the path of the cached grid or None if it is not cached."""
+
+        if not self.enabled:
+            return None
+
+        path = self.get_path(key)
+        try:
+            # Mark the grid as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key: str, grid_data: bytes):
+        """Store a grid and return its path, None if the cache is disabled."""
+
+        if not self.enabled:
+            return None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.get_path(key)
+        # Write to a temporary file first as other workers might read the grid
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, mode="wb") as file:
+            file.write(grid_data)
+        os.replace(temp_path, path)
+
+        self.evict()
+        return path
+
+    def evict(self):
+        """Delete the least recently used grids until the cache is below its limit."""
+
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def stats(self):
+        """Return the hit and miss counters and the current size of the cache."""
+
+        entries = 0
+        size = 0
+        if os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".bin"):
+                    entries += 1
+                    size += entry.stat().st_size
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+        }
+
+
+def read_r5_grid(grid_data, percentile: int = None):
+    """Decode an R5 grid from bytes or from a cached file using a memory map."""
+
+    if not isinstance(grid_data, str):
+        return decode_r5_grid(grid_data, percentile=percentile)
+
+    with open(grid_data, mode="rb") as file:
+        grid_buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return decode_r5_grid(grid_buffer, percentile=percentile)
+
+
+r5_grid_cache = R5GridCache(
+    cache_dir=settings.R5_CACHE_DIR, max_size=settings.R5_CACHE_MAX_SIZE
+)
@@ -0,0 +1,121 @@
+import asyncio
+import math
+import time
+
+import numpy as np
+import shapely
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.core.job import background_logger
+
+EARTH_RADIUS = 6371008.8  # Mean earth radius in meters
+
+
+def get_r5_bounds(lat: float, lon: float, buffer_distance: float = 100000) -> dict:
+    """Compute the bounds of the R5 analysis around a starting point.
+
+    The bounds are the envelope of a geodesic buffer (spherical cap) of the given
+    distance around the starting point.
+    """
+
+    angular_distance = buffer_distance / EARTH_RADIUS
+    delta_lat = math.degrees(angular_distance)
+    delta_lon = math.degrees(
+        math.asin(
+            min(1.0, math.sin(angular_distance) / math.cos(math.radians(lat)))
+        )
+    )
+    return {
+        "north": min(lat + delta_lat, 90.0),
+        "south": max(lat - delta_lat, -90.0),
+        "east": lon + delta_lon,
+        "west": lon - delta_lon,
+    }
+
+
+class R5RegionIndex:
+    """Process-local spatial index of the R5 region mapping table.
+
+    The index is loaded on first use and reloaded once it is older than
+    R5_REGION_MAPPING_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self, table_name: str, refresh_interval: int):
+        self.table_name = table_name
+        self.refresh_interval = refresh_interval
+        self.tree = None
+        self.regions = []
+        self.loaded_at = None
+        self.lock = asyncio.Lock()
+
+    @property
+    def is_stale(self):
+        return (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > self.refresh_interval
+        )
+
+    async def load(self, async_session: AsyncSession):
+        """Load the region mapping table into the index."""
+
+        sql_get_region_mapping = f"""
+            SELECT r5_region_id, r5_bundle_id, r5_host, ST_AsBinary(geom)
+            FROM {self.table_name}
+            WHERE geom IS NOT NULL
+            ORDER BY r5_region_id;
+        """
+        result = (await async_session.execute(sql_get_region_mapping)).fetchall()
+        self.set_regions(
+            regions=[
+                {"r5_region_id": row[0], "r5_bundle_id": row[1], "r5_host": row[2]}
+                for row in result
+            ],
+            geometries=shapely.from_wkb([bytes(row[3]) for row in result]),
+        )
+
+    def set_regions(self, regions: list, geometries: list):
+        """Replace the regions of the index."""
+
+        self.regions = regions
+        self.tree = shapely.STRtree(geometries)
+        self.loaded_at = time.monotonic()
+
+    def query(self, lats: list, lons: list):
+        """Get the region of all starting points, None if any point is not covered."""
+
+        points = shapely.points(lons, lats)
+        point_idx, region_idx = self.tree.query(points, predicate="intersects")
+        if len(np.unique(point_idx)) != len(points):
+            return None
+
+        # Take the first matching region of each point
+        first_match = np.full(len(points), len(self.regions))
+        np.minimum.at(first_match, point_idx, region_idx)
+        return [self.regions[i] for i in first_match]
+
+    async def get_regions(self, async_session: AsyncSession, lats: list, lons: list):
+        """Get the region of all starting points, None if any point is not covered.
+
+        None is also returned if the index can't be loaded, so that the regions are
+        looked up in the database instead.
+        """
+
+        if self.is_stale:
+            async with self.lock:
+                if self.is_stale:
+                    try:
+                        await self.load(async_session)
+                    except Exception as e:
+                        background_logger.warning(
+                            f"Could not load the R5 region mapping: {str(e)}"
+                        )
+                        return None
+
+        return self.query(lats, lons)
+
+
+r5_region_index = R5RegionIndex(
+    table_name=settings.REGION_MAPPING_PT_TABLE,
+    refresh_interval=settings.R5_REGION_MAPPING_REFRESH_INTERVAL,
+)
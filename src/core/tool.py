@@ -1,6 +1,8 @@
 from typing import List
 from uuid import UUID
 
+import numpy as np
+import shapely
 from fastapi import BackgroundTasks
 from fastapi_pagination import Params as PaginationParams
 from httpx import AsyncClient
@@ -148,6 +150,9 @@ def get_statistics_sql(field, operation):
 
 
 class CRUDToolBase(CRUDFailedJob):
+    # Record the resources used by the jobs of the tool if job profiling is enabled
+    profiling = True
+
     def __init__(self, job_id, background_tasks, async_session, user_id, project_id):
         super().__init__(job_id, background_tasks, async_session, user_id)
         self.project_id = project_id
@@ -754,3 +759,158 @@ class CRUDToolBase(CRUDFailedJob):
         await self.async_session.execute(sql_temp_geometry_layer)
         await self.async_session.commit()
         return temp_geometry_layer
+
+    async def copy_records_to_table(self, table: str, columns: List[str], records):
+        """Stream records into a table using binary COPY."""
+
+        connection = await self.async_session.connection()
+        raw_connection = await connection.get_raw_connection()
+        schema_name, table_name = table.split(".")
+        await raw_connection.driver_connection.copy_records_to_table(
+            table_name,
+            schema_name=schema_name,
+            columns=columns,
+            records=records,
+        )
+
+    async def insert_geometries(
+        self,
+        result_table: str,
+        layer_id: str,
+        geometries: List,
+        attributes: dict = {},
+    ):
+        """Bulk insert geometries computed in Python into a user data table.
+
+        The geometries are validated client-side and streamed as WKB through a binary
+        COPY into a staging table from which they are inserted into the result table.
+        The attributes map column names of the result table to a list of values.
+        """
+
+        # Validate geometries client-side instead of using ST_MakeValid
+        geometries = np.asarray(geometries, dtype=object)
+        invalid = ~shapely.is_valid(geometries)
+        if invalid.any():
+            geometries[invalid] = shapely.make_valid(geometries[invalid])
+        wkb = shapely.to_wkb(geometries).tolist()
+
+        # Create staging table with the same column types as the result table
+        staging_table = await self.create_temp_table_name("geometries")
+        columns = list(attributes.keys())
+        columns_string = "".join([f", {column}" for column in columns])
+        await self.async_session.execute(
+            f"""
+            CREATE TABLE {staging_table} AS
+            SELECT layer_id, geom::bytea AS geom{columns_string}
+            FROM {result_table}
+            WITH NO DATA;
+            """
+        )
+        await self.async_session.commit()
+
+        try:
+            # Stream the records into the staging table using binary COPY
+            await self.copy_records_to_table(
+                table=staging_table,
+                columns=["layer_id", "geom"] + columns,
+                records=zip(
+                    [str(layer_id)] * len(wkb),
+                    wkb,
+                    *[np.asarray(values).tolist() for values in attributes.values()],
+                    strict=True,
+                ),
+            )
+
+            # Move the records to the result table
+            await self.async_session.execute(
+                f"""
+                INSERT INTO {result_table} (layer_id, geom{columns_string})
+                SELECT layer_id, ST_SetSRID(ST_GeomFromWKB(geom), 4326){columns_string}
+                FROM {staging_table};
+                """
+            )
+        finally:
+            # Drop the staging table also if the insert failed or the job was killed
+            await self.async_session.execute(f"DROP TABLE IF EXISTS {staging_table};")
+            await self.async_session.commit()
+
+    async def insert_h3_cells(
+        self,
+        result_table: str,
+        layer_id: str,
+        h3_indexes: List[int],
+        attributes: dict = {},
+        resolution: int | None = None,
+        missing_cells_are_zero: bool = True,
+    ):
+        """Bulk insert h3 cells computed in Python into a user data table.
+
+        The h3 indexes are streamed through a binary COPY into a staging table. The
+        cell boundaries are created when inserting into the result table and the h3
+        index is stored in text_attr1. If a coarser resolution is passed, the cells
+        are rolled up to their parents at this resolution with the mean attributes
+        over all children of a parent, so children without a value count as zero.
+        Otherwise the mean only covers the children with a value.
+        """
+
+        # Create staging table with the same column types as the result table
+        staging_table = await self.create_temp_table_name("cells")
+        columns = list(attributes.keys())
+        columns_string = "".join([f", {column}" for column in columns])
+        await self.async_session.execute(
+            f"""
+            CREATE TABLE {staging_table} AS
+            SELECT layer_id, 0::bigint AS h3_index{columns_string}
+            FROM {result_table}
+            WITH NO DATA;
+            """
+        )
+        await self.async_session.commit()
+
+        # Stream the records into the staging table using binary COPY
+        await self.copy_records_to_table(
+            table=staging_table,
+            columns=["layer_id", "h3_index"] + columns,
+            records=zip(
+                [str(layer_id)] * len(h3_indexes),
+                np.asarray(h3_indexes, dtype=np.int64).tolist(),
+                *[np.asarray(values).tolist() for values in attributes.values()],
+                strict=True,
+            ),
+        )
+
+        # Move the records to the result table
+        if resolution is None:
+            await self.async_session.execute(
+                f"""
+                INSERT INTO {result_table} (layer_id, geom, text_attr1{columns_string})
+                SELECT layer_id,
+                    ST_SetSRID(h3_cell_to_boundary(h3_index::h3index)::geometry, 4326),
+                    h3_index::h3index{columns_string}
+                FROM {staging_table};
+                """
+            )
+        else:
+            children_size = f"h3_cell_to_children_size(h3_cell_to_parent(h3_index::h3index, {resolution}), MIN(h3_get_resolution(h3_index::h3index)))"
+            mean_columns_string = "".join(
+                [
+                    (
+                        f", SUM({column}) / {children_size}"
+                        if missing_cells_are_zero
+                        else f", AVG({column})"
+                    )
+                    for column in columns
+                ]
+            )
+            await self.async_session.execute(
+                f"""
+                INSERT INTO {result_table} (layer_id, geom, text_attr1{columns_string})
+                SELECT layer_id,
+                    ST_SetSRID(h3_cell_to_boundary(h3_cell_to_parent(h3_index::h3index, {resolution}))::geometry, 4326),
+                    h3_cell_to_parent(h3_index::h3index, {resolution}){mean_columns_string}
+                FROM {staging_table}
+                GROUP BY layer_id, h3_cell_to_parent(h3_index::h3index, {resolution});
+                """
+            )
+        await self.async_session.execute(f"DROP TABLE IF EXISTS {staging_table};")
+        await self.async_session.commit()
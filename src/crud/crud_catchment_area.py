@@ -1,19 +1,27 @@
 import asyncio
+import weakref
 from uuid import UUID
 
+import numpy as np
 from httpx import AsyncClient
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.config import settings
 from src.core.job import job_init, job_log, run_background_or_immediately
+from src.core.r5_cache import r5_grid_cache
+from src.core.r5_region import get_r5_bounds, r5_region_index
 from src.core.tool import CRUDToolBase
-from src.jsoline import generate_jsolines
+from src.jsoline import (
+    async_generate_grid_from_r5_grid,
+    async_generate_jsolines_from_r5_grid,
+)
 from src.schemas.catchment_area import (
     CatchmentAreaNearbyStationAccess,
     CatchmentAreaRoutingModeActiveMobility,
     CatchmentAreaRoutingModeCar,
     CatchmentAreaTravelTimeCostActiveMobility,
     CatchmentAreaTravelTimeCostMotorizedMobility,
+    CatchmentAreaTypePT,
     ICatchmentAreaActiveMobility,
     ICatchmentAreaCar,
     ICatchmentAreaPT,
@@ -31,7 +39,10 @@ from src.schemas.toolbox_base import (
     CatchmentAreaGeometryTypeMapping,
     DefaultResultLayerName,
 )
-from src.utils import decode_r5_grid, format_value_null_sql
+from src.utils import format_value_null_sql, poll_endpoint
+
+# Semaphores of the R5 hosts per event loop, as semaphores are bound to their loop
+r5_semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
 
 
 async def call_routing_endpoint(
@@ -39,39 +50,41 @@ async def call_routing_endpoint(
     request_payload: dict,
     http_client: AsyncClient,
 ):
+    # Call GOAT Routing endpoint to compute catchment area
+    url = (
+        f"{settings.GOAT_ROUTING_URL}/active-mobility/catchment-area"
+        if type(routing_mode) == CatchmentAreaRoutingModeActiveMobility
+        else f"{settings.GOAT_ROUTING_URL}/motorized-mobility/catchment-area"
+    )
     try:
-        # Call GOAT Routing endpoint multiple times for upto 20 seconds / 10 retries
-        for i in range(settings.CRUD_NUM_RETRIES):
-            # Call GOAT Routing endpoint to compute catchment area
-            url = (
-                f"{settings.GOAT_ROUTING_URL}/active-mobility/catchment-area"
-                if type(routing_mode) == CatchmentAreaRoutingModeActiveMobility
-                else f"{settings.GOAT_ROUTING_URL}/motorized-mobility/catchment-area"
-            )
-            response = await http_client.post(
+        # Poll GOAT Routing endpoint until it has finished processing the request
+        response = await poll_endpoint(
+            request=lambda: http_client.post(
                 url=url,
                 json=request_payload,
                 headers={"Authorization": settings.GOAT_ROUTING_AUTHORIZATION},
-            )
-            if response.status_code == 202:
-                # Endpoint is still processing request, retry shortly
-                if i == settings.CRUD_NUM_RETRIES - 1:
-                    raise Exception(
-                        "GOAT routing endpoint took too long to process request."
-                    )
-                await asyncio.sleep(settings.CRUD_RETRY_INTERVAL)
-                continue
-            elif response.status_code == 201:
-                # Endpoint has finished processing request, break
-                break
-            else:
-                raise Exception(response.text)
+            ),
+            endpoint="goat_routing",
+        )
+        if response.status_code != 201:
+            raise Exception(response.text)
     except Exception as e:
         raise RoutingEndpointError(
             f"Error while calling the routing endpoint: {str(e)}"
         )
 
 
+def get_r5_semaphore(r5_host: str) -> asyncio.Semaphore:
+    """Returns the semaphore bounding the number of parallel requests to an R5 host."""
+
+    semaphores = r5_semaphores.setdefault(asyncio.get_running_loop(), {})
+    if r5_host not in semaphores:
+        semaphores[r5_host] = asyncio.Semaphore(
+            settings.R5_MAX_PARALLEL_REQUESTS_PER_HOST
+        )
+    return semaphores[r5_host]
+
+
 async def create_temp_isochrone_table(async_session: AsyncSession, job_id: UUID):
     try:
         # Create result table to store catchment area geometry
@@ -365,35 +378,224 @@ class CRUDCatchmentAreaPT(CRUDCatchmentAreaBase):
 
         self.http_client = http_client
 
+    async def get_r5_regions(self, lats: list, lons: list):
+        """Get the R5 region, bundle, host and region bounds for all starting points."""
+
+        # Look up the regions in the in-memory index of the region mapping table
+        regions = await r5_region_index.get_regions(self.async_session, lats, lons)
+
+        if regions is None:
+            # Fall back to the database in case the index is not up to date
+            sql_get_r5_regions = f"""
+                SELECT r.r5_region_id, r.r5_bundle_id, r.r5_host
+                FROM UNNEST(ARRAY{str(lons)}::float8[], ARRAY{str(lats)}::float8[])
+                    WITH ORDINALITY AS p(lon, lat, idx)
+                LEFT JOIN LATERAL (
+                    SELECT r5_region_id, r5_bundle_id, r5_host
+                    FROM {settings.REGION_MAPPING_PT_TABLE}
+                    WHERE ST_INTERSECTS(
+                        ST_SETSRID(ST_MAKEPOINT(p.lon, p.lat), 4326),
+                        ST_SetSRID(geom, 4326)
+                    )
+                    LIMIT 1
+                ) r ON TRUE
+                ORDER BY p.idx;
+            """
+            result = await self.async_session.execute(sql_get_r5_regions)
+            regions = []
+            for r5_region_id, r5_bundle_id, r5_host in result.fetchall():
+                if r5_region_id is None:
+                    raise OutOfGeofenceError(
+                        "There are starting points that are not within a supported public transport region."
+                    )
+                regions.append(
+                    {
+                        "r5_region_id": r5_region_id,
+                        "r5_bundle_id": r5_bundle_id,
+                        "r5_host": r5_host,
+                    }
+                )
+
+        # TODO Compute buffer distance dynamically?
+        return [
+            region | {"bounds": get_r5_bounds(lat, lon)}
+            for region, lat, lon in zip(regions, lats, lons, strict=True)
+        ]
+
+    def build_r5_request_payload(
+        self, params: ICatchmentAreaPT, lat: float, lon: float, region: dict
+    ):
+        """Build the R5 request payload for a single starting point."""
+
+        return {
+            "accessModes": params.routing_type.access_mode.value.upper(),
+            "transitModes": ",".join(params.routing_type.mode).upper(),
+            "bikeSpeed": params.bike_speed,
+            "walkSpeed": params.walk_speed,
+            "bikeTrafficStress": params.bike_traffic_stress,
+            "date": params.time_window.weekday_date,
+            "fromTime": params.time_window.from_time,
+            "toTime": params.time_window.to_time,
+            "maxTripDurationMinutes": params.travel_cost.max_traveltime,
+            "decayFunction": {
+                "type": "logistic",
+                "standard_deviation_minutes": params.decay_function.standard_deviation_minutes,
+                "width_minutes": params.decay_function.width_minutes,
+            },
+            "destinationPointSetIds": [],
+            "bounds": region["bounds"],
+            "directModes": params.routing_type.access_mode.value.upper(),
+            "egressModes": params.routing_type.egress_mode.value.upper(),
+            "fromLat": lat,
+            "fromLon": lon,
+            "zoom": params.zoom,
+            "maxBikeTime": params.max_bike_time,
+            "maxRides": params.max_rides,
+            "maxWalkTime": params.max_walk_time,
+            "monteCarloDraws": params.monte_carlo_draws,
+            "percentiles": params.percentiles,
+            "variantIndex": settings.R5_VARIANT_INDEX,
+            "workerVersion": settings.R5_WORKER_VERSION,
+            "regionId": region["r5_region_id"],
+            "projectId": region["r5_region_id"],
+            "bundleId": region["r5_bundle_id"],
+        }
+
+    async def call_r5_endpoint(self, r5_host: str, request_payload: dict) -> bytes:
+        """Call the R5 endpoint and wait until the travel time grid is computed."""
+
+        try:
+            # Poll R5 endpoint until it has finished processing the request
+            response = await poll_endpoint(
+                request=lambda: self.http_client.post(
+                    url=f"{r5_host}/api/analysis",
+                    json=request_payload,
+                    headers={"Authorization": settings.R5_AUTHORIZATION},
+                ),
+                endpoint="r5",
+            )
+            if response.status_code != 200:
+                raise Exception(response.text)
+            return response.content
+        except Exception as e:
+            raise R5EndpointError(f"Error while calling the R5 endpoint: {str(e)}")
+
+    async def request_r5_grid(self, region: dict, request_payload: dict) -> bytes:
+        """Request the travel time grid of a starting point from its R5 host."""
+
+        # Limit the number of concurrent requests sent to the same R5 host
+        async with get_r5_semaphore(region["r5_host"]):
+            return await self.call_r5_endpoint(region["r5_host"], request_payload)
+
+    async def process_r5_grid(self, params: ICatchmentAreaPT, grid_data: bytes | str):
+        """Decode a travel time grid and compute its jsolines or grid cells.
+
+        A FileNotFoundError is raised if a cached grid was evicted before it was read.
+        """
+
+        try:
+            # Decode R5 response data & convert it to valid catchment area geometry
+            if params.catchment_area_type == CatchmentAreaTypePT.rectangular_grid:
+                return await async_generate_grid_from_r5_grid(
+                    grid_data_buffer=grid_data,
+                    travel_time=params.travel_cost.max_traveltime,
+                    percentile=5,
+                )
+            return await async_generate_jsolines_from_r5_grid(
+                grid_data_buffer=grid_data,
+                travel_time=params.travel_cost.max_traveltime,
+                percentile=5,
+                steps=params.travel_cost.steps,
+                polygon_difference=params.polygon_difference,
+            )
+        except FileNotFoundError:
+            if isinstance(grid_data, str):
+                raise
+            raise R5CatchmentAreaComputeError(
+                "Error while processing R5 catchment area grid: file not found"
+            )
+        except Exception as e:
+            raise R5CatchmentAreaComputeError(
+                f"Error while processing R5 catchment area grid: {str(e)}"
+            )
+
+    async def compute_starting_point(
+        self, params: ICatchmentAreaPT, lat: float, lon: float, region: dict
+    ):
+        """Compute the travel time grid and jsolines for a single starting point.
+
+        For the grid catchment area type the grid cells are returned instead of the
+        jsolines.
+        """
+
+        request_payload = self.build_r5_request_payload(params, lat, lon, region)
+
+        # Skip R5 if the travel time grid of an identical request is cached
+        cache_key = r5_grid_cache.get_key(request_payload)
+        result = r5_grid_cache.get(cache_key)
+        if result is None:
+            result = await self.request_r5_grid(region, request_payload)
+            if r5_grid_cache.enabled:
+                try:
+                    result = await asyncio.to_thread(
+                        r5_grid_cache.put, cache_key, result
+                    )
+                except OSError:
+                    # Continue without caching if the grid cannot be written to disk
+                    pass
+
+        try:
+            return await self.process_r5_grid(params, result)
+        except FileNotFoundError:
+            # The cached grid was evicted by another job before it was read
+            result = await self.request_r5_grid(region, request_payload)
+            return await self.process_r5_grid(params, result)
+
     async def write_catchment_area_result(
         self,
         catchment_area_type,
         layer_id,
         result_table,
-        shapes,
-        grid,
+        results,
         polygon_difference,
     ):
-        """Save the result of the catchment area computation to the database."""
+        """Save the results of the catchment area computation to the database."""
 
         if catchment_area_type == "polygon":
-            # Save catchment area geometry data (shapes)
-            shapes = shapes["incremental"] if polygon_difference else shapes["full"]
-            shapes_sorted = []
-            for i in shapes.index:
-                shapes_sorted.append((shapes["geometry"][i], shapes["minute"][i]))
-            shapes_sorted = sorted(shapes_sorted, key=lambda x: x[1], reverse=True)
-            insert_string = ""
-            for shape in shapes_sorted:
-                insert_string += f"('{layer_id}', ST_MakeValid(ST_SetSRID(ST_GeomFromText('{shape[0]}'), 4326)), {shape[1]}),"
-            insert_string = f"""
-                INSERT INTO {result_table} (layer_id, geom, integer_attr1)
-                VALUES {insert_string.rstrip(",")};
-            """
-            await self.async_session.execute(insert_string)
+            # Save catchment area geometry data (shapes) of all starting points
+            geometries = []
+            minutes = []
+            for result_shapes in results:
+                result_shapes = (
+                    result_shapes["incremental"]
+                    if polygon_difference
+                    else result_shapes["full"]
+                )
+                result_shapes = result_shapes.sort_values("minute", ascending=False)
+                geometries.extend(result_shapes["geometry"])
+                minutes.extend(np.floor(result_shapes["minute"] + 0.5).astype(int))
+            await self.insert_geometries(
+                result_table=result_table,
+                layer_id=layer_id,
+                geometries=geometries,
+                attributes={"integer_attr1": minutes},
+            )
         else:
-            # Save catchment area grid data
-            pass
+            # Save catchment area grid data (cells) of all starting points. The cells
+            # keep their geometry as the layer is rendered as vector tiles from the
+            # user data table and used as input of other tools like any feature layer
+            await self.insert_geometries(
+                result_table=result_table,
+                layer_id=layer_id,
+                geometries=[
+                    geometry for grid in results for geometry in grid["geometry"]
+                ],
+                attributes={
+                    "integer_attr1": [
+                        minute for grid in results for minute in grid["minute"]
+                    ]
+                },
+            )
 
     @job_log(job_step_name="catchment_area")
     async def catchment_area(
@@ -423,160 +625,50 @@ class CRUDCatchmentAreaPT(CRUDCatchmentAreaBase):
         )
         result_table = f"{settings.USER_DATA_SCHEMA}.{layer_catchment_area.feature_layer_geometry_type.value}_{str(self.user_id).replace('-', '')}"
 
-        # Compute catchment area for each starting point
-        for i in range(0, len(lats)):
-            # Identify relevant R5 region & bundle for this catchment area starting point
-            sql_get_region_mapping = f"""
-                SELECT r5_region_id, r5_bundle_id, r5_host
-                FROM {settings.REGION_MAPPING_PT_TABLE}
-                WHERE ST_INTERSECTS(
-                    ST_SETSRID(
-                        ST_MAKEPOINT(
-                            {lons[i]},
-                            {lats[i]}
-                        ),
-                        4326
-                    ),
-                    ST_SetSRID(geom, 4326)
-                );
-            """
-            r5_region_id, r5_bundle_id, r5_host = (
-                await self.async_session.execute(sql_get_region_mapping)
-            ).fetchall()[0]
-
-            # Get relevant region bounds for this starting point
-            # TODO Compute buffer distance dynamically?
-            sql_get_region_bounds = f"""
-                SELECT ST_XMin(b.geom), ST_YMin(b.geom), ST_XMax(b.geom), ST_YMax(b.geom)
-                FROM (
-                    SELECT ST_Envelope(
-                        ST_Buffer(
-                            ST_SetSRID(
-                                ST_MakePoint(
-                                    {lons[i]},
-                                    {lats[i]}),
-                                4326
-                            )::geography,
-                            100000
-                        )::geometry
-                    ) AS geom
-                ) b;
-            """
-            xmin, ymin, xmax, ymax = (
-                await self.async_session.execute(sql_get_region_bounds)
-            ).fetchall()[0]
-
-            # Construct request payload
-            request_payload = {
-                "accessModes": params.routing_type.access_mode.value.upper(),
-                "transitModes": ",".join(params.routing_type.mode).upper(),
-                "bikeSpeed": params.bike_speed,
-                "walkSpeed": params.walk_speed,
-                "bikeTrafficStress": params.bike_traffic_stress,
-                "date": params.time_window.weekday_date,
-                "fromTime": params.time_window.from_time,
-                "toTime": params.time_window.to_time,
-                "maxTripDurationMinutes": params.travel_cost.max_traveltime,
-                "decayFunction": {
-                    "type": "logistic",
-                    "standard_deviation_minutes": params.decay_function.standard_deviation_minutes,
-                    "width_minutes": params.decay_function.width_minutes,
-                },
-                "destinationPointSetIds": [],
-                "bounds": {
-                    "north": ymax,
-                    "south": ymin,
-                    "east": xmax,
-                    "west": xmin,
-                },
-                "directModes": params.routing_type.access_mode.value.upper(),
-                "egressModes": params.routing_type.egress_mode.value.upper(),
-                "fromLat": lats[i],
-                "fromLon": lons[i],
-                "zoom": params.zoom,
-                "maxBikeTime": params.max_bike_time,
-                "maxRides": params.max_rides,
-                "maxWalkTime": params.max_walk_time,
-                "monteCarloDraws": params.monte_carlo_draws,
-                "percentiles": params.percentiles,
-                "variantIndex": settings.R5_VARIANT_INDEX,
-                "workerVersion": settings.R5_WORKER_VERSION,
-                "regionId": r5_region_id,
-                "projectId": r5_region_id,
-                "bundleId": r5_bundle_id,
-            }
-
-            result = None
-            try:
-                # Call R5 endpoint multiple times for upto 20 seconds / 10 retries
-                for i in range(settings.CRUD_NUM_RETRIES):
-                    # Call R5 endpoint to compute catchment area
-                    response = await self.http_client.post(
-                        url=f"{r5_host}/api/analysis",
-                        json=request_payload,
-                        headers={"Authorization": settings.R5_AUTHORIZATION},
-                    )
-                    if response.status_code == 202:
-                        # Engine is still processing request, retry shortly
-                        if i == settings.CRUD_NUM_RETRIES - 1:
-                            raise Exception(
-                                "R5 engine took too long to process request."
-                            )
-                        await asyncio.sleep(settings.CRUD_RETRY_INTERVAL)
-                        continue
-                    elif response.status_code == 200:
-                        # Engine has finished processing request, break
-                        result = response.content
-                        break
-                    else:
-                        raise Exception(response.text)
-            except Exception as e:
-                raise R5EndpointError(f"Error while calling the R5 endpoint: {str(e)}")
-
-            catchment_area_grid = None
-            catchment_area_shapes = None
-            try:
-                # Decode R5 response data
-                catchment_area_grid = decode_r5_grid(result)
-
-                # Convert grid data returned by R5 to valid catchment area geometry
-                catchment_area_shapes = generate_jsolines(
-                    grid=catchment_area_grid,
-                    travel_time=params.travel_cost.max_traveltime,
-                    percentile=5,
-                    steps=params.travel_cost.steps,
-                )
-            except Exception as e:
-                raise R5CatchmentAreaComputeError(
-                    f"Error while processing R5 catchment area grid: {str(e)}"
-                )
+        # Identify relevant R5 region, bundle & bounds for all starting points at once
+        regions = await self.get_r5_regions(lats, lons)
 
-            try:
-                # Save result to database
-                await self.write_catchment_area_result(
-                    catchment_area_type=params.catchment_area_type.value,
-                    layer_id=str(layer_catchment_area.id),
-                    result_table=result_table,
-                    shapes=catchment_area_shapes,
-                    grid=catchment_area_grid,
-                    polygon_difference=params.polygon_difference,
-                )
-            except Exception as e:
-                raise SQLError(
-                    f"Error while saving R5 catchment area result to database: {str(e)}"
-                )
+        # Compute catchment areas for all starting points concurrently
+        tasks = [
+            asyncio.create_task(
+                self.compute_starting_point(params, lats[i], lons[i], regions[i])
+            )
+            for i in range(len(lats))
+        ]
+        try:
+            results = await asyncio.gather(*tasks)
+        except BaseException:
+            # Abort the requests of the other starting points
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        try:
+            # Save results to database
+            await self.write_catchment_area_result(
+                catchment_area_type=params.catchment_area_type.value,
+                layer_id=str(layer_catchment_area.id),
+                result_table=result_table,
+                results=results,
+                polygon_difference=params.polygon_difference,
+            )
+        except Exception as e:
+            raise SQLError(
+                f"Error while saving R5 catchment area result to database: {str(e)}"
+            )
 
-            # Create new layers.
+        # Create new layers.
+        await self.create_feature_layer_tool(
+            layer_in=layer_catchment_area,
+            params=params,
+        )
+        # Create new layer if starting points are not a layer
+        if not params.starting_points.layer_project_id:
             await self.create_feature_layer_tool(
-                layer_in=layer_catchment_area,
+                layer_in=layer_starting_points,
                 params=params,
             )
-            # Create new layer if starting points are not a layer
-            if not params.starting_points.layer_project_id:
-                await self.create_feature_layer_tool(
-                    layer_in=layer_starting_points,
-                    params=params,
-                )
 
         return {
             "status": JobStatusType.finished.value,
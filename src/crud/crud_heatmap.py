@@ -1,16 +1,33 @@
+from typing import List
+from uuid import UUID
+
+from src.core.config import settings
+from src.core.heatmap import get_traveltime_matrix_version
+from src.core.heatmap_cache import heatmap_result_cache
 from src.core.tool import CRUDToolBase
 from src.crud.crud_layer_project import layer_project as crud_layer_project
+from src.schemas.error import UnsupportedLayerTypeError
 from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_INVERSE_TABLE,
+    TRAVELTIME_MATRIX_RESOLUTION,
+    TRAVELTIME_MATRIX_TABLE,
+    ActiveRoutingHeatmapType,
     IHeatmapClosestAverageActive,
     IHeatmapClosestAverageMotorized,
     IHeatmapConnectivityActive,
     IHeatmapConnectivityMotorized,
     IHeatmapGravityActive,
     IHeatmapGravityMotorized,
+    MotorizedRoutingHeatmapType,
 )
+from src.schemas.layer import FeatureGeometryType, LayerType
+from src.utils import format_h3_array_sql, format_value_null_sql
 
 
 class CRUDHeatmapBase(CRUDToolBase):
+    # Cells missing from the result have a value of zero when they are rolled up
+    missing_cells_are_zero = True
+
     def __init__(self, job_id, background_tasks, async_session, user_id, project_id):
         super().__init__(job_id, background_tasks, async_session, user_id, project_id)
 
@@ -53,6 +70,7 @@ class CRUDHeatmapBase(CRUDToolBase):
                     "table_name": layer_project.table_name,
                     "where_query": layer_project.where_query,
                     "geom_type": layer_project.feature_layer_geometry_type,
+                    "layer_id": layer_project.layer_id,
                     "layer": layer,
                 }
             )
@@ -65,3 +83,413 @@ class CRUDHeatmapBase(CRUDToolBase):
             ]
 
         return opportunity_layers, opportunity_geofence_layer
+
+    async def get_delta_result_layer(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+    ):
+        """Get the result layer of a previous run which is updated in delta mode."""
+
+        layer_project = await crud_layer_project.get_internal(
+            async_session=self.async_session,
+            id=params.delta.previous_result_id,
+            project_id=self.project_id,
+            expected_layer_types=[LayerType.feature],
+            expected_geometry_types=[FeatureGeometryType.polygon],
+        )
+        if layer_project.tool_type != params.tool_type:
+            raise UnsupportedLayerTypeError(
+                f"Layer {layer_project.name} is not a {params.tool_type.value} result layer"
+            )
+
+        # Cells rolled up to a coarser output resolution can't be updated in place
+        result = await self.async_session.execute(
+            f"""
+            SELECT h3_get_resolution(text_attr1::h3index)
+            FROM {layer_project.table_name}
+            WHERE layer_id = '{layer_project.layer_id}'
+            LIMIT 1;
+            """
+        )
+        resolution = result.scalar()
+        if (
+            resolution is not None
+            and resolution != TRAVELTIME_MATRIX_RESOLUTION[params.routing_type]
+        ):
+            raise UnsupportedLayerTypeError(
+                f"Layer {layer_project.name} has a coarser output resolution than the travel time matrix"
+            )
+        return layer_project
+
+    async def get_changed_cells(
+        self,
+        routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
+        h3_indexes: List[str],
+    ):
+        """Get the changed cells at the resolution of the travel time matrix."""
+
+        resolution = TRAVELTIME_MATRIX_RESOLUTION[routing_type]
+        h3_array = format_h3_array_sql(h3_indexes)
+        result = await self.async_session.execute(
+            f"""
+            SELECT DISTINCT h3_index::text,
+                basic.to_short_h3_3(h3_cell_to_parent(h3_index, 3)::bigint) AS h3_3
+            FROM (
+                SELECT h3_cell_to_parent(cell, {resolution}) AS h3_index
+                FROM UNNEST({h3_array}) cell
+                WHERE h3_get_resolution(cell) >= {resolution}
+                UNION ALL
+                SELECT h3_cell_to_children(cell, {resolution}) AS h3_index
+                FROM UNNEST({h3_array}) cell
+                WHERE h3_get_resolution(cell) < {resolution}
+            ) changed;
+            """
+        )
+        return result.fetchall()
+
+    async def get_affected_cells(
+        self,
+        routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
+        h3_indexes: List[str],
+        max_traveltime: int,
+    ):
+        """Get the cells reached from the changed cells within the max traveltime.
+
+        As the opportunities are the origins of the travel time matrix, these are the
+        only cells whose accessibility can change when opportunities are edited.
+        """
+
+        changed_cells = await self.get_changed_cells(routing_type, h3_indexes)
+        h3_3 = ",".join(sorted({str(cell[1]) for cell in changed_cells}))
+        result = await self.async_session.execute(
+            f"""
+            SELECT DISTINCT dest_id.value::text
+            FROM {TRAVELTIME_MATRIX_TABLE[routing_type]} matrix,
+            LATERAL UNNEST(matrix.dest_id) dest_id(value)
+            WHERE matrix.h3_3 = ANY(ARRAY[{h3_3}]::int[])
+            AND matrix.orig_id = ANY({format_h3_array_sql([cell[0] for cell in changed_cells])})
+            AND matrix.traveltime <= {max_traveltime};
+            """
+        )
+        return [row[0] for row in result.fetchall()]
+
+    async def matrix_table_is_current(
+        self,
+        routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
+        table_name: str,
+    ):
+        """Check if an optional table derived from a travel time matrix can be used.
+
+        The table must exist and have been built from the current version of the
+        matrix, which build_traveltime_matrix_tables records as its comment.
+        """
+
+        result = await self.async_session.execute(
+            f"SELECT obj_description(to_regclass('{table_name}'), 'pg_class');"
+        )
+        built_from = result.scalar()
+        return built_from is not None and built_from == (
+            await get_traveltime_matrix_version(self.async_session, routing_type)
+        )
+
+    async def get_reaching_cells(
+        self,
+        routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
+        h3_indexes: List[str],
+        max_traveltime: int,
+    ):
+        """Get the cells from which the given cells are reached within the max traveltime.
+
+        The cells are looked up in the inverse travel time matrix. None is returned if
+        it has not been built from the current matrix of the routing type.
+        """
+
+        inverse_table = TRAVELTIME_MATRIX_INVERSE_TABLE[routing_type]
+        if not await self.matrix_table_is_current(routing_type, inverse_table):
+            return None
+
+        h3_array = format_h3_array_sql(h3_indexes)
+        result = await self.async_session.execute(
+            f"""
+            SELECT DISTINCT orig_id.value::text
+            FROM {inverse_table} inverse,
+            LATERAL UNNEST(inverse.orig_id) orig_id(value)
+            WHERE inverse.h3_3 = ANY(
+                ARRAY(
+                    SELECT DISTINCT basic.to_short_h3_3(h3_cell_to_parent(cell, 3)::bigint)
+                    FROM UNNEST({h3_array}) cell
+                )
+            )
+            AND inverse.dest_id = ANY({h3_array})
+            AND inverse.traveltime <= {max_traveltime};
+            """
+        )
+        return [row[0] for row in result.fetchall()]
+
+    async def create_delta_table(self, result_table: str):
+        """Create the table the affected cells are recomputed into in delta mode."""
+
+        delta_table = await self.create_temp_table_name("delta")
+        await self.async_session.execute(
+            f"""
+            CREATE TABLE {delta_table} AS
+            SELECT layer_id, geom, text_attr1, float_attr1
+            FROM {result_table}
+            WITH NO DATA;
+            """
+        )
+        await self.async_session.commit()
+        return delta_table
+
+    async def replace_result_cells(
+        self,
+        result_table: str,
+        result_layer_id: str,
+        delta_table: str,
+        h3_indexes: List[str],
+    ):
+        """Replace the affected cells of a result layer by the recomputed ones.
+
+        The cells are replaced in one transaction once they are recomputed, so a
+        failed, timed out or killed delta run leaves the result layer unchanged.
+        """
+
+        await self.async_session.commit()
+        await self.async_session.connection(
+            execution_options={"isolation_level": "READ COMMITTED"}
+        )
+        await self.async_session.execute(
+            f"""
+            DELETE FROM {result_table}
+            WHERE layer_id = '{result_layer_id}'
+            AND text_attr1 = ANY('{{{",".join(h3_indexes)}}}'::text[]);
+            """
+        )
+        await self.async_session.execute(
+            f"""
+            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
+            SELECT layer_id, geom, text_attr1, float_attr1
+            FROM {delta_table};
+            """
+        )
+        await self.async_session.commit()
+        await self.async_session.execute(f"DROP TABLE IF EXISTS {delta_table};")
+        await self.async_session.commit()
+
+        # Cached results of the layer are outdated now
+        heatmap_result_cache.invalidate(result_layer_id)
+
+    async def get_layer_versions(self, layers: List[dict]):
+        """Get the versions of layers (dicts with layer_id and table_name) by layer ID.
+
+        The version of a layer is the last update of its layer row and of its data
+        with its feature count, as feature edits don't update the layer row and
+        deleted features don't leave an update behind. The data is read from the
+        (layer_id, updated_at) index of the user data tables.
+        """
+
+        if not layers:
+            return {}
+        sql_data_versions = " UNION ALL ".join(
+            f"""
+            SELECT '{layer["layer_id"]}'::uuid AS layer_id, MAX(updated_at) AS data_updated_at, COUNT(*) AS feature_cnt
+            FROM {layer["table_name"]}
+            WHERE layer_id = '{layer["layer_id"]}'
+            """
+            for layer in layers
+        )
+        result = await self.async_session.execute(
+            f"""
+            SELECT l.id::text, l.updated_at, d.data_updated_at, d.feature_cnt
+            FROM ({sql_data_versions}) d
+            INNER JOIN {settings.CUSTOMER_SCHEMA}.layer l ON l.id = d.layer_id;
+            """
+        )
+        return {row[0]: list(row[1:]) for row in result.fetchall()}
+
+    async def get_scenario_version(self, scenario_id: UUID | None):
+        """Get the feature count and last update of a scenario."""
+
+        if scenario_id is None:
+            return None
+        result = await self.async_session.execute(
+            f"""
+            SELECT COUNT(*), MAX(sf.updated_at)
+            FROM {settings.CUSTOMER_SCHEMA}.scenario_scenario_feature ssf
+            INNER JOIN {settings.CUSTOMER_SCHEMA}.scenario_feature sf ON sf.id = ssf.scenario_feature_id
+            WHERE ssf.scenario_id = {format_value_null_sql(scenario_id)};
+            """
+        )
+        return list(result.fetchone())
+
+    def get_cache_layers(self, layers: List[dict], layers_project: list):
+        """Get the input layers of a heatmap relevant for its result cache."""
+
+        return [
+            {
+                "layer_id": layer["layer_id"],
+                "table_name": layer["table_name"],
+                "where_query": layer["where_query"],
+            }
+            for layer in layers
+        ] + [
+            {
+                "layer_id": layer_project.layer_id,
+                "table_name": layer_project.table_name,
+                "where_query": layer_project.where_query,
+            }
+            for layer_project in layers_project
+            if layer_project is not None
+        ]
+
+    async def get_cache_key(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+        layers: List[dict],
+    ):
+        """Get the result cache key of a heatmap.
+
+        The key covers the user, the parameters, the version of each input layer
+        (dicts with layer_id, table_name and where_query), the version of the
+        scenario and of the travel time matrix, so that changed inputs lead to a
+        new key.
+        """
+
+        versions = await self.get_layer_versions(layers)
+        layer_versions = [
+            {
+                "layer_id": layer["layer_id"],
+                "where_query": layer["where_query"],
+                "version": versions.get(str(layer["layer_id"])),
+            }
+            for layer in layers
+        ]
+        return heatmap_result_cache.get_key(
+            user_id=self.user_id,
+            tool_type=params.tool_type.value,
+            params=params.dict(exclude={"delta"}),
+            layers=layer_versions,
+            scenario=await self.get_scenario_version(params.scenario_id),
+            matrix=await get_traveltime_matrix_version(
+                self.async_session, params.routing_type
+            ),
+        )
+
+    async def copy_cached_result(
+        self, cache_key: str, result_table: str, result_layer_id: str
+    ):
+        """Copy a cached heatmap result into a new result layer.
+
+        Returns False if the result is not cached or no longer exists.
+        """
+
+        if cached := heatmap_result_cache.get(cache_key):
+            result = await self.async_session.execute(
+                f"""
+                INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
+                SELECT '{result_layer_id}', geom, text_attr1, float_attr1
+                FROM {cached["table_name"]}
+                WHERE layer_id = '{cached["layer_id"]}';
+                """
+            )
+            await self.async_session.commit()
+            if result.rowcount > 0:
+                return True
+            heatmap_result_cache.invalidate(cached["layer_id"])
+        return False
+
+    def cache_result(
+        self,
+        cache_key: str,
+        result_table: str,
+        result_layer_id: str,
+        layers: List[dict],
+    ):
+        """Cache the result layer of a heatmap."""
+
+        heatmap_result_cache.put(
+            cache_key,
+            layer_id=result_layer_id,
+            table_name=result_table,
+            input_layer_ids=[layer["layer_id"] for layer in layers],
+        )
+
+    def get_output_resolution(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+    ):
+        """Get the resolution the result cells are rolled up to, None to keep them."""
+
+        if params.output_resolution in (
+            None,
+            TRAVELTIME_MATRIX_RESOLUTION[params.routing_type],
+        ):
+            return None
+        return params.output_resolution
+
+    def build_result_query(
+        self,
+        params: (
+            IHeatmapGravityActive
+            | IHeatmapGravityMotorized
+            | IHeatmapClosestAverageActive
+            | IHeatmapClosestAverageMotorized
+            | IHeatmapConnectivityActive
+            | IHeatmapConnectivityMotorized
+        ),
+        cells_query: str,
+        result_table: str,
+        result_layer_id: str,
+    ):
+        """Builds SQL query to write the cells of a heatmap to the result table.
+
+        The cells query returns the h3_index and value of the cells at the matrix
+        resolution. For a coarser output resolution, the cells are rolled up to their
+        parents which store the mean value of their cells, so the cell boundaries are
+        only built for the output cells. The mean is taken over all children of the
+        parent if missing cells have a value of zero, else over the returned cells.
+        """
+
+        output_resolution = self.get_output_resolution(params)
+        if output_resolution is None:
+            return f"""
+                INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
+                SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(h3_index)::geometry, 4326),
+                    h3_index, value
+                FROM ({cells_query}) cells;
+            """
+
+        mean_value = "AVG(value)"
+        if self.missing_cells_are_zero:
+            mean_value = f"SUM(value) / h3_cell_to_children_size(h3_cell_to_parent(h3_index, {output_resolution}), {TRAVELTIME_MATRIX_RESOLUTION[params.routing_type]})"
+        return f"""
+            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
+            SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(h3_index)::geometry, 4326),
+                h3_index, value
+            FROM (
+                SELECT h3_cell_to_parent(h3_index, {output_resolution}) AS h3_index, {mean_value} AS value
+                FROM ({cells_query}) cells
+                GROUP BY h3_cell_to_parent(h3_index, {output_resolution})
+            ) output_cells;
+        """
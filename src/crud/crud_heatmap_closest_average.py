@@ -1,11 +1,22 @@
 from typing import List
 from uuid import UUID
 
+import numpy as np
+import pandas as pd
+
 from src.core.config import settings
+from src.core.heatmap import (
+    get_h3_3,
+    get_reached_cells,
+    get_traveltime_matrix,
+    heatmap_closest_average,
+)
 from src.core.job import job_init, job_log, run_background_or_immediately
+from src.core.job_profiler import run_in_executor
 from src.crud.crud_heatmap import CRUDHeatmapBase
 from src.schemas.heatmap import (
     ROUTING_MODE_DEFAULT_SPEED,
+    TRAVELTIME_MATRIX_INVERSE_TABLE,
     TRAVELTIME_MATRIX_RESOLUTION,
     TRAVELTIME_MATRIX_TABLE,
     ActiveRoutingHeatmapType,
@@ -16,10 +27,13 @@ from src.schemas.heatmap import (
 from src.schemas.job import JobStatusType
 from src.schemas.layer import FeatureGeometryType, IFeatureLayerToolCreate
 from src.schemas.toolbox_base import DefaultResultLayerName
-from src.utils import format_value_null_sql
+from src.utils import format_h3_array_sql, format_value_null_sql
 
 
 class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
+    # Cells without reachable opportunities have no travel time rather than zero
+    missing_cells_are_zero = False
+
     def __init__(self, job_id, background_tasks, async_session, user_id, project_id):
         super().__init__(job_id, background_tasks, async_session, user_id, project_id)
 
@@ -89,11 +103,24 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
         opportunity_table: str,
         result_table: str,
         result_layer_id: str,
+        affected_h3_indexes: List[str] | None = None,
+        origin_h3_indexes: List[str] | None = None,
     ):
         """Builds SQL query to compute heatmap closest-average."""
 
-        query = f"""
-            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
+        # Only compute the affected cells in delta mode
+        affected_filters = []
+        dest_filter = "TRUE"
+        if affected_h3_indexes is not None:
+            affected_array = format_h3_array_sql(affected_h3_indexes)
+            affected_filters.append(f"AND matrix.dest_id && {affected_array}")
+            dest_filter = f"dest_id.value = ANY({affected_array})"
+        if origin_h3_indexes is not None:
+            origin_array = format_h3_array_sql(origin_h3_indexes)
+            affected_filters.append(f"AND opportunity.h3_index = ANY({origin_array})")
+        affected_filter = " ".join(affected_filters)
+
+        cells_query = f"""
             WITH grouped AS (
                 SELECT dest_id, (ARRAY_AGG(traveltime ORDER BY traveltime))[1:num_destinations] AS traveltime
                 FROM (
@@ -104,20 +131,112 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
                         WHERE matrix.h3_3 = opportunity.h3_3
                         AND matrix.orig_id = opportunity.h3_index
                         AND matrix.traveltime <= opportunity.max_traveltime
+                        {affected_filter}
                     ) sub_matrix
-                    JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON TRUE
+                    JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON {dest_filter}
                     GROUP BY opportunity_id, dest_id.value, num_destinations
                 ) grouped_opportunities
                 GROUP BY dest_id, num_destinations
             )
-            SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(grouped.dest_id)::geometry, 4326), grouped.dest_id,
-                AVG(traveltime.value) AS accessibility
+            SELECT grouped.dest_id AS h3_index, AVG(traveltime.value) AS value
             FROM grouped
             JOIN LATERAL UNNEST(grouped.traveltime) traveltime(value) ON TRUE
-            GROUP BY grouped.dest_id;
+            GROUP BY grouped.dest_id
         """
 
-        return query
+        return self.build_result_query(
+            params, cells_query, result_table, result_layer_id
+        )
+
+    async def compute_heatmap_in_process(
+        self,
+        params: IHeatmapClosestAverageActive | IHeatmapClosestAverageMotorized,
+        opportunity_table: str,
+        result_table: str,
+        result_layer_id: str,
+        affected_h3_indexes: List[str] | None = None,
+        origin_h3_indexes: List[str] | None = None,
+    ):
+        """Computes heatmap closest-average in Python from the locally cached travel time matrices.
+
+        The closest opportunities of each reached cell are selected from the inverse
+        travel time matrix in order of traveltime, which stops once enough
+        opportunities are found instead of sorting all reachable opportunities.
+        """
+
+        # Fetch opportunities, each opportunity forms a group with its own parameters
+        result = await self.async_session.execute(
+            f"""
+            SELECT id::text, h3_index::bigint, max_traveltime, num_destinations, h3_3
+            FROM {opportunity_table};
+            """
+        )
+        opportunities = pd.DataFrame(
+            result.fetchall(),
+            columns=["id", "h3_index", "max_traveltime", "num_destinations", "h3_3"],
+        )
+        opportunities["group"] = opportunities.groupby(
+            ["id", "num_destinations"], sort=False, dropna=False
+        ).ngroup()
+        groups = opportunities.groupby("group").first()
+
+        # Only use the opportunities reaching the affected cells in delta mode
+        if origin_h3_indexes is not None:
+            opportunities = opportunities[
+                opportunities["h3_index"].isin(
+                    [int(h3_index, 16) for h3_index in origin_h3_indexes]
+                )
+            ]
+        opportunity_h3_index = opportunities["h3_index"].to_numpy(dtype="int64")
+        opportunity_max_traveltime = opportunities["max_traveltime"].to_numpy(
+            dtype="float64"
+        )
+
+        # Get the reached cells, only the affected ones in delta mode
+        matrix = await get_traveltime_matrix(
+            self.async_session, params.routing_type, opportunities["h3_3"].unique()
+        )
+        h3_index = await run_in_executor(
+            None,
+            get_reached_cells,
+            matrix,
+            opportunity_h3_index=opportunity_h3_index,
+            opportunity_max_traveltime=opportunity_max_traveltime,
+        )
+        if affected_h3_indexes is not None:
+            h3_index = h3_index[
+                np.isin(
+                    h3_index, [int(h3_index, 16) for h3_index in affected_h3_indexes]
+                )
+            ]
+
+        # Compute the average traveltime to the closest opportunities
+        inverse_matrix = await get_traveltime_matrix(
+            self.async_session,
+            params.routing_type,
+            np.unique(get_h3_3(h3_index)),
+            inverse=True,
+        )
+        h3_index, traveltime = await run_in_executor(
+            None,
+            heatmap_closest_average,
+            inverse_matrix,
+            h3_index,
+            opportunity_h3_index=opportunity_h3_index,
+            opportunity_group=opportunities["group"].to_numpy(),
+            opportunity_max_traveltime=opportunity_max_traveltime,
+            group_num_destinations=groups["num_destinations"].to_numpy(dtype="int64"),
+        )
+
+        # Write result to result table
+        await self.insert_h3_cells(
+            result_table=result_table,
+            layer_id=result_layer_id,
+            h3_indexes=h3_index.tolist(),
+            attributes={"float_attr1": traveltime.tolist()},
+            resolution=self.get_output_resolution(params),
+            missing_cells_are_zero=self.missing_cells_are_zero,
+        )
 
     @job_log(job_step_name="heatmap_closest_average")
     async def heatmap(
@@ -126,14 +245,8 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
     ):
         """Compute heatmap closest-average."""
 
-        # Fetch opportunity tables
+        # Fetch opportunity layers
         layers, opportunity_geofence_layer = await self.fetch_opportunity_layers(params)
-        opportunity_table = await self.create_distributed_opportunity_table(
-            params.routing_type,
-            layers,
-            params.scenario_id,
-            opportunity_geofence_layer,
-        )
 
         # Initialize result table
         result_table = f"{settings.USER_DATA_SCHEMA}.{FeatureGeometryType.polygon.value}_{str(self.user_id).replace('-', '')}"
@@ -154,21 +267,96 @@ class CRUDHeatmapClosestAverage(CRUDHeatmapBase):
             job_id=self.job_id,
         )
 
-        # Compute heatmap & write to result table
-        await self.async_session.execute(
-            self.build_query(
+        # Reuse the result of a previous heatmap with the same inputs
+        if not params.delta:
+            cache_layers = self.get_cache_layers(layers, [opportunity_geofence_layer])
+            cache_key = await self.get_cache_key(params, cache_layers)
+            if await self.copy_cached_result(
+                cache_key, result_table, str(layer_heatmap.id)
+            ):
+                await self.create_feature_layer_tool(
+                    layer_in=layer_heatmap,
+                    params=params,
+                )
+                return {
+                    "status": JobStatusType.finished.value,
+                    "msg": "Heatmap closest-average was successfully computed.",
+                }
+
+        # Create opportunity table
+        opportunity_table = await self.create_distributed_opportunity_table(
+            params.routing_type,
+            layers,
+            params.scenario_id,
+            opportunity_geofence_layer,
+        )
+
+        # In delta mode, update the affected cells of the previous result layer
+        result_layer_id = str(layer_heatmap.id)
+        output_table = result_table
+        affected_h3_indexes = None
+        origin_h3_indexes = None
+        if params.delta:
+            result_layer = await self.get_delta_result_layer(params)
+            result_table = result_layer.table_name
+            result_layer_id = str(result_layer.layer_id)
+            max_traveltime = max([layer["layer"].max_traveltime for layer in layers])
+            affected_h3_indexes = await self.get_affected_cells(
+                routing_type=params.routing_type,
+                h3_indexes=params.delta.changed_h3_indexes,
+                max_traveltime=max_traveltime,
+            )
+            if not affected_h3_indexes:
+                return {
+                    "status": JobStatusType.finished.value,
+                    "msg": "No cells of the heatmap closest-average are affected by the changes.",
+                }
+            output_table = await self.create_delta_table(result_table)
+            origin_h3_indexes = await self.get_reaching_cells(
+                routing_type=params.routing_type,
+                h3_indexes=affected_h3_indexes,
+                max_traveltime=max_traveltime,
+            )
+
+        # Compute heatmap & write to result table, or delta table in delta mode
+        if settings.HEATMAP_IN_PROCESS_ENGINE and await self.matrix_table_is_current(
+            params.routing_type, TRAVELTIME_MATRIX_INVERSE_TABLE[params.routing_type]
+        ):
+            await self.compute_heatmap_in_process(
                 params=params,
                 opportunity_table=opportunity_table,
-                result_table=result_table,
-                result_layer_id=str(layer_heatmap.id),
+                result_table=output_table,
+                result_layer_id=result_layer_id,
+                affected_h3_indexes=affected_h3_indexes,
+                origin_h3_indexes=origin_h3_indexes,
             )
-        )
+        else:
+            await self.async_session.execute(
+                self.build_query(
+                    params=params,
+                    opportunity_table=opportunity_table,
+                    result_table=output_table,
+                    result_layer_id=result_layer_id,
+                    affected_h3_indexes=affected_h3_indexes,
+                    origin_h3_indexes=origin_h3_indexes,
+                )
+            )
+
+        if params.delta:
+            await self.replace_result_cells(
+                result_table, result_layer_id, output_table, affected_h3_indexes
+            )
+            return {
+                "status": JobStatusType.finished.value,
+                "msg": f"Heatmap closest-average was successfully updated for {len(affected_h3_indexes)} cells.",
+            }
 
         # Register feature layer
         await self.create_feature_layer_tool(
             layer_in=layer_heatmap,
             params=params,
         )
+        self.cache_result(cache_key, result_table, result_layer_id, cache_layers)
 
         return {
             "status": JobStatusType.finished.value,
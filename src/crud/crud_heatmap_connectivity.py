@@ -1,11 +1,13 @@
+from typing import List
 from uuid import UUID
 
 from pydantic import BaseModel
 
 from src.core.config import settings
 from src.core.job import job_init, job_log, run_background_or_immediately
-from src.core.tool import CRUDToolBase
+from src.crud.crud_heatmap import CRUDHeatmapBase
 from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_REACHABLE_AREA_TABLE,
     TRAVELTIME_MATRIX_RESOLUTION,
     TRAVELTIME_MATRIX_TABLE,
     ActiveRoutingHeatmapType,
@@ -16,10 +18,10 @@ from src.schemas.heatmap import (
 from src.schemas.job import JobStatusType
 from src.schemas.layer import FeatureGeometryType, IFeatureLayerToolCreate
 from src.schemas.toolbox_base import DefaultResultLayerName
-from src.utils import format_value_null_sql
+from src.utils import format_h3_array_sql, format_value_null_sql
 
 
-class CRUDHeatmapConnectivity(CRUDToolBase):
+class CRUDHeatmapConnectivity(CRUDHeatmapBase):
     def __init__(self, job_id, background_tasks, async_session, user_id, project_id):
         super().__init__(job_id, background_tasks, async_session, user_id, project_id)
 
@@ -57,22 +59,49 @@ class CRUDHeatmapConnectivity(CRUDToolBase):
         reference_area_table: str,
         result_table: str,
         result_layer_id: str,
+        affected_h3_indexes: List[str] | None = None,
+        reachable_area_table: str | None = None,
     ):
-        """Builds SQL query to compute heatmap connectivity."""
+        """Builds SQL query to compute heatmap connectivity.
+
+        If the reachable area table of the routing type is passed, the reachable
+        cells are looked up per reference cell instead of aggregating the matrix.
+        """
+
+        # Only compute the affected cells in delta mode
+        affected_filter = ""
+        if affected_h3_indexes is not None:
+            affected_filter = (
+                f"AND o.h3_index = ANY({format_h3_array_sql(affected_h3_indexes)})"
+            )
 
         h3_cell_area = f"((3 * SQRT(3) / 2) * POWER(h3_get_hexagon_edge_length_avg({TRAVELTIME_MATRIX_RESOLUTION[params.routing_type]}, 'm'), 2))"
 
-        query = f"""
-            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
-            SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(matrix.orig_id)::geometry, 4326),
-                matrix.orig_id, SUM(ARRAY_LENGTH(matrix.dest_id, 1) * {h3_cell_area})
-            FROM {reference_area_table} o, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
-            WHERE matrix.h3_3 = o.h3_3
-            AND matrix.orig_id = o.h3_index
-            AND matrix.traveltime <= {params.max_traveltime}
-            GROUP BY matrix.orig_id;
-        """
-        return query
+        if reachable_area_table is not None:
+            reachable_cells = f"area.reachable_cells[LEAST({params.max_traveltime} + 1, CARDINALITY(area.reachable_cells))]"
+            cells_query = f"""
+                SELECT area.orig_id AS h3_index, SUM({reachable_cells} * {h3_cell_area}) AS value
+                FROM {reference_area_table} o, {reachable_area_table} area
+                WHERE area.h3_3 = o.h3_3
+                AND area.orig_id = o.h3_index
+                AND {reachable_cells} > 0
+                {affected_filter}
+                GROUP BY area.orig_id
+            """
+        else:
+            cells_query = f"""
+                SELECT matrix.orig_id AS h3_index, SUM(ARRAY_LENGTH(matrix.dest_id, 1) * {h3_cell_area}) AS value
+                FROM {reference_area_table} o, {TRAVELTIME_MATRIX_TABLE[params.routing_type]} matrix
+                WHERE matrix.h3_3 = o.h3_3
+                AND matrix.orig_id = o.h3_index
+                AND matrix.traveltime <= {params.max_traveltime}
+                {affected_filter}
+                GROUP BY matrix.orig_id
+            """
+
+        return self.build_result_query(
+            params, cells_query, result_table, result_layer_id
+        )
 
     @job_log(job_step_name="heatmap_connectivity")
     async def heatmap(
@@ -81,13 +110,8 @@ class CRUDHeatmapConnectivity(CRUDToolBase):
     ):
         """Compute heatmap connectivity."""
 
-        # Fetch reference area table
+        # Fetch reference area layer
         reference_area_layer = await self.get_layers_project(params)
-        reference_area_table = await self.create_distributed_opportunity_table(
-            params.routing_type,
-            reference_area_layer["reference_area_layer_project_id"],
-            params.scenario_id,
-        )
 
         # Initialize result table
         result_table = f"{settings.USER_DATA_SCHEMA}.{FeatureGeometryType.polygon.value}_{str(self.user_id).replace('-', '')}"
@@ -108,20 +132,84 @@ class CRUDHeatmapConnectivity(CRUDToolBase):
             job_id=self.job_id,
         )
 
-        # Compute heatmap & write to output table
+        # Reuse the result of a previous heatmap with the same inputs
+        if not params.delta:
+            cache_layers = self.get_cache_layers(
+                [], [reference_area_layer["reference_area_layer_project_id"]]
+            )
+            cache_key = await self.get_cache_key(params, cache_layers)
+            if await self.copy_cached_result(
+                cache_key, result_table, str(layer_heatmap.id)
+            ):
+                await self.create_feature_layer_tool(
+                    layer_in=layer_heatmap,
+                    params=params,
+                )
+                return {
+                    "status": JobStatusType.finished.value,
+                    "msg": "Heatmap connectivity was successfully computed.",
+                }
+
+        # Create reference area table
+        reference_area_table = await self.create_distributed_opportunity_table(
+            params.routing_type,
+            reference_area_layer["reference_area_layer_project_id"],
+            params.scenario_id,
+        )
+
+        # In delta mode, update the changed cells of the previous result layer
+        result_layer_id = str(layer_heatmap.id)
+        output_table = result_table
+        affected_h3_indexes = None
+        if params.delta:
+            result_layer = await self.get_delta_result_layer(params)
+            result_table = result_layer.table_name
+            result_layer_id = str(result_layer.layer_id)
+            affected_h3_indexes = [
+                cell[0]
+                for cell in await self.get_changed_cells(
+                    params.routing_type, params.delta.changed_h3_indexes
+                )
+            ]
+            output_table = await self.create_delta_table(result_table)
+
+        # Use the reachable area per origin if it was built from the current matrix
+        reachable_area_table = TRAVELTIME_MATRIX_REACHABLE_AREA_TABLE[
+            params.routing_type
+        ]
+        if not await self.matrix_table_is_current(
+            params.routing_type, reachable_area_table
+        ):
+            reachable_area_table = None
+
+        # Compute heatmap & write to result table, or delta table in delta mode
         await self.async_session.execute(
             self.build_query(
                 params=params,
                 reference_area_table=reference_area_table,
-                result_table=result_table,
-                result_layer_id=str(layer_heatmap.id),
+                result_table=output_table,
+                result_layer_id=result_layer_id,
+                affected_h3_indexes=affected_h3_indexes,
+                reachable_area_table=reachable_area_table,
             )
         )
+
+        if params.delta:
+            await self.replace_result_cells(
+                result_table, result_layer_id, output_table, affected_h3_indexes
+            )
+            return {
+                "status": JobStatusType.finished.value,
+                "msg": f"Heatmap connectivity was successfully updated for {len(affected_h3_indexes)} cells.",
+            }
+
         # Register feature layer
         await self.create_feature_layer_tool(
             layer_in=layer_heatmap,
             params=params,
         )
+        self.cache_result(cache_key, result_table, result_layer_id, cache_layers)
+
         return {
             "status": JobStatusType.finished.value,
             "msg": "Heatmap connectivity was successfully computed.",
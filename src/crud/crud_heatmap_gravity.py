@@ -1,9 +1,17 @@
+import asyncio
 from typing import List
 from uuid import UUID
 
+import numpy as np
+import pandas as pd
+
 from src.core.config import settings
+from src.core.heatmap import get_traveltime_matrix, heatmap_gravity
 from src.core.job import job_init, job_log, run_background_or_immediately
+from src.core.job_profiler import run_in_executor
 from src.crud.crud_heatmap import CRUDHeatmapBase
+from src.crud.crud_job import job as crud_job
+from src.db.session import session_manager
 from src.schemas.heatmap import (
     ROUTING_MODE_DEFAULT_SPEED,
     TRAVELTIME_MATRIX_RESOLUTION,
@@ -17,7 +25,7 @@ from src.schemas.heatmap import (
 from src.schemas.job import JobStatusType
 from src.schemas.layer import FeatureGeometryType, IFeatureLayerToolCreate
 from src.schemas.toolbox_base import DefaultResultLayerName
-from src.utils import format_value_null_sql
+from src.utils import format_h3_array_sql, format_value_null_sql
 
 
 class CRUDHeatmapGravity(CRUDHeatmapBase):
@@ -25,17 +33,16 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
     def __init__(self, job_id, background_tasks, async_session, user_id, project_id):
         super().__init__(job_id, background_tasks, async_session, user_id, project_id)
 
-    async def create_distributed_opportunity_table(
+    async def create_layer_opportunity_table(
         self,
         routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
-        layers: List[dict],
+        layer: dict,
         scenario_id: UUID,
         opportunity_geofence_layer,
+        temp_points: str,
+        semaphore: asyncio.Semaphore,
     ):
-        """Create distributed table for user-specified opportunities."""
-
-        # Create temp table name for points
-        temp_points = await self.create_temp_table_name("points")
+        """Create distributed table for the opportunities of a single layer."""
 
         # Create formatted opportunity geofence layer strings for SQL query
         geofence_table = (
@@ -50,24 +57,24 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
             )
             geofence_where_filter = f"'{geofence_where_filter}'"
 
-        append_to_existing = False
-        for layer in layers:
-            # Compute geofence buffer distance
-            geofence_buffer_dist = (
-                layer["layer"].max_traveltime
-                * ((ROUTING_MODE_DEFAULT_SPEED[routing_type] * 1000) / 60)
-                if opportunity_geofence_layer is not None
-                else "NULL"
-            )
+        # Compute geofence buffer distance
+        geofence_buffer_dist = (
+            layer["layer"].max_traveltime
+            * ((ROUTING_MODE_DEFAULT_SPEED[routing_type] * 1000) / 60)
+            if opportunity_geofence_layer is not None
+            else "NULL"
+        )
 
-            # Create distributed point table using sql
-            potential_column = layer["layer"].destination_potential_column
-            if layer["layer"].destination_potential_column == "$area":
-                potential_column = "'ST_Area(geom::geography)'"
-            elif not potential_column:
-                potential_column = 1
+        # Create distributed point table using sql
+        potential_column = layer["layer"].destination_potential_column
+        if layer["layer"].destination_potential_column == "$area":
+            potential_column = "'ST_Area(geom::geography)'"
+        elif not potential_column:
+            potential_column = 1
 
-            await self.async_session.execute(
+        # Use a separate connection from the pool to stage layers concurrently
+        async with semaphore, session_manager.session() as async_session:
+            await async_session.execute(
                 f"""SELECT basic.create_heatmap_gravity_opportunity_table(
                     {layer["layer"].opportunity_layer_project_id},
                     '{layer["table_name"]}',
@@ -83,14 +90,105 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
                     '{temp_points}',
                     {TRAVELTIME_MATRIX_RESOLUTION[routing_type]},
                     {layer["geom_type"] == FeatureGeometryType.polygon},
-                    {append_to_existing}
+                    {False}
                 )"""
             )
+            await async_session.commit()
+
+        return temp_points
+
+    async def create_distributed_opportunity_table(
+        self,
+        routing_type: ActiveRoutingHeatmapType | MotorizedRoutingHeatmapType,
+        layers: List[dict],
+        scenario_id: UUID,
+        opportunity_geofence_layer,
+    ):
+        """Create distributed table for user-specified opportunities."""
+
+        # Create temp table names for the points of each layer
+        temp_points = [await self.create_temp_table_name("points") for _ in layers]
 
+        # Stage the layers concurrently
+        semaphore = asyncio.Semaphore(settings.HEATMAP_OPPORTUNITY_STAGING_CONCURRENCY)
+        tasks = [
+            asyncio.create_task(
+                self.create_layer_opportunity_table(
+                    routing_type,
+                    layer,
+                    scenario_id,
+                    opportunity_geofence_layer,
+                    temp_points[i],
+                    semaphore,
+                )
+            )
+            for i, layer in enumerate(layers)
+        ]
+        try:
+            for i, task in enumerate(asyncio.as_completed(tasks)):
+                await task
+                await crud_job.update_status(
+                    async_session=self.async_session,
+                    job_id=self.job_id,
+                    job_step_name="heatmap_gravity",
+                    status=JobStatusType.running.value,
+                    msg_text=f"Staged {i + 1} of {len(layers)} opportunity layers.",
+                )
+        except BaseException:
+            # Abort the remaining layers and drop the partial tables
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for table in temp_points:
+                await self.async_session.execute(f"DROP TABLE IF EXISTS {table};")
             await self.async_session.commit()
-            append_to_existing = True
+            raise
 
-        return temp_points
+        return await self.aggregate_opportunity_table(temp_points)
+
+    async def aggregate_opportunity_table(self, opportunity_tables: List[str]):
+        """Aggregate opportunities to the cells of the travel time matrix.
+
+        Opportunities covering a single cell with the same max traveltime and
+        sensitivity are merged by summing their potential. Opportunities covering
+        multiple cells are kept as they are reached with their minimum traveltime.
+        """
+
+        opportunity_table = " UNION ALL ".join(
+            [f"SELECT * FROM {table}" for table in opportunity_tables]
+        )
+        temp_opportunities = await self.create_temp_table_name("opportunities")
+        await self.async_session.execute(
+            f"CREATE TABLE {temp_opportunities} (LIKE {opportunity_tables[0]});"
+        )
+        await self.async_session.execute(
+            f"SELECT create_distributed_table('{temp_opportunities}', 'h3_3', colocate_with => '{opportunity_tables[0]}');"
+        )
+        await self.async_session.execute(
+            f"""
+            INSERT INTO {temp_opportunities} (id, h3_index, max_traveltime, sensitivity, potential, h3_3)
+            SELECT COALESCE(multi_cell.id, basic.uuid_generate_v7()), opportunity.h3_index,
+                opportunity.max_traveltime, opportunity.sensitivity, SUM(opportunity.potential),
+                opportunity.h3_3
+            FROM ({opportunity_table}) opportunity
+            LEFT JOIN (
+                SELECT id
+                FROM ({opportunity_table}) opportunity
+                GROUP BY id
+                HAVING COUNT(*) > 1
+            ) multi_cell ON opportunity.id = multi_cell.id
+            GROUP BY opportunity.h3_3, opportunity.h3_index, opportunity.max_traveltime,
+                opportunity.sensitivity, multi_cell.id;
+            """
+        )
+        await self.async_session.execute(
+            f"CREATE INDEX ON {temp_opportunities} (h3_index, h3_3);"
+        )
+        for table in opportunity_tables:
+            await self.async_session.execute(f"DROP TABLE IF EXISTS {table};")
+        await self.async_session.commit()
+
+        return temp_opportunities
 
     # TODO: Verify function formulas
     def build_impedance_function(
@@ -122,6 +220,8 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
         max_sensitivity: float,
         result_table: str,
         result_layer_id: str,
+        affected_h3_indexes: List[str] | None = None,
+        origin_h3_indexes: List[str] | None = None,
     ):
         """Builds SQL query to compute heatmap gravity."""
 
@@ -131,10 +231,20 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
             max_sensitivity=max_sensitivity,
         )
 
-        query = f"""
-            INSERT INTO {result_table} (layer_id, geom, text_attr1, float_attr1)
-            SELECT '{result_layer_id}', ST_SetSRID(h3_cell_to_boundary(dest_id)::geometry, 4326), dest_id,
-                {impedance_function} AS accessibility
+        # Only compute the affected cells in delta mode
+        affected_filters = []
+        dest_filter = "TRUE"
+        if affected_h3_indexes is not None:
+            affected_array = format_h3_array_sql(affected_h3_indexes)
+            affected_filters.append(f"AND matrix.dest_id && {affected_array}")
+            dest_filter = f"dest_id.value = ANY({affected_array})"
+        if origin_h3_indexes is not None:
+            origin_array = format_h3_array_sql(origin_h3_indexes)
+            affected_filters.append(f"AND opportunity.h3_index = ANY({origin_array})")
+        affected_filter = " ".join(affected_filters)
+
+        cells_query = f"""
+            SELECT dest_id AS h3_index, {impedance_function} AS value
             FROM (
                 SELECT opportunity_id, dest_id.value AS dest_id, min(traveltime) AS traveltime, sensitivity, potential
                 FROM
@@ -145,27 +255,104 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
                     WHERE matrix.h3_3 = opportunity.h3_3
                     AND matrix.orig_id = opportunity.h3_index
                     AND matrix.traveltime <= opportunity.max_traveltime
+                    {affected_filter}
                 ) sub_matrix
-                JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON TRUE
+                JOIN LATERAL UNNEST(sub_matrix.dest_id) dest_id(value) ON {dest_filter}
                 GROUP BY opportunity_id, dest_id.value, sensitivity, potential
             ) grouped_opportunities
-            GROUP BY dest_id;
+            GROUP BY dest_id
         """
 
-        return query
+        return self.build_result_query(
+            params, cells_query, result_table, result_layer_id
+        )
+
+    async def compute_heatmap_in_process(
+        self,
+        params: IHeatmapGravityActive | IHeatmapGravityMotorized,
+        opportunity_table: str,
+        max_traveltime: int,
+        max_sensitivity: float,
+        result_table: str,
+        result_layer_id: str,
+        affected_h3_indexes: List[str] | None = None,
+        origin_h3_indexes: List[str] | None = None,
+    ):
+        """Computes heatmap gravity in Python from the locally cached travel time matrix."""
+
+        # Fetch opportunities, each opportunity forms a group with its own parameters
+        result = await self.async_session.execute(
+            f"""
+            SELECT id::text, h3_index::bigint, max_traveltime, sensitivity, potential, h3_3
+            FROM {opportunity_table};
+            """
+        )
+        opportunities = pd.DataFrame(
+            result.fetchall(),
+            columns=[
+                "id",
+                "h3_index",
+                "max_traveltime",
+                "sensitivity",
+                "potential",
+                "h3_3",
+            ],
+        )
+        opportunities["group"] = opportunities.groupby(
+            ["id", "sensitivity", "potential"], sort=False, dropna=False
+        ).ngroup()
+        groups = opportunities.groupby("group").first()
+
+        # Only use the opportunities reaching the affected cells in delta mode
+        if origin_h3_indexes is not None:
+            opportunities = opportunities[
+                opportunities["h3_index"].isin(
+                    [int(h3_index, 16) for h3_index in origin_h3_indexes]
+                )
+            ]
+
+        # Compute accessibility of the reached cells
+        matrix = await get_traveltime_matrix(
+            self.async_session, params.routing_type, opportunities["h3_3"].unique()
+        )
+        h3_index, accessibility = await run_in_executor(
+            None,
+            heatmap_gravity,
+            matrix,
+            opportunity_h3_index=opportunities["h3_index"].to_numpy(dtype="int64"),
+            opportunity_group=opportunities["group"].to_numpy(),
+            opportunity_max_traveltime=opportunities["max_traveltime"].to_numpy(
+                dtype="float64"
+            ),
+            group_sensitivity=groups["sensitivity"].to_numpy(dtype="float64"),
+            group_potential=groups["potential"].to_numpy(dtype="float64"),
+            impedance_function=params.impedance_function,
+            max_traveltime=max_traveltime,
+            max_sensitivity=max_sensitivity,
+        )
+
+        # Only keep the affected cells in delta mode
+        if affected_h3_indexes is not None:
+            affected = np.isin(
+                h3_index, [int(h3_index, 16) for h3_index in affected_h3_indexes]
+            )
+            h3_index, accessibility = h3_index[affected], accessibility[affected]
+
+        # Write result to result table
+        await self.insert_h3_cells(
+            result_table=result_table,
+            layer_id=result_layer_id,
+            h3_indexes=h3_index.tolist(),
+            attributes={"float_attr1": accessibility.tolist()},
+            resolution=self.get_output_resolution(params),
+        )
 
     @job_log(job_step_name="heatmap_gravity")
     async def heatmap(self, params: IHeatmapGravityActive | IHeatmapGravityMotorized):
         """Compute heatmap gravity."""
 
-        # Fetch opportunity tables
+        # Fetch opportunity layers
         layers, opportunity_geofence_layer = await self.fetch_opportunity_layers(params)
-        opportunity_table = await self.create_distributed_opportunity_table(
-            params.routing_type,
-            layers,
-            params.scenario_id,
-            opportunity_geofence_layer,
-        )
 
         # Initialize result table
         result_table = f"{settings.USER_DATA_SCHEMA}.{FeatureGeometryType.polygon.value}_{str(self.user_id).replace('-', '')}"
@@ -186,26 +373,100 @@ class CRUDHeatmapGravity(CRUDHeatmapBase):
             job_id=self.job_id,
         )
 
+        # Reuse the result of a previous heatmap with the same inputs
+        if not params.delta:
+            cache_layers = self.get_cache_layers(layers, [opportunity_geofence_layer])
+            cache_key = await self.get_cache_key(params, cache_layers)
+            if await self.copy_cached_result(
+                cache_key, result_table, str(layer_heatmap.id)
+            ):
+                await self.create_feature_layer_tool(
+                    layer_in=layer_heatmap,
+                    params=params,
+                )
+                return {
+                    "status": JobStatusType.finished.value,
+                    "msg": "Heatmap gravity was successfully computed.",
+                }
+
+        # Create opportunity table
+        opportunity_table = await self.create_distributed_opportunity_table(
+            params.routing_type,
+            layers,
+            params.scenario_id,
+            opportunity_geofence_layer,
+        )
+
         # Get max traveltime & sensitivity for normalization
         max_traveltime = max([layer["layer"].max_traveltime for layer in layers])
 
-        # Compute heatmap & write to result table
-        await self.async_session.execute(
-            self.build_query(
+        # In delta mode, update the affected cells of the previous result layer
+        result_layer_id = str(layer_heatmap.id)
+        output_table = result_table
+        affected_h3_indexes = None
+        origin_h3_indexes = None
+        if params.delta:
+            result_layer = await self.get_delta_result_layer(params)
+            result_table = result_layer.table_name
+            result_layer_id = str(result_layer.layer_id)
+            affected_h3_indexes = await self.get_affected_cells(
+                routing_type=params.routing_type,
+                h3_indexes=params.delta.changed_h3_indexes,
+                max_traveltime=max_traveltime,
+            )
+            if not affected_h3_indexes:
+                return {
+                    "status": JobStatusType.finished.value,
+                    "msg": "No cells of the heatmap gravity are affected by the changes.",
+                }
+            output_table = await self.create_delta_table(result_table)
+            origin_h3_indexes = await self.get_reaching_cells(
+                routing_type=params.routing_type,
+                h3_indexes=affected_h3_indexes,
+                max_traveltime=max_traveltime,
+            )
+
+        # Compute heatmap & write to result table, or delta table in delta mode
+        if settings.HEATMAP_IN_PROCESS_ENGINE:
+            await self.compute_heatmap_in_process(
                 params=params,
                 opportunity_table=opportunity_table,
                 max_traveltime=max_traveltime,
                 max_sensitivity=settings.HEATMAP_GRAVITY_MAX_SENSITIVITY,
-                result_table=result_table,
-                result_layer_id=str(layer_heatmap.id),
+                result_table=output_table,
+                result_layer_id=result_layer_id,
+                affected_h3_indexes=affected_h3_indexes,
+                origin_h3_indexes=origin_h3_indexes,
             )
-        )
+        else:
+            await self.async_session.execute(
+                self.build_query(
+                    params=params,
+                    opportunity_table=opportunity_table,
+                    max_traveltime=max_traveltime,
+                    max_sensitivity=settings.HEATMAP_GRAVITY_MAX_SENSITIVITY,
+                    result_table=output_table,
+                    result_layer_id=result_layer_id,
+                    affected_h3_indexes=affected_h3_indexes,
+                    origin_h3_indexes=origin_h3_indexes,
+                )
+            )
+
+        if params.delta:
+            await self.replace_result_cells(
+                result_table, result_layer_id, output_table, affected_h3_indexes
+            )
+            return {
+                "status": JobStatusType.finished.value,
+                "msg": f"Heatmap gravity was successfully updated for {len(affected_h3_indexes)} cells.",
+            }
 
         # Register feature layer
         await self.create_feature_layer_tool(
             layer_in=layer_heatmap,
             params=params,
         )
+        self.cache_result(cache_key, result_table, result_layer_id, cache_layers)
 
         return {
             "status": JobStatusType.finished.value,
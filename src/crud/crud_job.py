@@ -1,14 +1,19 @@
+import json
 from datetime import datetime
 from typing import List
 from uuid import UUID
 
 from fastapi import HTTPException, status
 from fastapi_pagination import Params as PaginationParams
-from sqlalchemy import and_, func, select
+from sqlalchemy import and_, func, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm.attributes import flag_modified
 
 from src.core.config import settings
+from src.core.job_status import (
+    JOB_STATUS_CHANNEL,
+    JOB_STATUS_MSG_MAX_LENGTH,
+    get_notify_status_query,
+)
 from src.crud.base import CRUDBase
 from src.db.models.job import Job
 from src.schemas.common import OrderEnum
@@ -18,6 +23,44 @@ from src.utils import sanitize_error_message
 
 
 class CRUDJob(CRUDBase):
+    def get_status_event(self, job: Job, job_step_name: str = None) -> dict:
+        """Get the job status event of a job, optionally for one of its steps."""
+
+        return {
+            "id": str(job.id),
+            "user_id": str(job.user_id),
+            "project_id": str(job.project_id) if job.project_id else None,
+            "type": job.type,
+            "status_simple": job.status_simple,
+            "msg_simple": (
+                job.msg_simple[:JOB_STATUS_MSG_MAX_LENGTH] if job.msg_simple else None
+            ),
+            "job_step_name": job_step_name,
+            "step_status": (
+                job.status[job_step_name]["status"]
+                if job_step_name and job_step_name in job.status
+                else None
+            ),
+        }
+
+    async def notify_status(
+        self, async_session: AsyncSession, job: Job, job_step_name: str = None
+    ):
+        """Notify the subscribers of job status events about a job's status."""
+
+        event = self.get_status_event(job, job_step_name)
+        await async_session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": JOB_STATUS_CHANNEL, "payload": json.dumps(event)},
+        )
+        await async_session.commit()
+
+    async def update(self, db: AsyncSession, *, db_obj: Job, obj_in=None) -> Job:
+        job = await super().update(db, db_obj=db_obj, obj_in=obj_in)
+        if isinstance(obj_in, dict) and "status_simple" in obj_in:
+            await self.notify_status(db, job)
+        return job
+
     async def check_and_create(
         self,
         async_session: AsyncSession,
@@ -76,47 +119,88 @@ class CRUDJob(CRUDBase):
         error=None,
         msg_text: str = "",
     ):
-        """Update job status."""
-
-        # TODO: Find another way to avoid refetching the job again here.
-        # Get job and check if job is killed. This is needed at the moment as the job is not updated in here but in the DB.
-        job = await self.get(db=async_session, id=job_id)
-        async_session.expire(job)
-        job = await self.get(db=async_session, id=job_id)
-
-        # Update job step
-        job.status[job_step_name]["timestamp_end"] = str(datetime.now())
-        job.status[job_step_name]["status"] = status
-
-        # Populate job step msg
-        msg_text = sanitize_error_message(msg_text.replace("'", "''"))
-        job.status[job_step_name]["msg"] = {
-            "type": MsgType.info.value,
-            "text": msg_text,
+        """Update job status.
+
+        The step is updated and the status is notified in a single statement
+        returning the updated job. A job killed in the meantime stays killed and its
+        step is marked as killed, so the kill is seen in the returned job. Steps
+        record their start on their first update, and their end and duration in
+        seconds once they are no longer running.
+        """
+
+        status = JobStatusType(status)
+        params = {
+            "job_id": job_id,
+            "job_step_name": job_step_name,
+            "step_status": status.value,
+            "msg_text": sanitize_error_message(msg_text),
+            "killed": JobStatusType.killed.value,
+            "msg_killed": "Job was killed.",
+            "msg_type": MsgType.info.value,
+            "msg_simple": None,
         }
-        if status == JobStatusType.finished:
-            job.status_simple = JobStatusType.running.value
-        else:
-            job.status_simple = status
+
+        # Keep the start of the step if it was started before
+        step_query = "status -> CAST(:job_step_name AS text)"
+        start_query = (
+            f"COALESCE(({step_query} ->> 'timestamp_start')::timestamptz, now())"
+        )
+        end_query = (
+            f", 'timestamp_end', now(), 'duration', EXTRACT(EPOCH FROM now() - {start_query})"
+            if status != JobStatusType.running
+            else ""
+        )
+        status_query = f"""
+            jsonb_set(
+                status,
+                ARRAY[CAST(:job_step_name AS text)],
+                COALESCE({step_query}, '{{}}'::jsonb) || jsonb_build_object(
+                    'status', CASE WHEN status_simple = :killed THEN :killed ELSE CAST(:step_status AS text) END,
+                    'msg', jsonb_build_object(
+                        'type', CAST(:msg_type AS text),
+                        'text', CASE WHEN status_simple = :killed THEN :msg_killed ELSE CAST(:msg_text AS text) END
+                    ),
+                    'timestamp_start', {start_query}
+                    {end_query}
+                )
+            )
+        """
 
         # If error is not None population msg_simple
         if status == JobStatusType.failed:
-            if error is None:
+            if error is None or error.__class__ not in ERROR_MAPPING:
                 error = UnknownError("Unknown error occurred.")
-            else:
-                # Define msg_simple
-                if error.__class__ not in ERROR_MAPPING:
-                    error = UnknownError("Unknown error occurred.")
-            error_name = error.__class__.__name__
-            error_message = str(error)
-            job.msg_simple = f"{error_name}: {error_message}"
-            flag_modified(job, "msg_simple")
-
-        flag_modified(job, "status")
-        flag_modified(job, "status_simple")
-
-        # Update job
-        job = await self.update(db=async_session, db_obj=job)
+            params["msg_simple"] = f"{error.__class__.__name__}: {str(error)}"
+
+        # Finished steps leave the job running until the job is finished
+        if status == JobStatusType.finished:
+            params["status_simple"] = JobStatusType.running.value
+        else:
+            params["status_simple"] = status.value
+
+        query = text(
+            f"""
+            WITH updated AS (
+                UPDATE {settings.CUSTOMER_SCHEMA}.job
+                SET status = {status_query},
+                status_simple = CASE WHEN status_simple = :killed THEN :killed ELSE CAST(:status_simple AS text) END,
+                msg_simple = COALESCE(CAST(:msg_simple AS text), msg_simple),
+                updated_at = now()
+                WHERE id = :job_id
+                RETURNING *
+            ),
+            notified AS ({get_notify_status_query("CAST(:job_step_name AS text)")})
+            SELECT updated.*
+            FROM updated, notified
+            """
+        )
+        result = await async_session.execute(
+            select(Job)
+            .from_statement(query.bindparams(**params))
+            .execution_options(populate_existing=True)
+        )
+        job = result.scalars().first()
+        await async_session.commit()
         return job
 
     async def get_by_date(
@@ -0,0 +1,48 @@
+import json
+from uuid import UUID
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.config import settings
+from src.core.job_profiler import JobProfiler
+from src.crud.base import CRUDBase
+from src.db.models.job_profile import JobProfile
+
+
+class CRUDJobProfile(CRUDBase):
+    async def save(self, async_session: AsyncSession, profiler: JobProfiler):
+        """Save the profile of a job, replacing the profile of a previous run."""
+
+        profile = profiler.dict()
+        await async_session.execute(
+            text(
+                f"""
+                INSERT INTO {settings.CUSTOMER_SCHEMA}.job_profile
+                (job_id, wall_time, statements, requests, functions, updated_at)
+                VALUES (:job_id, :wall_time, CAST(:statements AS jsonb),
+                CAST(:requests AS jsonb), CAST(:functions AS jsonb), now())
+                ON CONFLICT (job_id) DO UPDATE
+                SET wall_time = EXCLUDED.wall_time, statements = EXCLUDED.statements,
+                requests = EXCLUDED.requests, functions = EXCLUDED.functions,
+                updated_at = EXCLUDED.updated_at
+                """
+            ),
+            {
+                "job_id": profile["job_id"],
+                "wall_time": profile["wall_time"],
+                "statements": json.dumps(profile["statements"], default=str),
+                "requests": json.dumps(profile["requests"], default=str),
+                "functions": json.dumps(profile["functions"], default=str),
+            },
+        )
+        await async_session.commit()
+
+    async def get_by_job(self, async_session: AsyncSession, job_id: UUID):
+        result = await async_session.execute(
+            select(JobProfile).where(JobProfile.job_id == job_id)
+        )
+        return result.scalars().first()
+
+
+job_profile = CRUDJobProfile(JobProfile)
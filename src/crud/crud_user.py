@@ -101,6 +101,12 @@ class CRUDUser(CRUDBase):
                             f"""CREATE INDEX ON {settings.USER_DATA_SCHEMA}."{table_name}" (layer_id, cluster_keep);"""
                         )
                     )
+                    # Create index for the data version of the layers
+                    await async_session.execute(
+                        text(
+                            f"""CREATE INDEX ON {settings.USER_DATA_SCHEMA}."{table_name}" (layer_id, updated_at);"""
+                        )
+                    )
                     # Create Primary Key on ID
                     await async_session.execute(
                         text(
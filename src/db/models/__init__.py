@@ -10,6 +10,7 @@ from ._link_model import (
 from .data_store import DataStore
 from .folder import Folder
 from .job import Job
+from .job_profile import JobProfile
 from .layer import Layer
 from .project import Project
 from .scenario import Scenario
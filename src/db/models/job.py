@@ -1,9 +1,21 @@
+from datetime import datetime
 from typing import TYPE_CHECKING, List
 from uuid import UUID
 
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.dialects.postgresql import UUID as UUID_PG
-from sqlmodel import ARRAY, Boolean, Column, Field, ForeignKey, Relationship, Text, text
+from sqlmodel import (
+    ARRAY,
+    Boolean,
+    Column,
+    DateTime,
+    Field,
+    ForeignKey,
+    Integer,
+    Relationship,
+    Text,
+    text,
+)
 from src.schemas.job import JobStatusType, JobType
 from ._base_class import DateTimeBase
 from src.core.config import settings
@@ -66,6 +78,26 @@ class Job(DateTimeBase, table=True):
     payload: dict | None = Field(
         sa_column=Column(JSONB, nullable=True), description="Payload of the job"
     )
+    priority: int | None = Field(
+        sa_column=Column(Integer, nullable=False, server_default="0"),
+        description="Priority of the job in the job queue",
+    )
+    task: dict | None = Field(
+        sa_column=Column(JSONB, nullable=True),
+        description="Task run by a worker if the job is queued",
+    )
+    worker_id: str | None = Field(
+        sa_column=Column(Text, nullable=True),
+        description="ID of the worker that claimed the job",
+    )
+    lease_expires_at: datetime | None = Field(
+        sa_column=Column(DateTime(timezone=True), nullable=True),
+        description="Time until the worker holds the job unless it renews the lease",
+    )
+    attempts: int | None = Field(
+        sa_column=Column(Integer, nullable=False, server_default="0"),
+        description="Number of times the job was claimed by a worker",
+    )
 
     # Relationships
     user: "User" = Relationship(back_populates="jobs")
@@ -0,0 +1,42 @@
+from uuid import UUID
+
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import UUID as UUID_PG
+from sqlmodel import Column, Field, Float, ForeignKey
+
+from src.core.config import settings
+
+from ._base_class import DateTimeBase
+
+
+class JobProfile(DateTimeBase, table=True):
+    """Resources used by a profiled job."""
+
+    __tablename__ = "job_profile"
+    __table_args__ = {"schema": settings.CUSTOMER_SCHEMA}
+
+    job_id: UUID = Field(
+        sa_column=Column(
+            UUID_PG(as_uuid=True),
+            ForeignKey(f"{settings.CUSTOMER_SCHEMA}.job.id", ondelete="CASCADE"),
+            primary_key=True,
+            nullable=False,
+        ),
+        description="ID of the profiled job",
+    )
+    wall_time: float = Field(
+        sa_column=Column(Float, nullable=False),
+        description="Wall time of the job in seconds",
+    )
+    statements: list = Field(
+        sa_column=Column(JSONB, nullable=False),
+        description="Wall time, rows and plan of the statements run by the job",
+    )
+    requests: list = Field(
+        sa_column=Column(JSONB, nullable=False),
+        description="Wall time of the requests to upstream services",
+    )
+    functions: list = Field(
+        sa_column=Column(JSONB, nullable=False),
+        description="Wall and CPU time of the functions run in executors",
+    )
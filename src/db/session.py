@@ -11,6 +11,8 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy import event
 import asyncpg
 
+from src.core import job_profiler
+
 
 async def set_type_codec(
     conn,
@@ -136,6 +138,18 @@ class DatabaseSessionManager:
         def register_custom_types(dbapi_connection, connection_record):
             dbapi_connection.run_async(setup)
 
+        # Profile the statements of the profiled jobs
+        event.listen(
+            self._engine.sync_engine,
+            "before_cursor_execute",
+            job_profiler.before_cursor_execute,
+        )
+        event.listen(
+            self._engine.sync_engine,
+            "after_cursor_execute",
+            job_profiler.after_cursor_execute,
+        )
+
     @contextlib.asynccontextmanager
     async def connect(self) -> AsyncIterator[AsyncConnection]:
         """
@@ -0,0 +1,23 @@
+DROP FUNCTION IF EXISTS basic.insert_traveltime_matrix_inverse;
+CREATE OR REPLACE FUNCTION basic.insert_traveltime_matrix_inverse(
+    matrix_table text, result_table_name text, partition_h3_3 int
+)
+RETURNS SETOF void
+LANGUAGE plpgsql
+AS $function$
+BEGIN
+    -- Invert the rows of the origins in one partition of the travel time matrix.
+    -- The destinations are stored in the partition they belong to, a destination
+    -- reached from origins in several partitions has one row per origin partition.
+    EXECUTE format(
+        'INSERT INTO %s (dest_id, traveltime, orig_id, h3_3)
+        SELECT dest_id.value, matrix.traveltime, ARRAY_AGG(matrix.orig_id ORDER BY matrix.orig_id),
+            basic.to_short_h3_3(h3_cell_to_parent(dest_id.value, 3)::bigint) AS h3_3
+        FROM %s matrix, LATERAL UNNEST(matrix.dest_id) dest_id(value)
+        WHERE matrix.h3_3 = %s
+        GROUP BY dest_id.value, matrix.traveltime',
+        result_table_name, matrix_table, partition_h3_3
+    );
+END;
+$function$
+PARALLEL SAFE;
@@ -0,0 +1,37 @@
+DROP FUNCTION IF EXISTS basic.insert_traveltime_matrix_reachable_area;
+CREATE OR REPLACE FUNCTION basic.insert_traveltime_matrix_reachable_area(
+    matrix_table text, result_table_name text, partition_h3_3 int
+)
+RETURNS SETOF void
+LANGUAGE plpgsql
+AS $function$
+BEGIN
+    -- Count the cells reachable from the origins in one partition of the travel time
+    -- matrix. Element i + 1 of reachable_cells holds the number of cells reachable
+    -- within i minutes, up to the largest traveltime of the origin.
+    EXECUTE format(
+        'INSERT INTO %s (orig_id, reachable_cells, h3_3)
+        SELECT orig_id, ARRAY_AGG(reachable_cells ORDER BY minute), h3_3
+        FROM (
+            SELECT origin.orig_id, origin.h3_3, minute,
+                SUM(COALESCE(cells.cnt, 0)) OVER (PARTITION BY origin.orig_id ORDER BY minute)::int AS reachable_cells
+            FROM (
+                SELECT orig_id, h3_3, MAX(traveltime) AS max_traveltime
+                FROM %s
+                WHERE h3_3 = %s
+                GROUP BY orig_id, h3_3
+            ) origin
+            CROSS JOIN LATERAL generate_series(0, origin.max_traveltime) minute
+            LEFT JOIN (
+                SELECT orig_id, traveltime, SUM(ARRAY_LENGTH(dest_id, 1)) AS cnt
+                FROM %s
+                WHERE h3_3 = %s
+                GROUP BY orig_id, traveltime
+            ) cells ON cells.orig_id = origin.orig_id AND cells.traveltime = minute
+        ) cumulative
+        GROUP BY orig_id, h3_3',
+        result_table_name, matrix_table, partition_h3_3, matrix_table, partition_h3_3
+    );
+END;
+$function$
+PARALLEL SAFE;
@@ -57,6 +57,25 @@ def add_trigger(tables):
                     conn.execute(sql_create_trigger)
 
 
+def add_updated_at_index(tables):
+    with engine.connect() as conn:
+        for table in tables:
+            table_name = table[0]
+            table_type = table_name.split("_")[0]
+
+            if table_type in ("point", "line", "polygon"):
+                # Check if index exists
+                index_exists = conn.execute(
+                    f"SELECT indexname FROM pg_indexes WHERE schemaname = '{settings.USER_DATA_SCHEMA}' AND tablename = '{table_name}' AND indexdef LIKE '%(layer_id, updated_at)';"
+                )
+                index_exists = index_exists.fetchone()
+                if not index_exists:
+                    conn.execute(
+                        f"""CREATE INDEX ON {settings.USER_DATA_SCHEMA}."{table_name}" (layer_id, updated_at);"""
+                    )
+
+
 # tables = get_tables()
 # add_uuid_constraint(tables)
 # add_trigger(tables)
+# add_updated_at_index(tables)
@@ -107,6 +107,10 @@ BEGIN
 				EXECUTE format('CREATE INDEX ON %I.%I (layer_id, cluster_keep);', 
 				    user_data_schema, table_name_input
 				);
+
+				EXECUTE format('CREATE INDEX ON %I.%I (layer_id, updated_at);', 
+				    user_data_schema, table_name_input
+				);
 				
 			END IF;
             
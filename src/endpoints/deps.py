@@ -1,18 +1,16 @@
-from typing import Generator, Optional
+from typing import Generator
 
 from fastapi import Depends, HTTPException, Path, Request, status
-from httpx import AsyncClient, Timeout
 from jose import jwt
 from pydantic import UUID4
 from sqlalchemy.ext.asyncio import AsyncSession
 from qgis.core import QgsApplication
 
 from src.core.config import settings
+from src.core.http_client import close_http_client, get_http_client  # noqa: F401
 from src.crud.crud_scenario import scenario as crud_scenario
 from src.db.session import session_manager
 
-http_client: Optional[AsyncClient] = None
-
 
 async def get_db() -> Generator:  # type: ignore
     async with session_manager.session() as session:
@@ -67,29 +65,6 @@ async def get_scenario(
     return scenario[0]
 
 
-def get_http_client():
-    """Returns an asynchronous HTTP client, typically used for connecting to the GOAT Routing service."""
-
-    global http_client
-    if http_client is None:
-        http_client = AsyncClient(
-            timeout=Timeout(
-                settings.ASYNC_CLIENT_DEFAULT_TIMEOUT,
-                read=settings.ASYNC_CLIENT_READ_TIMEOUT,
-            )
-        )
-    return http_client
-
-
-async def close_http_client():
-    """Clean-up network resources used by the HTTP client."""
-
-    global http_client
-    if http_client is not None:
-        await http_client.aclose()
-        http_client = None
-
-
 def initialize_qgis_application():
     """Initialize QGIS session and resources."""
     
@@ -1,14 +1,22 @@
+import asyncio
+import json
 from datetime import datetime
 from typing import List
 
 from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query
+from fastapi.responses import StreamingResponse
 from fastapi_pagination import Page
 from fastapi_pagination import Params as PaginationParams
 from pydantic import UUID4
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.core.config import settings
+from src.core.job_cancellation import job_cancellation
+from src.core.job_status import job_status_broker
 from src.crud.crud_job import job as crud_job
+from src.crud.crud_job_profile import job_profile as crud_job_profile
 from src.db.models.job import Job
+from src.db.models.job_profile import JobProfile
 from src.deps.auth import auth_z
 from src.endpoints.deps import get_db, get_user_id
 from src.schemas.common import OrderEnum
@@ -17,6 +25,66 @@ from src.schemas.job import JobStatusType, JobType
 router = APIRouter()
 
 
+@router.get(
+    "/events",
+    response_class=StreamingResponse,
+    status_code=200,
+    summary="Stream the status transitions of the user's jobs.",
+    dependencies=[Depends(auth_z)],
+)
+async def stream_job_events(
+    async_session: AsyncSession = Depends(get_db),
+    user_id: UUID4 = Depends(get_user_id),
+    job_id: UUID4 | None = Query(
+        None,
+        description="Job ID to stream the status of. If not specified, the status of all jobs of the user will be streamed.",
+        example="3fa85f64-5717-4562-b3fc-2c963f66afa6",
+    ),
+):
+    """Stream the status transitions of the user's jobs as Server-Sent Events instead of polling the jobs."""
+
+    if not job_status_broker.connected:
+        raise HTTPException(
+            status_code=503, detail="Job status events are currently unavailable"
+        )
+
+    async def events():
+        with job_status_broker.subscribe(user_id) as queue:
+            # Send the current status of the job, as it may have changed already
+            if job_id is not None:
+                job = await crud_job.get_by_multi_keys(
+                    db=async_session, keys={"id": job_id, "user_id": user_id}
+                )
+                if job == []:
+                    return
+                event = crud_job.get_status_event(job[0])
+                yield f"event: job\ndata: {json.dumps(event)}\n\n"
+            # Don't hold a database connection while streaming
+            await async_session.close()
+
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        queue.get(),
+                        timeout=settings.JOB_STATUS_EVENTS_KEEPALIVE_INTERVAL,
+                    )
+                except asyncio.TimeoutError:
+                    # Keep the connection open through proxies
+                    yield ": keep-alive\n\n"
+                    continue
+                # End the stream when the notifications are interrupted
+                if event is None:
+                    return
+                if job_id is None or event["id"] == str(job_id):
+                    yield f"event: job\ndata: {json.dumps(event)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get(
     "/{job_id}",
     response_model=Job,
@@ -45,6 +113,37 @@ async def get_job(
     return job[0]
 
 
+@router.get(
+    "/{job_id}/profile",
+    response_model=JobProfile,
+    status_code=200,
+    summary="Get the resources used by a job.",
+    dependencies=[Depends(auth_z)],
+)
+async def get_job_profile(
+    async_session: AsyncSession = Depends(get_db),
+    job_id: UUID4 = Path(
+        ...,
+        description="The ID of the job to get the profile of",
+        example="3fa85f64-5717-4562-b3fc-2c963f66afa6",
+    ),
+    user_id: UUID4 = Depends(get_user_id),
+):
+    """Retrieve the slowest statements, requests and functions of a profiled job."""
+    job = await crud_job.get_by_multi_keys(
+        db=async_session, keys={"id": job_id, "user_id": user_id}
+    )
+
+    if job == []:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    job_profile = await crud_job_profile.get_by_job(async_session, job_id)
+    if job_profile is None:
+        raise HTTPException(status_code=404, detail="Job profile not found")
+
+    return job_profile
+
+
 @router.get(
     "",
     response_model=Page[Job],
@@ -147,7 +246,7 @@ async def kill_job(
         example="7e5eeb1f-3605-4ff7-87f8-2aed7094e4de",
     ),
 ):
-    """Kill a job. It will let the job finish already started tasks and then kill it. All data produced by the job will be deleted."""
+    """Kill a job. Running steps are cancelled together with their database queries. All data produced by the job will be deleted."""
 
     job = await crud_job.get_by_multi_keys(
         db=async_session, keys={"id": job_id, "user_id": user_id}
@@ -166,6 +265,9 @@ async def kill_job(
             detail="Job is not pending or running. Therefore it cannot be killed.",
         )
 
-    return await crud_job.update(
+    job = await crud_job.update(
         db=async_session, db_obj=job, obj_in={"status_simple": "killed"}
     )
+    # Cancel the job if it runs in this process, other processes are notified
+    job_cancellation.cancel(job_id)
+    return job
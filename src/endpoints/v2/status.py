@@ -4,6 +4,9 @@ from src.endpoints.deps import get_db
 from src.deps.auth import is_superuser
 from src.db.models import Status
 from src.crud.crud_status import status as crud_status
+from src.core.heatmap_cache import heatmap_result_cache
+from src.core.r5_cache import r5_grid_cache
+from src.utils import polling_metrics
 
 router = APIRouter()
 
@@ -50,3 +53,45 @@ async def update_status(
     # Update the status
     status = await crud_status.update(db=async_session, db_obj=status, obj_in=obj_in)
     return status
+
+
+@router.get(
+    "/r5-cache",
+    summary="Get the statistics of the R5 travel time grid cache",
+    status_code=200,
+    dependencies=[Depends(is_superuser)],
+)
+async def get_r5_cache_status():
+    """
+    Get the hit and miss counters of this worker and the size of the R5 travel time grid cache.
+    """
+
+    return r5_grid_cache.stats()
+
+
+@router.get(
+    "/polling",
+    summary="Get the polling metrics of the routing endpoints",
+    status_code=200,
+    dependencies=[Depends(is_superuser)],
+)
+async def get_polling_status():
+    """
+    Get the number of requests, polls, errors and timeouts of this worker per routing endpoint.
+    """
+
+    return polling_metrics
+
+
+@router.get(
+    "/heatmap-cache",
+    summary="Get the statistics of the heatmap result cache",
+    status_code=200,
+    dependencies=[Depends(is_superuser)],
+)
+async def get_heatmap_cache_status():
+    """
+    Get the number of entries, hits, misses and invalidations of the heatmap result cache of this worker.
+    """
+
+    return heatmap_result_cache.stats()
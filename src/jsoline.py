@@ -3,16 +3,31 @@ Translated from https://github.com/goat-community/goat/blob/0089611acacbebf4e297
 """
 
 import math
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
 
 import numpy as np
 from geopandas import GeoDataFrame
 from numba import njit
-from shapely.geometry import shape
-
-from src.utils import compute_r5_surface, coordinate_from_pixel, decode_r5_grid
+import shapely
+from shapely.geometry import MultiPolygon
+
+from src.core.config import settings
+from src.core.job_profiler import run_in_executor
+from src.core.r5_cache import read_r5_grid
+from src.utils import (
+    compute_r5_surface,
+    decode_r5_grid,
+    pixel_to_latitude,
+    pixel_to_longitude,
+    pixel_x_to_web_mercator_x,
+    pixel_y_to_web_mercator_y,
+)
 
 MAX_COORDS = 20000
 
+process_pool: Optional[ProcessPoolExecutor] = None
+
 
 @njit
 def get_contour(surface, width, height, cutoff):
@@ -61,70 +76,61 @@ def get_contour(surface, width, height, cutoff):
 
 
 @njit
-def followLoop(idx, xy, prev_xy):
+def followLoop(idx, x, y, prevx, prevy):
     """
     Follow the loop
     We keep track of which contour cell we're in, and we always keep the filled
     area to our left. Thus we always indicate only which direction we exit the
     cell.
     """
-    x = xy[0]
-    y = xy[1]
-    prevx = prev_xy[0]
-    prevy = prev_xy[1]
-
-    if idx in (1, 3, 7):
-        return [x - 1, y]
-    elif idx in (2, 6, 14):
-        return [x, y + 1]
-    elif idx in (4, 12, 13):
-        return [x + 1, y]
+    if idx == 1 or idx == 3 or idx == 7:
+        return x - 1, y
+    elif idx == 2 or idx == 6 or idx == 14:
+        return x, y + 1
+    elif idx == 4 or idx == 12 or idx == 13:
+        return x + 1, y
     elif idx == 5:
         # Assume that saddle has // orientation (as opposed to \\). It doesn't
         # really matter if we're wrong, we'll just have two disjoint pieces
         # where we should have one, or vice versa.
         # From Bottom:
         if prevy > y:
-            return [x + 1, y]
+            return x + 1, y
 
         # From Top:
         if prevy < y:
-            return [x - 1, y]
+            return x - 1, y
 
-        return [x, y]
-    elif idx in (8, 9, 11):
-        return [x, y - 1]
+        return x, y
+    elif idx == 8 or idx == 9 or idx == 11:
+        return x, y - 1
     elif idx == 10:
         # From left
         if prevx < x:
-            return [x, y + 1]
+            return x, y + 1
 
         # From right
         if prevx > x:
-            return [x, y - 1]
+            return x, y - 1
 
-        return [x, y]
+        return x, y
 
     else:
-        return [x, y]
+        return x, y
 
 
 @njit
-def interpolate(pos, cutoff, start, surface, width, height):
+def interpolate(x, y, cutoff, startx, starty, surface, width, height):
     """
     Do linear interpolation
     """
     #   The edges are always considered unreachable to avoid edge effects so set
     #   them to the cutoff.
-    x = pos[0]
-    y = pos[1]
-    startx = start[0]
-    starty = start[1]
     index = y * width + x
-    topLeft = surface[index]
-    topRight = surface[index + 1]
-    botLeft = surface[index + width]
-    botRight = surface[index + width + 1]
+    topLeft = float(surface[index])
+    topRight = float(surface[index + 1])
+    botLeft = float(surface[index + width])
+    botRight = float(surface[index + width + 1])
     if x == 0:
         topLeft = botLeft = cutoff
     if y == 0:
@@ -136,41 +142,33 @@ def interpolate(pos, cutoff, start, surface, width, height):
     # From left
     if startx < x:
         frac = (cutoff - topLeft) / (botLeft - topLeft)
-        return [x, y + ensureFractionIsNumber(frac, "left")]
+        return x, y + ensureFractionIsNumber(frac, "left")
     # From right
     if startx > x:
         frac = (cutoff - topRight) / (botRight - topRight)
-        return [x + 1, y + ensureFractionIsNumber(frac, "right")]
+        return x + 1, y + ensureFractionIsNumber(frac, "right")
     # From bottom
     if starty > y:
         frac = (cutoff - botLeft) / (botRight - botLeft)
-        return [x + ensureFractionIsNumber(frac, "bottom"), y + 1]
+        return x + ensureFractionIsNumber(frac, "bottom"), y + 1
     # From top
-    if starty < y:
-        frac = (cutoff - topLeft) / (topRight - topLeft)
-        return [x + ensureFractionIsNumber(frac, "top"), y]
-    pass
+    frac = (cutoff - topLeft) / (topRight - topLeft)
+    return x + ensureFractionIsNumber(frac, "top"), y
 
 
 @njit
-def noInterpolate(pos, start):
-    x = pos[0]
-    y = pos[1]
-    startx = start[0]
-    starty = start[1]
+def noInterpolate(x, y, startx, starty):
     # From left
     if startx < x:
-        return [x, y + 0.5]
+        return x, y + 0.5
     # From right
     if startx > x:
-        return [x + 1, y + 0.5]
+        return x + 1, y + 0.5
     # From bottom
     if starty > y:
-        return [x + 0.5, y + 1]
+        return x + 0.5, y + 1
     # From top
-    if starty < y:
-        return [x + 0.5, y]
-    pass
+    return x + 0.5, y
 
 
 # Calculated fractions may not be numbers causing interpolation to fail.
@@ -181,6 +179,35 @@ def ensureFractionIsNumber(frac, direction):
     return frac
 
 
+@njit
+def get_cell_index(ranks, width, x, y, k):
+    """
+    Get the contour index of a cell for the k-th sorted cutoff. A grid point is
+    below the cutoff if k is greater than or equal to its rank.
+    """
+    index = y * width + x
+    idx = 0
+    if ranks[index] <= k:
+        idx |= 1 << 3
+    if ranks[index + 1] <= k:
+        idx |= 1 << 2
+    if ranks[index + width + 1] <= k:
+        idx |= 1 << 1
+    if ranks[index + width] <= k:
+        idx |= 1
+    return idx
+
+
+@njit
+def grow(buffer, size):
+    """Double the capacity of a buffer if it is full."""
+    if size < buffer.shape[0]:
+        return buffer
+    grown = np.empty(buffer.shape[0] * 2, dtype=buffer.dtype)
+    grown[:size] = buffer[:size]
+    return grown
+
+
 @njit
 def calculate_jsolines(
     surface,
@@ -193,141 +220,254 @@ def calculate_jsolines(
     interpolation=True,
     web_mercator=True,
 ):
-    geometries = []
-    for _, cutoff in np.ndenumerate(cutoffs):
-        contour = get_contour(surface, width, height, cutoff)
-        cWidth = width - 1
-        # Store warnings
-        warnings = []
-
-        # JavaScript does not have boolean arrays.
-        found = np.zeros((width - 1) * (height - 1), dtype=np.int8)
-
-        # DEBUG, comment out to save memory
-        indices = []
+    """
+    Trace the isolines of all cutoffs with a single classification pass over the
+    surface.
 
-        # We'll sort out what shell goes with what hole in a bit.
-        shells = []
-        holes = []
+    Instead of nested lists the rings are returned as flat buffers: the x and y
+    coordinates, the offsets of each ring into the coordinates, the cutoff index
+    of each ring, whether it is a shell and, for holes, the ring index of the
+    containing shell (-1 if there is none).
+    """
+    n_cutoffs = len(cutoffs)
+    cWidth = width - 1
+    n_cells = cWidth * (height - 1)
+
+    order = np.argsort(cutoffs, kind="mergesort")
+    sorted_cutoffs = cutoffs[order].astype(np.float64)
+
+    # Rank every grid point against all cutoffs at once. The point is below the
+    # k-th sorted cutoff if k >= rank. Points on the edge of the surface are never
+    # below any cutoff, so that isochrones always close even when they actually
+    # extend beyond the edges of the surface.
+    ranks = np.searchsorted(sorted_cutoffs, surface.astype(np.float64), side="right")
+    for x in range(width):
+        ranks[x] = n_cutoffs
+        ranks[(height - 1) * width + x] = n_cutoffs
+    for y in range(height):
+        ranks[y * width] = n_cutoffs
+        ranks[y * width + width - 1] = n_cutoffs
+
+    # A cell contains a line for all cutoffs between the min and max rank of its
+    # corners. Index the cells with lines by cutoff (CSR) in a single pass so that
+    # cells without lines are never visited again.
+    cell_min_rank = np.empty(n_cells, dtype=np.int64)
+    cell_max_rank = np.empty(n_cells, dtype=np.int64)
+    active_offsets = np.zeros(n_cutoffs + 2, dtype=np.int64)
+    for y in range(height - 1):
+        for x in range(width - 1):
+            index = y * width + x
+            min_rank = min(
+                ranks[index],
+                ranks[index + 1],
+                ranks[index + width],
+                ranks[index + width + 1],
+            )
+            max_rank = max(
+                ranks[index],
+                ranks[index + 1],
+                ranks[index + width],
+                ranks[index + width + 1],
+            )
+            cell_min_rank[y * cWidth + x] = min_rank
+            cell_max_rank[y * cWidth + x] = max_rank
+            if min_rank < max_rank:
+                active_offsets[min_rank + 1] += 1
+                active_offsets[max_rank + 1] -= 1
+    for k in range(n_cutoffs):
+        active_offsets[k + 1] += active_offsets[k]
+    for k in range(n_cutoffs):
+        active_offsets[k + 1] += active_offsets[k]
+    active_offsets = active_offsets[: n_cutoffs + 1]
+    active_cells = np.empty(active_offsets[n_cutoffs], dtype=np.int64)
+    active_fill = active_offsets[:n_cutoffs].copy()
+    for cell in range(n_cells):
+        for k in range(cell_min_rank[cell], cell_max_rank[cell]):
+            active_cells[active_fill[k]] = cell
+            active_fill[k] += 1
+
+    # Flat output buffers
+    xs = np.empty(1024, dtype=np.float64)
+    ys = np.empty(1024, dtype=np.float64)
+    ring_offsets = np.zeros(64, dtype=np.int64)
+    ring_cutoff = np.empty(64, dtype=np.int64)
+    ring_is_shell = np.empty(64, dtype=np.bool_)
+    ring_parent = np.empty(64, dtype=np.int64)
+    n_coords = 0
+    n_rings = 0
+
+    # The cell was found for the k-th sorted cutoff if found[cell] == k
+    found = np.full(n_cells, -1, dtype=np.int64)
+
+    for k in range(n_cutoffs):
+        cutoff = sorted_cutoffs[k]
+        first_ring = n_rings
 
         # Find a cell that has a line in it, then follow that line, keeping filled
         # area to your left. This lets us use winding direction to determine holes.
-
-        for origy in range(height - 1):
-            for origx in range(width - 1):
-                index = origy * cWidth + origx
-                if found[index] == 1:
-                    continue
-                idx = contour[index]
-
-                # Continue if there is no line here or if it's a saddle, as we don't know which way the saddle goes.
-                if idx == 0 or idx == 5 or idx == 10 or idx == 15:
-                    continue
-
-                # Huzzah! We have found a line, now follow it, keeping the filled area to our left,
-                # which allows us to use the winding direction to determine what should be a shell and
-                # what should be a hole
-                pos = [origx, origy]
-                prev = [-1, -1]
-                start = [-1, -1]
-
-                # Track winding direction
-                direction = 0
-                coords = []
-
-                # Make sure we're not traveling in circles.
-                # NB using index from _previous_ cell, we have not yet set an index for this cell
-
-                while found[index] != 1:
-                    prev = start
-                    start = pos
-                    idx = contour[index]
-
-                    indices.append(idx)
-
-                    # Mark as found if it's not a saddle because we expect to reach saddles twice.
-                    if idx != 5 and idx != 10:
-                        found[index] = 1
-
-                    if idx == 0 or idx >= 15:
-                        warnings.append("Ran off outside of ring")
-                        break
-
-                    # Follow the loop
-                    pos = followLoop(idx, pos, prev)
-                    index = pos[1] * cWidth + pos[0]
-
-                    # Keep track of winding direction
-                    direction += (pos[0] - start[0]) * (pos[1] + start[1])
-
-                    # Shift exact coordinates
-                    if interpolation:
-                        coord = interpolate(pos, cutoff, start, surface, width, height)
-                    else:
-                        coord = noInterpolate(pos, start)
-
-                    if not coord:
-                        warnings.append(
-                            f"Unexpected coo rdinate shift from ${start[0]}, ${start[1]} to ${pos[0]}, ${pos[1]}, discarding ring"
-                        )
-                        break
-                    xy = coordinate_from_pixel(
-                        [coord[0] + west, coord[1] + north],
-                        zoom=zoom,
-                        web_mercator=web_mercator,
+        for a in range(active_offsets[k], active_offsets[k + 1]):
+            index = active_cells[a]
+            if found[index] == k:
+                continue
+            origx = index % cWidth
+            origy = index // cWidth
+            idx = get_cell_index(ranks, width, origx, origy, k)
+
+            # Continue if there is no line here or if it's a saddle, as we don't know which way the saddle goes.
+            if idx == 0 or idx == 5 or idx == 10 or idx == 15:
+                continue
+
+            # Huzzah! We have found a line, now follow it, keeping the filled area to our left,
+            # which allows us to use the winding direction to determine what should be a shell and
+            # what should be a hole
+            x = origx
+            y = origy
+            startx = -1
+            starty = -1
+
+            # Track winding direction
+            direction = 0
+            ring_start = n_coords
+            closed = False
+
+            # Make sure we're not traveling in circles.
+            # NB using index from _previous_ cell, we have not yet set an index for this cell
+
+            while found[index] != k:
+                prevx = startx
+                prevy = starty
+                startx = x
+                starty = y
+                idx = get_cell_index(ranks, width, x, y, k)
+
+                # Mark as found if it's not a saddle because we expect to reach saddles twice.
+                if idx != 5 and idx != 10:
+                    found[index] = k
+
+                # Ran off outside of ring
+                if idx == 0 or idx >= 15:
+                    break
+
+                # Follow the loop
+                x, y = followLoop(idx, x, y, prevx, prevy)
+                index = y * cWidth + x
+
+                # Keep track of winding direction
+                direction += (x - startx) * (y + starty)
+
+                # Unexpected coordinate shift, discarding ring
+                if x == startx and y == starty:
+                    break
+
+                # Shift exact coordinates
+                if interpolation:
+                    px, py = interpolate(
+                        x, y, cutoff, startx, starty, surface, width, height
                     )
-                    coords.append(xy)
-
-                    # We're back at the start of the ring
-                    if pos[0] == origx and pos[1] == origy:
-                        coords.append(coords[0])  # close the ring
-
-                        # make it a fully-fledged GeoJSON object
-                        geom = [coords]
-
-                        # Check winding direction. Positive here means counter clockwise,
-                        # see http:#stackoverflow.com/questions/1165647
-                        # +y is down so the signs are reversed from what would be expected
-                        if direction > 0:
-                            shells.append(geom)
-                        else:
-                            holes.append(geom)
-                        break
+                else:
+                    px, py = noInterpolate(x, y, startx, starty)
+
+                if web_mercator:
+                    cx = pixel_x_to_web_mercator_x(px + west, zoom)
+                    cy = pixel_y_to_web_mercator_y(py + north, zoom)
+                else:
+                    cx = pixel_to_longitude(px + west, zoom)
+                    cy = pixel_to_latitude(py + north, zoom)
+                xs = grow(xs, n_coords)
+                ys = grow(ys, n_coords)
+                xs[n_coords] = cx
+                ys[n_coords] = cy
+                n_coords += 1
+
+                # We're back at the start of the ring
+                if x == origx and y == origy:
+                    # close the ring
+                    xs = grow(xs, n_coords)
+                    ys = grow(ys, n_coords)
+                    xs[n_coords] = xs[ring_start]
+                    ys[n_coords] = ys[ring_start]
+                    n_coords += 1
+                    closed = True
+                    break
+
+            if not closed:
+                n_coords = ring_start
+                continue
+
+            ring_offsets = grow(ring_offsets, n_rings + 1)
+            ring_cutoff = grow(ring_cutoff, n_rings)
+            ring_is_shell = grow(ring_is_shell, n_rings)
+            ring_parent = grow(ring_parent, n_rings)
+            ring_offsets[n_rings + 1] = n_coords
+            ring_cutoff[n_rings] = order[k]
+            # Check winding direction. Positive here means counter clockwise,
+            # see http:#stackoverflow.com/questions/1165647
+            # +y is down so the signs are reversed from what would be expected
+            ring_is_shell[n_rings] = direction > 0
+            ring_parent[n_rings] = -1
+            n_rings += 1
 
         # Shell game time. Sort out shells and holes.
-        for hole in holes:
+        # Bounding boxes of the rings allow to skip most point in polygon tests.
+        bounds = np.empty((n_rings - first_ring, 3), dtype=np.float64)
+        for ring in range(first_ring, n_rings):
+            start = ring_offsets[ring]
+            end = ring_offsets[ring + 1]
+            bounds[ring - first_ring, 0] = xs[start:end].max()
+            bounds[ring - first_ring, 1] = ys[start:end].min()
+            bounds[ring - first_ring, 2] = ys[start:end].max()
+        for hole in range(first_ring, n_rings):
+            if ring_is_shell[hole]:
+                continue
             # Only accept holes that are at least 2-dimensional.
-            # Workaroudn (x+y) to avoid float to str type conversion in numba
-            vertices = []
-            for x, y in hole[0]:
-                vertices.append((x + y))
-
-            if len(vertices) >= 3:
+            if ring_offsets[hole + 1] - ring_offsets[hole] >= 3:
                 # NB this is checking whether the first coordinate of the hole is inside
                 # the shell. This is sufficient as shells don't overlap, and holes are
                 # guaranteed to be completely contained by a single shell.
-                holePoint = hole[0][0]
-                containingShell = []
-                for shell in shells:
-                    if pointinpolygon(holePoint[0], holePoint[1], shell[0]):
-                        containingShell.append(shell)
-                if len(containingShell) == 1:
-                    containingShell[0].append(hole[0])
-
-        geometries.append(list(shells))
-    return geometries
+                hole_x = xs[ring_offsets[hole]]
+                hole_y = ys[ring_offsets[hole]]
+                containing_shell = -1
+                containing_shell_cnt = 0
+                for shell in range(first_ring, n_rings):
+                    if not ring_is_shell[shell]:
+                        continue
+                    # The point can not be inside if it is outside the bounding box
+                    if (
+                        hole_x > bounds[shell - first_ring, 0]
+                        or hole_y <= bounds[shell - first_ring, 1]
+                        or hole_y > bounds[shell - first_ring, 2]
+                    ):
+                        continue
+                    start = ring_offsets[shell]
+                    end = ring_offsets[shell + 1]
+                    if pointinpolygon(hole_x, hole_y, xs[start:end], ys[start:end]):
+                        containing_shell = shell
+                        containing_shell_cnt += 1
+                if containing_shell_cnt == 1:
+                    ring_parent[hole] = containing_shell
+
+    return (
+        xs[:n_coords],
+        ys[:n_coords],
+        ring_offsets[: n_rings + 1],
+        ring_cutoff[:n_rings],
+        ring_is_shell[:n_rings],
+        ring_parent[:n_rings],
+    )
 
 
 @njit
-def pointinpolygon(x, y, poly):
-    n = len(poly)
+def pointinpolygon(x, y, poly_x, poly_y):
+    n = len(poly_x)
     inside = False
     p2x = 0.0
     p2y = 0.0
     xints = 0.0
-    p1x, p1y = poly[0]
+    p1x = poly_x[0]
+    p1y = poly_y[0]
     for i in range(n + 1):
-        p2x, p2y = poly[i % n]
+        p2x = poly_x[i % n]
+        p2y = poly_y[i % n]
         if y > min(p1y, p2y):
             if y <= max(p1y, p2y):
                 if x <= max(p1x, p2x):
@@ -340,6 +480,40 @@ def pointinpolygon(x, y, poly):
     return inside
 
 
+def jsolines_geometries(
+    xs, ys, ring_offsets, ring_cutoff, ring_is_shell, ring_parent, n_cutoffs
+):
+    """
+    Assemble the flat ring buffers returned by calculate_jsolines into one
+    multipolygon per cutoff using vectorized shapely operations.
+    """
+    n_rings = len(ring_cutoff)
+    geometries = np.empty(n_cutoffs, dtype=object)
+    if n_rings > 0:
+        ring_ids = np.repeat(np.arange(n_rings), np.diff(ring_offsets))
+        rings = shapely.linearrings(np.column_stack((xs, ys)), indices=ring_ids)
+
+        # Number the shells (polygons) by cutoff and assign the holes to them
+        shells = np.flatnonzero(ring_is_shell)
+        shells = shells[np.argsort(ring_cutoff[shells], kind="stable")]
+        polygon_id = np.full(n_rings, -1, dtype=np.int64)
+        polygon_id[shells] = np.arange(len(shells))
+        holes = np.flatnonzero(ring_parent >= 0)
+        polygon_id[holes] = polygon_id[ring_parent[holes]]
+
+        # Order the rings by polygon with the shell first followed by its holes
+        rings_used = np.flatnonzero(polygon_id >= 0)
+        rings_used = rings_used[
+            np.lexsort((rings_used, ~ring_is_shell[rings_used], polygon_id[rings_used]))
+        ]
+        polygons = shapely.polygons(rings[rings_used], indices=polygon_id[rings_used])
+        shapely.multipolygons(polygons, indices=ring_cutoff[shells], out=geometries)
+
+    # Cutoffs without any polygon
+    geometries[shapely.is_missing(geometries)] = MultiPolygon()
+    return geometries
+
+
 def jsolines(
     surface,
     width,
@@ -351,6 +525,7 @@ def jsolines(
     interpolation=True,
     return_incremental=False,
     web_mercator=False,
+    return_full=True,
 ):
     """
     Calculate isolines from a surface.
@@ -365,32 +540,25 @@ def jsolines(
     :param interpolation: Whether to interpolate between pixels.
     :param return_incremental: Whether to also return incremental isolines. Takes
     :param web_mercator: Whether to use web mercator coordinates.
+    :param return_full: Whether to return the full isolines.
 
     :return: A dictionary with full and/or incremental isolines as a geodataframe object.
     """
 
-    isochrone_multipolygon_coordinates = calculate_jsolines(
+    isochrone_rings = calculate_jsolines(
         surface, width, height, west, north, zoom, cutoffs, interpolation, web_mercator
     )
+    isochrone_shapes = jsolines_geometries(*isochrone_rings, len(cutoffs))
 
     result = {}
-    isochrone_shapes = []
-    for isochrone in isochrone_multipolygon_coordinates:
-        isochrone_shapes.append(
-            shape({"type": "MultiPolygon", "coordinates": isochrone})
-        )
-
-    result["full"] = GeoDataFrame({"geometry": isochrone_shapes, "minute": cutoffs})
+    if return_full:
+        result["full"] = GeoDataFrame({"geometry": isochrone_shapes, "minute": cutoffs})
 
     if return_incremental:
-        isochrone_diff = []
-        for i in range(len(isochrone_shapes)):
-            if i == 0:
-                isochrone_diff.append(isochrone_shapes[i])
-            else:
-                isochrone_diff.append(
-                    isochrone_shapes[i].difference(isochrone_shapes[i - 1])
-                )
+        isochrone_diff = isochrone_shapes.copy()
+        isochrone_diff[1:] = shapely.difference(
+            isochrone_shapes[1:], isochrone_shapes[:-1]
+        )
 
         result["incremental"] = GeoDataFrame(
             {"geometry": isochrone_diff, "minute": cutoffs}
@@ -405,10 +573,55 @@ def jsolines(
     return result
 
 
-def generate_jsolines(grid, travel_time, percentile, steps):
+def grid_cells(surface, width, height, west, north, zoom, travel_time):
+    """
+    Convert a surface into rectangular grid cells. Adjacent pixels of a row with the
+    same value are merged into a single cell to keep the output compact.
+
+    :param surface: A 2D array of values.
+    :param width: The width of the surface.
+    :param height: The height of the surface.
+    :param west: The western edge of the surface.
+    :param north: The northern edge of the surface.
+    :param zoom: The zoom level of the surface.
+    :param travel_time: The maximum value of the pixels to include.
+
+    :return: A geodataframe object with one row per cell.
+    """
+
+    values = np.where(surface <= travel_time, surface.astype(np.int64), -1).reshape(
+        height, width
+    )
+
+    # Runs of the same value start at the beginning of a row or on a value change
+    run_start = np.ones((height, width), dtype=bool)
+    run_start[:, 1:] = values[:, 1:] != values[:, :-1]
+    run_y, run_x0 = np.nonzero(run_start)
+    run_x1 = np.append(run_x0[1:], width)
+    run_x1[np.append(run_y[1:] != run_y[:-1], True)] = width
+    run_value = values[run_y, run_x0]
+    reachable = run_value >= 0
+    run_y, run_x0, run_x1, run_value = (
+        run_y[reachable],
+        run_x0[reachable],
+        run_x1[reachable],
+        run_value[reachable],
+    )
+
+    lons = np.array([pixel_to_longitude(west + x, zoom) for x in range(width + 1)])
+    lats = np.array([pixel_to_latitude(north + y, zoom) for y in range(height + 1)])
+    geometries = shapely.box(lons[run_x0], lats[run_y + 1], lons[run_x1], lats[run_y])
+
+    return GeoDataFrame({"geometry": geometries, "minute": run_value}, crs="EPSG:4326")
+
+
+def generate_jsolines(grid, travel_time, percentile, steps, polygon_difference=None):
     """
     Generate the jsolines from the isochrones.
 
+    :param polygon_difference: Whether to only return the incremental (True) or the
+    full (False) jsolines. Both are returned if not specified.
+
     :return: A GeoDataFrame with the jsolines.
 
     """
@@ -429,11 +642,96 @@ def generate_jsolines(grid, travel_time, percentile, steps):
             stop=travel_time + 1,
             step=(travel_time / steps),
         ),
-        return_incremental=True,
+        return_incremental=polygon_difference is not False,
+        return_full=polygon_difference is not True,
     )
     return isochrones
 
 
+def generate_jsolines_from_r5_grid(
+    grid_data_buffer, travel_time, percentile, steps, polygon_difference=None
+):
+    """
+    Decode an R5 grid and generate the jsolines for it. Runs in a worker process.
+    The grid is passed as raw bytes or as the path of a cached grid.
+
+    :return: The jsolines, the decoded grid isn't sent back to the caller.
+    """
+    grid = read_r5_grid(grid_data_buffer, percentile=percentile)
+    return generate_jsolines(grid, travel_time, percentile, steps, polygon_difference)
+
+
+def get_process_pool() -> Optional[ProcessPoolExecutor]:
+    """Returns the process pool used for contouring, None if it is disabled."""
+
+    global process_pool
+    if process_pool is None and settings.JSOLINE_PROCESS_POOL_SIZE:
+        process_pool = ProcessPoolExecutor(
+            max_workers=settings.JSOLINE_PROCESS_POOL_SIZE
+        )
+    return process_pool
+
+
+def close_process_pool():
+    """Shut down the worker processes used for contouring."""
+
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(cancel_futures=True)
+        process_pool = None
+
+
+def generate_grid_from_r5_grid(grid_data_buffer, travel_time, percentile):
+    """
+    Decode an R5 grid and convert it into grid cells. Runs in a worker process.
+    The grid is passed as raw bytes or as the path of a cached grid.
+
+    :return: A GeoDataFrame with the grid cells.
+    """
+    grid = read_r5_grid(grid_data_buffer, percentile=percentile)
+    return grid_cells(
+        compute_r5_surface(grid, percentile),
+        grid["width"],
+        grid["height"],
+        grid["west"],
+        grid["north"],
+        grid["zoom"],
+        travel_time,
+    )
+
+
+async def run_in_process_pool(func, *args):
+    """Run a CPU-bound function without blocking the event loop."""
+
+    return await run_in_executor(get_process_pool(), func, *args)
+
+
+async def async_generate_jsolines_from_r5_grid(
+    grid_data_buffer, travel_time, percentile, steps, polygon_difference=None
+):
+    """Generate the jsolines for an R5 grid without blocking the event loop."""
+
+    return await run_in_process_pool(
+        generate_jsolines_from_r5_grid,
+        grid_data_buffer,
+        travel_time,
+        percentile,
+        steps,
+        polygon_difference,
+    )
+
+
+async def async_generate_grid_from_r5_grid(grid_data_buffer, travel_time, percentile):
+    """Generate the grid cells for an R5 grid without blocking the event loop."""
+
+    return await run_in_process_pool(
+        generate_grid_from_r5_grid,
+        grid_data_buffer,
+        travel_time,
+        percentile,
+    )
+
+
 if __name__ == "__main__":
     fileName = "/app/src/tests/data/isochrone/public_transport_calculation.bin"
     with open(fileName, mode="rb") as file:  # b is important -> binary
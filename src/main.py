@@ -11,9 +11,13 @@ from sqlalchemy.exc import IntegrityError
 from starlette.middleware.cors import CORSMiddleware
 
 from src.core.config import settings
+from src.core.heatmap_cache import heatmap_result_cache
+from src.core.job_status import job_status_broker
+from src.core.r5_region import r5_region_index
 from src.db.session import session_manager
 from src.endpoints.deps import close_http_client, initialize_qgis_application, close_qgis_application
 from src.endpoints.v2.api import router as api_router_v2
+from src.jsoline import close_process_pool
 
 if settings.SENTRY_DSN and settings.ENVIRONMENT:
     sentry_sdk.init(
@@ -32,10 +36,23 @@ async def lifespan(app: FastAPI):
     handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
     logger.addHandler(handler)
     qgis_application = initialize_qgis_application()
+    try:
+        # Load the R5 region mapping into memory
+        async with session_manager.session() as async_session:
+            await r5_region_index.load(async_session)
+    except Exception as e:
+        logger.warning(f"Could not load the R5 region mapping: {str(e)}")
+    # Invalidate cached heatmap results when layers change
+    heatmap_result_cache.listen(settings.POSTGRES_DATABASE_URI)
+    # Stream job status transitions to the job events subscribers
+    job_status_broker.listen(settings.POSTGRES_DATABASE_URI)
     yield
     print("Shutting down...")
+    await heatmap_result_cache.close()
+    await job_status_broker.close()
     await session_manager.close()
     await close_http_client()
+    close_process_pool()
     close_qgis_application(qgis_application)
 
 
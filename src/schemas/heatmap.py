@@ -2,7 +2,7 @@ from enum import Enum
 from typing import List
 from uuid import UUID
 
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, constr, validator
 
 from src.core.config import settings
 from src.schemas.colors import ColorRangeType
@@ -37,6 +37,22 @@ TRAVELTIME_MATRIX_TABLE = {
     MotorizedRoutingHeatmapType.car.value: "basic.traveltime_matrix_car",
 }
 
+TRAVELTIME_MATRIX_INVERSE_TABLE = {
+    ActiveRoutingHeatmapType.walking: "basic.traveltime_matrix_walking_inverse",
+    ActiveRoutingHeatmapType.bicycle: "basic.traveltime_matrix_bicycle_inverse",
+    ActiveRoutingHeatmapType.pedelec.value: "basic.traveltime_matrix_pedelec_inverse",
+    MotorizedRoutingHeatmapType.public_transport.value: "basic.traveltime_matrix_pt_inverse",
+    MotorizedRoutingHeatmapType.car.value: "basic.traveltime_matrix_car_inverse",
+}
+
+TRAVELTIME_MATRIX_REACHABLE_AREA_TABLE = {
+    ActiveRoutingHeatmapType.walking: "basic.traveltime_matrix_walking_reachable_area",
+    ActiveRoutingHeatmapType.bicycle: "basic.traveltime_matrix_bicycle_reachable_area",
+    ActiveRoutingHeatmapType.pedelec.value: "basic.traveltime_matrix_pedelec_reachable_area",
+    MotorizedRoutingHeatmapType.public_transport.value: "basic.traveltime_matrix_pt_reachable_area",
+    MotorizedRoutingHeatmapType.car.value: "basic.traveltime_matrix_car_reachable_area",
+}
+
 
 TRAVELTIME_MATRIX_RESOLUTION = {
     ActiveRoutingHeatmapType.walking.value: 10,
@@ -122,6 +138,35 @@ class OpportunityGravityBased(OpportunityBase):
         return v
 
 
+class HeatmapDelta(BaseModel):
+    """Delta mode schema to update the result layer of a previous heatmap run."""
+
+    previous_result_id: int = Field(
+        ...,
+        title="Previous Result Layer Project ID",
+        description="The layer project ID of the result layer of a previous run with the same parameters. Its affected cells are recomputed in place.",
+    )
+    changed_h3_indexes: List[constr(regex=r"^[0-9a-fA-F]{15,16}$")] = Field(
+        ...,
+        title="Changed H3 Indexes",
+        description="The h3 cells containing the changed features, e.g. the old and new location of features edited in a scenario.",
+        min_items=1,
+    )
+
+
+def validate_output_resolution(routing_type, values):
+    output_resolution = values.get("output_resolution")
+    if output_resolution is None:
+        return
+    matrix_resolution = TRAVELTIME_MATRIX_RESOLUTION[routing_type]
+    if output_resolution > matrix_resolution:
+        raise ValueError(
+            f"Max supported output resolution for {routing_type} is {matrix_resolution}."
+        )
+    if output_resolution < matrix_resolution and values.get("delta"):
+        raise ValueError("Delta mode is not supported for a coarser output resolution.")
+
+
 class HeatmapGravityBase(BaseModel):
     """Gravity based heatmap schema."""
 
@@ -146,6 +191,17 @@ class HeatmapGravityBase(BaseModel):
         title="Opportunity geofence layer project ID",
         description="The layer project ID of a geofence to be used for limiting opportunities to a certain region.",
     )
+    output_resolution: int | None = Field(
+        None,
+        title="Output Resolution",
+        description="The H3 resolution of the result cells. A resolution coarser than the one of the travel time matrix stores the mean value of the cells per parent cell.",
+        ge=6,
+    )
+    delta: HeatmapDelta | None = Field(
+        None,
+        title="Delta",
+        description="Only recompute the cells of a previous result that are affected by the changed features.",
+    )
 
     def validate_max_traveltime(routing_type, values):
         max_traveltime = MaxTravelTimeTransportMode[routing_type].value
@@ -182,6 +238,17 @@ class HeatmapClosestAverageBase(BaseModel):
         title="Opportunity geofence layer project ID",
         description="The layer project ID of a geofence to be used for limiting opportunities to a certain region.",
     )
+    output_resolution: int | None = Field(
+        None,
+        title="Output Resolution",
+        description="The H3 resolution of the result cells. A resolution coarser than the one of the travel time matrix stores the mean value of the cells per parent cell.",
+        ge=6,
+    )
+    delta: HeatmapDelta | None = Field(
+        None,
+        title="Delta",
+        description="Only recompute the cells of a previous result that are affected by the changed features.",
+    )
 
     def validate_max_traveltime(routing_type, values):
         max_traveltime = MaxTravelTimeTransportMode[routing_type].value
@@ -220,6 +287,17 @@ class HeatmapConnectivityBase(BaseModel):
         title="Scenario ID",
         description="The ID of the scenario that is to be applied on the input layer or base network.",
     )
+    output_resolution: int | None = Field(
+        None,
+        title="Output Resolution",
+        description="The H3 resolution of the result cells. A resolution coarser than the one of the travel time matrix stores the mean value of the cells per parent cell.",
+        ge=6,
+    )
+    delta: HeatmapDelta | None = Field(
+        None,
+        title="Delta",
+        description="Only recompute the cells of a previous result that are affected by the changed features.",
+    )
 
     def validate_max_traveltime(routing_type, values):
         max_traveltime = MaxTravelTimeTransportMode[routing_type].value
@@ -245,6 +323,7 @@ class IHeatmapGravityActive(HeatmapGravityBase):
 
     @validator("routing_type")
     def validate_routing_type(cls, routing_type, values):
+        validate_output_resolution(routing_type, values)
         return super().validate_max_traveltime(routing_type, values)
 
     @property
@@ -276,6 +355,7 @@ class IHeatmapGravityMotorized(HeatmapGravityBase):
 
     @validator("routing_type")
     def validate_routing_type(cls, routing_type, values):
+        validate_output_resolution(routing_type, values)
         return super().validate_max_traveltime(routing_type, values)
 
     @property
@@ -307,6 +387,7 @@ class IHeatmapClosestAverageActive(HeatmapClosestAverageBase):
 
     @validator("routing_type")
     def validate_routing_type(cls, routing_type, values):
+        validate_output_resolution(routing_type, values)
         return super().validate_max_traveltime(routing_type, values)
 
     @property
@@ -338,6 +419,7 @@ class IHeatmapClosestAverageMotorized(HeatmapClosestAverageBase):
 
     @validator("routing_type")
     def validate_routing_type(cls, routing_type, values):
+        validate_output_resolution(routing_type, values)
         return super().validate_max_traveltime(routing_type, values)
 
     @property
@@ -369,6 +451,7 @@ class IHeatmapConnectivityActive(HeatmapConnectivityBase):
 
     @validator("routing_type")
     def validate_routing_type(cls, routing_type, values):
+        validate_output_resolution(routing_type, values)
         return super().validate_max_traveltime(routing_type, values)
 
     @property
@@ -400,6 +483,7 @@ class IHeatmapConnectivityMotorized(HeatmapConnectivityBase):
 
     @validator("routing_type")
     def validate_routing_type(cls, routing_type, values):
+        validate_output_resolution(routing_type, values)
         return super().validate_max_traveltime(routing_type, values)
 
     @property
@@ -418,4 +502,3 @@ class IHeatmapConnectivityMotorized(HeatmapConnectivityBase):
                 "color_scale": "quantile",
             }
         }
-
@@ -63,6 +63,7 @@ class JobStep(BaseModel):
     status: JobStatusType = JobStatusType.pending.value
     timestamp_start: datetime | None
     timestamp_end: datetime | None
+    duration: float | None
     msg: Msg | None
 
 
@@ -0,0 +1,130 @@
+import asyncio
+import sys
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import text
+
+from src.core.config import settings
+from src.core.heatmap import get_traveltime_matrix_version
+from src.db.session import session_manager
+from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_INVERSE_TABLE,
+    TRAVELTIME_MATRIX_REACHABLE_AREA_TABLE,
+    TRAVELTIME_MATRIX_TABLE,
+    ActiveRoutingHeatmapType,
+    MotorizedRoutingHeatmapType,
+)
+from src.utils import print_info
+
+ROUTING_TYPES = [routing_type.value for routing_type in ActiveRoutingHeatmapType] + [
+    routing_type.value for routing_type in MotorizedRoutingHeatmapType
+]
+
+
+async def build_traveltime_matrix_table(
+    async_session: AsyncSession,
+    routing_type: str,
+    table_name: str,
+    columns: str,
+    insert_function: str,
+    index_columns: str,
+):
+    """Build a table derived from a travel time matrix.
+
+    The table is built next to the existing one and swapped in once complete, so
+    the existing table can be used while it is refreshed. The version of the matrix
+    it was built from is recorded as the comment of the table, so that tables built
+    from a previous matrix aren't used.
+    """
+
+    matrix_table = TRAVELTIME_MATRIX_TABLE[routing_type]
+    matrix_version = await get_traveltime_matrix_version(async_session, routing_type)
+    new_table = f"{table_name}_new"
+    print_info(f"Building {table_name} from {matrix_table}")
+
+    # Create empty distributed table co-located with the travel time matrix
+    await async_session.execute(text(f"DROP TABLE IF EXISTS {new_table};"))
+    await async_session.execute(text(f"CREATE TABLE {new_table} ({columns});"))
+    await async_session.execute(
+        text(
+            f"""SELECT create_distributed_table('{new_table}', 'h3_3', colocate_with => '{matrix_table}')"""
+        )
+    )
+    await async_session.commit()
+
+    # Fill the table one origin partition at a time
+    result = await async_session.execute(
+        text(f"SELECT DISTINCT h3_3 FROM {matrix_table} ORDER BY h3_3")
+    )
+    partitions = [row[0] for row in result.fetchall()]
+    for i, h3_3 in enumerate(partitions):
+        await async_session.execute(
+            text(
+                f"""SELECT basic.{insert_function}(
+                    '{matrix_table}', '{new_table}', {h3_3}
+                )"""
+            )
+        )
+        await async_session.commit()
+        print_info(f"Processed partition {h3_3} ({i + 1}/{len(partitions)})")
+
+    # Add index and replace the existing table
+    await async_session.execute(text(f"CREATE INDEX ON {new_table} ({index_columns});"))
+    await async_session.execute(
+        text(f"COMMENT ON TABLE {new_table} IS '{matrix_version}';")
+    )
+    await async_session.execute(text(f"DROP TABLE IF EXISTS {table_name};"))
+    await async_session.execute(
+        text(f"ALTER TABLE {new_table} RENAME TO {table_name.split('.')[1]};")
+    )
+    await async_session.commit()
+    print_info(f"Table {table_name} has been built.")
+
+
+async def build_traveltime_matrix_inverse(
+    async_session: AsyncSession, routing_type: str
+):
+    """Build the inverse (destination -> origins) table of a travel time matrix."""
+
+    await build_traveltime_matrix_table(
+        async_session,
+        routing_type=routing_type,
+        table_name=TRAVELTIME_MATRIX_INVERSE_TABLE[routing_type],
+        columns="dest_id h3index, traveltime smallint, orig_id h3index[], h3_3 int",
+        insert_function="insert_traveltime_matrix_inverse",
+        index_columns="dest_id, h3_3, traveltime",
+    )
+
+
+async def build_traveltime_matrix_reachable_area(
+    async_session: AsyncSession, routing_type: str
+):
+    """Build the table of reachable cells per origin and minute of a matrix."""
+
+    await build_traveltime_matrix_table(
+        async_session,
+        routing_type=routing_type,
+        table_name=TRAVELTIME_MATRIX_REACHABLE_AREA_TABLE[routing_type],
+        columns="orig_id h3index, reachable_cells int[], h3_3 int",
+        insert_function="insert_traveltime_matrix_reachable_area",
+        index_columns="orig_id, h3_3",
+    )
+
+
+async def main():
+    # Build the tables of the specified or all routing types
+    routing_types = sys.argv[1:] or ROUTING_TYPES
+    for routing_type in routing_types:
+        if routing_type not in ROUTING_TYPES:
+            raise ValueError(f"Unknown routing type: {routing_type}")
+
+    session_manager.init(settings.ASYNC_SQLALCHEMY_DATABASE_URI)
+    async with session_manager.session() as async_session:
+        for routing_type in routing_types:
+            await build_traveltime_matrix_inverse(async_session, routing_type)
+            await build_traveltime_matrix_reachable_area(async_session, routing_type)
+    await session_manager.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,6 +7,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from utils import fetch_last_run_timestamp, update_last_run_timestamp
 
 from src.core.config import settings
+from src.core.http_client import close_http_client
 from src.core.print import PrintMap
 from src.crud.base import CRUDBase
 from src.crud.crud_layer_project import layer_project as crud_layer_project
@@ -167,6 +168,7 @@ async def main():
         # Set last run timestamp to current time
         await update_last_run_timestamp(async_session, system_task, current_run)
     await session_manager.close()
+    await close_http_client()
 
 
 if __name__ == "__main__":
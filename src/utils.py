@@ -1,5 +1,6 @@
 # Standard library imports
 import asyncio
+import email.utils
 import inspect
 import json
 import math
@@ -12,17 +13,16 @@ import subprocess
 import time
 import zipfile
 from functools import wraps
-from typing import Any, List, Type
+from typing import Any, Awaitable, Callable, Dict, List, Type
 from uuid import UUID
 
-import aiohttp
-
 # Third party imports
 import numpy as np
 from fastapi import UploadFile
 from geoalchemy2.shape import to_shape
 from geojson import Feature, FeatureCollection
 from geojson import loads as geojsonloads
+from httpx import AsyncClient
 from numba import njit
 from pydantic import BaseModel
 from pygeofilter.backends.sql import to_sql_where
@@ -63,6 +63,9 @@ async def table_exists(db: AsyncSession, schema_name: str, table_name: str) -> b
     return table_exists.scalar() > 0
 
 
+R5_TRAVEL_TIME_PERCENTILES = [5, 25, 50, 75, 95]
+
+
 def encode_r5_grid(grid_data: Any) -> bytes:
     """
     Encode raster grid data
@@ -82,16 +85,13 @@ def encode_r5_grid(grid_data: Any) -> bytes:
         dtype=np.int32,
     )
     header_bin = array.tobytes()
-    # - reshape the data
+    # - delta-encode each depth slice in a single pass
     grid_size = grid_data["width"] * grid_data["height"]
     if len(grid_data["data"]) == 0:
         data = np.array([], dtype=np.int32)
     else:
-        data = grid_data["data"].reshape(grid_data["depth"], grid_size)
-        reshaped_data = np.array([])
-        for i in range(grid_data["depth"]):
-            reshaped_data = np.append(reshaped_data, np.diff(data[i], prepend=0))
-        data = reshaped_data.astype(np.int32)
+        data = np.asarray(grid_data["data"]).reshape(grid_data["depth"], grid_size)
+        data = np.diff(data, axis=1, prepend=0).astype(np.int32, copy=False)
     z_diff_bin = data.tobytes()
 
     # - encode metadata
@@ -109,9 +109,16 @@ def encode_r5_grid(grid_data: Any) -> bytes:
     return binary_output
 
 
-def decode_r5_grid(grid_data_buffer: bytes) -> dict:
+def decode_r5_grid(
+    grid_data_buffer: bytes, percentile: int = None, out: np.ndarray = None
+) -> dict:
     """
     Decode R5 grid data
+
+    The buffer can be any object exposing the buffer protocol (bytes, memoryview,
+    mmap) and is read without copying. If a percentile is given, only the depth
+    slice of that percentile is decoded. The decoded values can be written into a
+    preallocated (e.g. memory-mapped) int32 array passed as `out`.
     """
     CURRENT_VERSION = 0
     HEADER_ENTRIES = 7
@@ -121,50 +128,54 @@ def decode_r5_grid(grid_data_buffer: bytes) -> dict:
     # -- PARSE HEADER
     ## - get header type
     header = {}
-    header_data = np.frombuffer(grid_data_buffer, count=8, dtype=np.byte)
-    header_type = "".join(map(chr, header_data))
+    buffer = memoryview(grid_data_buffer).cast("B")
+    header_type = bytes(buffer[:8]).decode("ascii", errors="replace")
     if header_type != TIMES_GRID_TYPE:
         raise ValueError("Invalid grid type")
     ## - get header data
-    header_raw = np.frombuffer(
-        grid_data_buffer, count=HEADER_ENTRIES, offset=8, dtype=np.int32
-    )
-    version = header_raw[0]
+    header_raw = np.frombuffer(buffer, count=HEADER_ENTRIES, offset=8, dtype=np.int32)
+    version = int(header_raw[0])
     if version != CURRENT_VERSION:
         raise ValueError("Invalid grid version")
-    header["zoom"] = header_raw[1]
-    header["west"] = header_raw[2]
-    header["north"] = header_raw[3]
-    header["width"] = header_raw[4]
-    header["height"] = header_raw[5]
-    header["depth"] = header_raw[6]
+    header["zoom"] = int(header_raw[1])
+    header["west"] = int(header_raw[2])
+    header["north"] = int(header_raw[3])
+    header["width"] = int(header_raw[4])
+    header["height"] = int(header_raw[5])
+    header["depth"] = int(header_raw[6])
     header["version"] = version
 
     # -- PARSE DATA --
-    gridSize = header["width"] * header["height"]
-    # - skip the header
+    grid_size = header["width"] * header["height"]
+    # - view the delta-encoded data as (depth, grid_size) without copying
     data = np.frombuffer(
-        grid_data_buffer,
+        buffer,
         offset=HEADER_LENGTH * 4,
-        count=gridSize * header["depth"],
+        count=grid_size * header["depth"],
         dtype=np.int32,
-    )
-    # - reshape the data
-    data = data.reshape(header["depth"], gridSize)
-    reshaped_data = np.array([], dtype=np.int32)
-    for i in range(header["depth"]):
-        reshaped_data = np.append(reshaped_data, data[i].cumsum())
-    data = reshaped_data
+    ).reshape(header["depth"], grid_size)
+    # - select only the requested percentile slice if specified
+    if percentile is not None:
+        percentile_index = (
+            0 if header["depth"] == 1 else R5_TRAVEL_TIME_PERCENTILES.index(percentile)
+        )
+        data = data[percentile_index : percentile_index + 1]
+    # - decode all remaining slices in a single pass
+    if out is not None:
+        data = np.cumsum(data, axis=1, dtype=np.int32, out=out.reshape(data.shape))
+    else:
+        data = np.cumsum(data, axis=1, dtype=np.int32)
+    data = data.reshape(-1)
+
     # - decode metadata
-    raw_metadata = np.frombuffer(
-        grid_data_buffer,
-        offset=(HEADER_LENGTH + header["width"] * header["height"] * header["depth"])
-        * 4,
-        dtype=np.int8,
-    )
-    metadata = json.loads(raw_metadata.tostring())
+    metadata_offset = (HEADER_LENGTH + grid_size * header["depth"]) * 4
+    metadata = json.loads(bytes(buffer[metadata_offset:]))
 
-    return header | metadata | {"data": data, "errors": [], "warnings": []}
+    return (
+        header
+        | metadata
+        | {"data": data, "percentile": percentile, "errors": [], "warnings": []}
+    )
 
 
 def compute_r5_surface(grid: dict, percentile: int) -> np.array:
@@ -178,11 +189,14 @@ def compute_r5_surface(grid: dict, percentile: int) -> np.array:
         or grid["depth"] is None
     ):
         return None
-    travel_time_percentiles = [5, 25, 50, 75, 95]
-    percentile_index = travel_time_percentiles.index(percentile)
+    percentile_index = R5_TRAVEL_TIME_PERCENTILES.index(percentile)
+    if grid.get("percentile") not in (None, percentile):
+        raise ValueError(
+            f"Grid was decoded for percentile {grid['percentile']}, not {percentile}"
+        )
 
-    if grid["depth"] == 1:
-        # if only one percentile is requested, return the grid as is
+    if grid["depth"] == 1 or grid.get("percentile") == percentile:
+        # if only one percentile is requested or decoded, return the grid as is
         surface = grid["data"]
     else:
         grid_percentiles = np.reshape(grid["data"], (grid["depth"], -1))
@@ -509,25 +523,102 @@ def build_insert_query(
 
 
 async def async_get_with_retry(
-    url: str, headers: dict, num_retries: int, retry_delay: int
+    http_client: AsyncClient, url: str, headers: dict, num_retries: int, retry_delay: int
 ):
-    async with aiohttp.ClientSession() as session:
-        for i in range(num_retries):
-            async with session.get(url, headers=headers) as response:
-                if response.status != 200:
-                    # Server is still processing request, retry shortly
-                    if i == num_retries - 1:
-                        raise Exception(
-                            "GEOAPI-Server took too long to process request. It can be that the layer is not properly processed yet."
-                        )
-                    await asyncio.sleep(retry_delay)
-                    continue
-                elif response.status == 200:
-                    # Server has finished processing request, break
-                    result = await response.text()
-                    return result
-                else:
-                    raise Exception(await response.text())
+    for i in range(num_retries):
+        response = await http_client.get(url, headers=headers)
+        if response.status_code != 200:
+            # Server is still processing request, retry shortly
+            if i == num_retries - 1:
+                raise Exception(
+                    "GEOAPI-Server took too long to process request. It can be that the layer is not properly processed yet."
+                )
+            await asyncio.sleep(retry_delay)
+            continue
+        elif response.status_code == 200:
+            # Server has finished processing request, break
+            return response.text
+        else:
+            raise Exception(response.text)
+
+
+polling_metrics: Dict[str, Dict[str, float]] = {}
+
+
+def get_retry_after(response) -> float | None:
+    """Get the number of seconds to wait according to the Retry-After header."""
+
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+async def poll_endpoint(
+    request: Callable[[], Awaitable[Any]],
+    endpoint: str,
+    timeout: float = settings.JOB_TIMEOUT_DEFAULT,
+    pending_status_code: int = 202,
+):
+    """
+    Poll an endpoint until it has finished processing a request.
+
+    The interval between polls starts at CRUD_POLL_INITIAL_INTERVAL and grows
+    exponentially with jitter up to CRUD_RETRY_INTERVAL, unless the endpoint specifies
+    it in the Retry-After header. Metrics are recorded per endpoint.
+
+    :param request: Coroutine function sending the request and returning the response.
+    :param endpoint: The name of the endpoint used for the metrics.
+    :param timeout: The number of seconds after which polling is given up.
+    :param pending_status_code: The status code of responses to unfinished requests.
+
+    :return: The first response with a status code other than the pending one.
+    """
+
+    metrics = polling_metrics.setdefault(
+        endpoint,
+        {"requests": 0, "polls": 0, "errors": 0, "timeouts": 0, "total_duration": 0.0},
+    )
+    metrics["requests"] += 1
+    start = time.monotonic()
+    deadline = start + timeout
+    interval = settings.CRUD_POLL_INITIAL_INTERVAL
+
+    try:
+        while True:
+            response = await request()
+            metrics["polls"] += 1
+            if response.status_code != pending_status_code:
+                return response
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics["timeouts"] += 1
+                raise TimeoutError(
+                    f"Endpoint did not finish processing the request within {timeout} seconds."
+                )
+
+            # Endpoint is still processing request, retry shortly
+            delay = get_retry_after(response)
+            if delay is None:
+                delay = random.uniform(interval / 2, interval)
+                interval = min(interval * 2, settings.CRUD_RETRY_INTERVAL)
+            await asyncio.sleep(min(delay, remaining))
+    except TimeoutError:
+        raise
+    except Exception:
+        metrics["errors"] += 1
+        raise
+    finally:
+        metrics["total_duration"] += time.monotonic() - start
 
 
 def hex_to_rgb(hex: str) -> tuple:
@@ -605,3 +696,7 @@ def format_value_null_sql(value) -> str:
         return "NULL"
     else:
         return f"'{value}'"
+
+
+def format_h3_array_sql(h3_indexes: List[str]) -> str:
+    return "'{" + ",".join(h3_indexes) + "}'::h3index[]"
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import logging
+import signal
+import socket
+import uuid
+
+from src.core.config import settings
+from src.core.heatmap_cache import heatmap_result_cache
+from src.core.http_client import create_http_client
+from src.core.job import CRUDFailedJob
+from src.core.job_queue import claim_job, release_job, renew_lease, run_task
+from src.core.job_status import job_status_broker
+from src.core.r5_region import r5_region_index
+from src.db.session import session_manager
+from src.endpoints.deps import close_qgis_application, initialize_qgis_application
+from src.jsoline import close_process_pool
+from src.schemas.error import UnknownError
+from src.schemas.job import JobStatusType
+
+# Create a logger object for the worker
+worker_logger = logging.getLogger("Job worker")
+worker_logger.setLevel(logging.INFO)
+handler = logging.StreamHandler()
+formatter = logging.Formatter(
+    "\033[92m%(levelname)s\033[0m: %(asctime)s %(name)s %(message)s"
+)
+handler.setFormatter(formatter)
+worker_logger.addHandler(handler)
+
+
+class JobQueueWorker:
+    """Worker process running the jobs of the job queue.
+
+    The worker claims jobs while it runs less than its concurrency and renews the
+    leases of its running jobs. Jobs of a worker that stops renewing its leases,
+    e.g. because its pod died, are claimed again by other workers.
+    """
+
+    def __init__(self, concurrency: int):
+        self.worker_id = f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.concurrency = concurrency
+        self.running = {}
+        self.stopping = asyncio.Event()
+        self.http_client = None
+
+    async def run_job(self, job: dict):
+        job_id = job["id"]
+        task = job["task"] if isinstance(job["task"], dict) else json.loads(job["task"])
+        worker_logger.info(f"Job {job_id} claimed (attempt {job['attempts']}).")
+        heartbeat = asyncio.create_task(self.heartbeat(job_id))
+        status, msg_simple = None, None
+        try:
+            async with session_manager.session() as async_session:
+                # Clean up after a previous attempt that was abandoned
+                if job["attempts"] > 1:
+                    crud_failed_job = CRUDFailedJob(
+                        job_id, None, async_session, job["user_id"]
+                    )
+                    await crud_failed_job.delete_temp_tables()
+                    await crud_failed_job.delete_created_layers()
+                await run_task(
+                    task,
+                    job_id=job_id,
+                    async_session=async_session,
+                    user_id=job["user_id"],
+                    project_id=job["project_id"],
+                    http_client=self.http_client,
+                )
+        except Exception as e:
+            # Errors in the job are handled by the job itself, so this failed the task
+            worker_logger.exception(f"Job {job_id} could not be run.")
+            status = JobStatusType.failed
+            msg_simple = f"{UnknownError.__name__}: {str(e)}"
+        finally:
+            heartbeat.cancel()
+            async with session_manager.session() as async_session:
+                await release_job(
+                    async_session, job_id, self.worker_id, status, msg_simple
+                )
+
+    async def heartbeat(self, job_id):
+        while True:
+            await asyncio.sleep(settings.JOB_QUEUE_HEARTBEAT_INTERVAL)
+            try:
+                async with session_manager.session() as async_session:
+                    if not await renew_lease(async_session, job_id, self.worker_id):
+                        break
+            except Exception as e:
+                worker_logger.warning(f"Could not renew lease of job {job_id}: {e}")
+
+        # Stop running the job as it may have been claimed by another worker
+        worker_logger.warning(f"Lost the lease of job {job_id}, cancelling it.")
+        task = self.running.get(job_id)
+        if task is not None:
+            task.cancel()
+
+    async def claim(self):
+        async with session_manager.session() as async_session:
+            return await claim_job(async_session, self.worker_id)
+
+    async def run(self):
+        worker_logger.info(f"Worker {self.worker_id} started.")
+        while not self.stopping.is_set():
+            job = None
+            if len(self.running) < self.concurrency:
+                try:
+                    job = await self.claim()
+                except Exception as e:
+                    worker_logger.warning(f"Could not claim a job: {e}")
+
+            if job is not None:
+                task = asyncio.create_task(self.run_job(job))
+                self.running[job["id"]] = task
+                task.add_done_callback(
+                    lambda _, job_id=job["id"]: self.running.pop(job_id, None)
+                )
+                continue
+
+            # Wait before polling again unless the worker is stopped
+            try:
+                await asyncio.wait_for(
+                    self.stopping.wait(), timeout=settings.JOB_QUEUE_POLL_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                pass
+
+        # Finish the running jobs before exiting
+        worker_logger.info(f"Worker {self.worker_id} stopping.")
+        await asyncio.gather(*self.running.values(), return_exceptions=True)
+
+    def stop(self):
+        self.stopping.set()
+
+
+async def main():
+    session_manager.init(settings.ASYNC_SQLALCHEMY_DATABASE_URI)
+    qgis_application = initialize_qgis_application()
+    try:
+        # Load the R5 region mapping into memory
+        async with session_manager.session() as async_session:
+            await r5_region_index.load(async_session)
+    except Exception as e:
+        worker_logger.warning(f"Could not load the R5 region mapping: {str(e)}")
+    # Invalidate cached heatmap results when layers change
+    heatmap_result_cache.listen(settings.POSTGRES_DATABASE_URI)
+    # Cancel the running jobs when they are killed
+    job_status_broker.listen(settings.POSTGRES_DATABASE_URI)
+
+    worker = JobQueueWorker(concurrency=settings.JOB_QUEUE_WORKER_CONCURRENCY)
+    worker.http_client = create_http_client()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+
+    try:
+        await worker.run()
+    finally:
+        await worker.http_client.aclose()
+        await heatmap_result_cache.close()
+        await job_status_broker.close()
+        await session_manager.close()
+        close_process_pool()
+        close_qgis_application(qgis_application)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
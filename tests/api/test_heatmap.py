@@ -1,9 +1,13 @@
 from typing import List
+from uuid import uuid4
 
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import text
 
 from src.core.config import settings
+from src.crud.crud_heatmap import CRUDHeatmapBase
+from src.crud.crud_layer import layer as crud_layer
 from src.schemas.heatmap import (
     ActiveRoutingHeatmapType,
     ImpedanceFunctionType,
@@ -328,3 +332,27 @@ async def test_heatmap_connectivity(
     # Check if job is finished
     job = await check_job_status(client, response.json()["job_id"])
     assert job["status_simple"] == "finished"
+
+
+@pytest.mark.asyncio
+async def test_heatmap_layer_versions(db_session, fixture_create_feature_layer):
+    layer = await crud_layer.get_internal(
+        db_session, id=fixture_create_feature_layer["id"]
+    )
+    crud_heatmap = CRUDHeatmapBase(uuid4(), None, db_session, layer.user_id, None)
+    layers = [{"layer_id": layer.id, "table_name": layer.table_name}]
+    version = (await crud_heatmap.get_layer_versions(layers))[str(layer.id)]
+
+    # Feature edits change the version without updating the layer row
+    await db_session.execute(
+        text(
+            f"""
+            DELETE FROM {layer.table_name}
+            WHERE id = (SELECT id FROM {layer.table_name} WHERE layer_id = '{layer.id}' LIMIT 1);
+            """
+        )
+    )
+    await db_session.commit()
+    new_version = (await crud_heatmap.get_layer_versions(layers))[str(layer.id)]
+    assert new_version[0] == version[0]
+    assert new_version != version
@@ -1,7 +1,12 @@
+from uuid import uuid4
+
 import pytest
 from httpx import AsyncClient
 
 from src.core.config import settings
+from src.core.job_profiler import JobProfiler, current_job_profiler
+from src.crud.crud_job import job as crud_job
+from src.schemas.job import JobStatusType, JobType
 from tests.utils import get_with_wrong_id, upload_valid_files
 
 
@@ -36,6 +41,82 @@ async def test_mark_jobs_as_read(client: AsyncClient, fixture_create_feature_lay
     assert response.json()[0]["read"] is True
 
 
+@pytest.mark.asyncio
+async def test_update_job_status(db_session, fixture_create_user):
+    job = await crud_job.check_and_create(
+        async_session=db_session,
+        user_id=fixture_create_user,
+        job_type=JobType.oev_gueteklasse,
+    )
+    job = await crud_job.update_status(
+        async_session=db_session,
+        job_id=job.id,
+        job_step_name="station_category",
+        status=JobStatusType.running,
+        msg_text="Job is running.",
+    )
+    assert job.status_simple == JobStatusType.running.value
+    assert job.status["station_category"]["timestamp_start"] is not None
+    assert job.status["station_category"]["timestamp_end"] is None
+
+    # Finish a step and start the next one
+    job = await crud_job.update_status(
+        async_session=db_session,
+        job_id=job.id,
+        job_step_name="station_category",
+        status=JobStatusType.finished,
+        msg_text="Job finished successfully.",
+    )
+    job = await crud_job.update_status(
+        async_session=db_session,
+        job_id=job.id,
+        job_step_name="station_buffer",
+        status=JobStatusType.running,
+        msg_text="Job is running.",
+    )
+    assert job.status["station_category"]["status"] == JobStatusType.finished.value
+    assert job.status["station_category"]["duration"] >= 0
+    assert job.status["station_buffer"]["status"] == JobStatusType.running.value
+
+    # A killed job stays killed
+    job = await crud_job.update(
+        db=db_session, db_obj=job, obj_in={"status_simple": "killed"}
+    )
+    job = await crud_job.update_status(
+        async_session=db_session,
+        job_id=job.id,
+        job_step_name="station_buffer",
+        status=JobStatusType.finished,
+        msg_text="Job finished successfully.",
+    )
+    assert job.status_simple == JobStatusType.killed.value
+    assert job.status["station_buffer"]["status"] == JobStatusType.killed.value
+
+
+@pytest.mark.asyncio
+async def test_profiled_statement_is_executed_once(db_session):
+    table = f"temporal.profiler_{uuid4().hex}"
+    await db_session.execute(f"CREATE TABLE {table} (id int);")
+    profiler = JobProfiler(uuid4(), explain=True)
+    token = current_job_profiler.set(profiler)
+    try:
+        result = await db_session.execute(
+            f"INSERT INTO {table} SELECT generate_series(1, 10);"
+        )
+        assert result.rowcount == 10
+    finally:
+        current_job_profiler.reset(token)
+
+    # The plan is stored without executing the statement a second time
+    count = await db_session.execute(f"SELECT count(*) FROM {table};")
+    assert count.scalar() == 10
+    statement = profiler.dict()["statements"][0]
+    assert statement["rows"] == 10
+    assert statement["plan"][0]["Plan"]["Node Type"] == "ModifyTable"
+    await db_session.execute(f"DROP TABLE {table};")
+    await db_session.commit()
+
+
 # @pytest.mark.asyncio
 # async def test_kill_job(client: AsyncClient, fixture_create_user):
 #     # # Create large geojson file out of valid.geojson by duplicating the features
@@ -0,0 +1,98 @@
+import pytest
+from sqlalchemy import text
+
+from src.core.config import settings
+from src.core.job_queue import claim_job, enqueue_job, release_job, renew_lease
+from src.crud.crud_job import job as crud_job
+from src.schemas.job import JobStatusType, JobType
+
+TASK = {
+    "tool": "src.crud.crud_geoprocessing:CRUDBuffer",
+    "method": "buffer_run",
+    "kwargs": {},
+}
+
+
+async def create_queued_job(db_session, user_id, job_type: JobType):
+    job = await crud_job.check_and_create(
+        async_session=db_session, user_id=user_id, job_type=job_type
+    )
+    await enqueue_job(db_session, job.id, TASK)
+    return job.id
+
+
+@pytest.fixture
+def job_queue_settings(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_QUEUE_MAX_JOBS_PER_USER", 2)
+    monkeypatch.setattr(settings, "JOB_QUEUE_MAX_JOBS_PER_TYPE", {})
+    monkeypatch.setattr(settings, "JOB_QUEUE_MAX_ATTEMPTS", 2)
+
+
+@pytest.mark.asyncio
+async def test_claim_job_by_priority(
+    db_session, fixture_create_user, job_queue_settings
+):
+    heatmap_job_id = await create_queued_job(
+        db_session, fixture_create_user, JobType.heatmap_gravity_active_mobility
+    )
+    catchment_area_job_id = await create_queued_job(
+        db_session, fixture_create_user, JobType.catchment_area_active_mobility
+    )
+
+    # The catchment area is claimed first although it was queued last
+    job = await claim_job(db_session, "worker-1")
+    assert job["id"] == catchment_area_job_id
+    assert job["attempts"] == 1
+    job = await claim_job(db_session, "worker-2")
+    assert job["id"] == heatmap_job_id
+    assert await renew_lease(db_session, heatmap_job_id, "worker-2")
+    assert not await renew_lease(db_session, heatmap_job_id, "worker-1")
+
+
+@pytest.mark.asyncio
+async def test_claim_job_user_limit(
+    db_session, fixture_create_user, job_queue_settings
+):
+    job_ids = [
+        await create_queued_job(db_session, fixture_create_user, JobType.buffer)
+        for _ in range(3)
+    ]
+
+    assert (await claim_job(db_session, "worker-1"))["id"] == job_ids[0]
+    assert (await claim_job(db_session, "worker-1"))["id"] == job_ids[1]
+    assert await claim_job(db_session, "worker-1") is None
+
+    # A slot is free again once a job is done
+    await release_job(db_session, job_ids[0], "worker-1", JobStatusType.finished)
+    assert (await claim_job(db_session, "worker-1"))["id"] == job_ids[2]
+
+
+@pytest.mark.asyncio
+async def test_claim_job_expired_lease(
+    db_session, fixture_create_user, job_queue_settings
+):
+    job_id = await create_queued_job(db_session, fixture_create_user, JobType.buffer)
+    expire_lease = text(
+        f"""
+        UPDATE {settings.CUSTOMER_SCHEMA}.job
+        SET lease_expires_at = now() - interval '1 second'
+        WHERE id = :job_id
+        """
+    )
+
+    # The job is claimed again by another worker after the lease expired
+    assert (await claim_job(db_session, "worker-1"))["id"] == job_id
+    await db_session.execute(expire_lease, {"job_id": job_id})
+    await db_session.commit()
+    job = await claim_job(db_session, "worker-2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+    # The job fails once it was abandoned too often
+    await db_session.execute(expire_lease, {"job_id": job_id})
+    await db_session.commit()
+    assert await claim_job(db_session, "worker-3") is None
+    job = await crud_job.get(db=db_session, id=job_id)
+    await db_session.refresh(job)
+    assert job.status_simple == JobStatusType.failed.value
+    assert job.worker_id is None
@@ -0,0 +1,338 @@
+"""Benchmarks of the heatmap queries on synthetic travel time matrices.
+
+The benchmarks run against the configured PostGIS + Citus + h3 database and are
+skipped unless sizes are selected, e.g.:
+
+    HEATMAP_BENCHMARK_SIZES=city,region pytest tests/benchmark
+
+The synthetic tables are kept in the heatmap_benchmark schema and reused by later
+runs. Wall time, result rows and the query plan of each run are written to the
+file set by HEATMAP_BENCHMARK_OUTPUT.
+"""
+
+import json
+import os
+import time
+from uuid import uuid4
+
+import pytest
+from sqlalchemy.sql import text
+
+from src.crud.crud_heatmap_closest_average import CRUDHeatmapClosestAverage
+from src.crud.crud_heatmap_connectivity import CRUDHeatmapConnectivity
+from src.crud.crud_heatmap_gravity import CRUDHeatmapGravity
+from src.schemas.heatmap import (
+    TRAVELTIME_MATRIX_TABLE,
+    ActiveRoutingHeatmapType,
+    IHeatmapClosestAverageActive,
+    IHeatmapConnectivityActive,
+    IHeatmapGravityActive,
+    ImpedanceFunctionType,
+)
+
+BENCHMARK_SCHEMA = "heatmap_benchmark"
+BENCHMARK_SIZES = [
+    size for size in os.environ.get("HEATMAP_BENCHMARK_SIZES", "").split(",") if size
+]
+BENCHMARK_OUTPUT = os.environ.get("HEATMAP_BENCHMARK_OUTPUT", "heatmap_benchmark.json")
+
+# Radius of the origin cells around the center in grid steps and number of opportunities
+SIZES = {
+    "city": {"radius": 30, "opportunities": 2000},
+    "region": {"radius": 100, "opportunities": 20000},
+    "state": {"radius": 200, "opportunities": 100000},
+}
+CENTER = (11.575, 48.137)
+RESOLUTION = 10
+MAX_TRAVELTIME = 30
+
+pytestmark = pytest.mark.skipif(
+    not BENCHMARK_SIZES, reason="No heatmap benchmark sizes selected"
+)
+
+results = []
+
+
+@pytest.fixture(scope="module", autouse=True)
+def write_results():
+    yield
+    with open(BENCHMARK_OUTPUT, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+
+
+async def create_table(async_session, table_name: str, columns: str, query: str):
+    """Create a distributed benchmark table unless it exists from a previous run."""
+
+    result = await async_session.execute(
+        text(f"SELECT to_regclass('{table_name}') IS NOT NULL;")
+    )
+    if result.scalar():
+        return
+    await async_session.execute(text(f"CREATE TABLE {table_name} ({columns});"))
+    await async_session.execute(
+        text(f"SELECT create_distributed_table('{table_name}', 'h3_3');")
+    )
+    await async_session.execute(text("SELECT setseed(0.42);"))
+    await async_session.execute(text(f"INSERT INTO {table_name} {query};"))
+    await async_session.execute(text(f"CREATE INDEX ON {table_name} (h3_3);"))
+    await async_session.execute(text(f"ANALYZE {table_name};"))
+    await async_session.commit()
+
+
+async def create_benchmark_tables(async_session, size: str):
+    """Create a synthetic travel time matrix and opportunity tables of a size.
+
+    Every cell in the radius around the center is an origin reaching the cells of
+    the k-th ring around it in k minutes.
+    """
+
+    radius = SIZES[size]["radius"]
+    n_opportunities = SIZES[size]["opportunities"]
+    center = f"h3_lat_lng_to_cell(POINT({CENTER[0]}, {CENTER[1]}), {RESOLUTION})"
+    h3_3 = "basic.to_short_h3_3(h3_cell_to_parent(cell, 3)::bigint)"
+    random_cells = f"""
+        SELECT cell FROM h3_grid_disk({center}, {radius}) cell
+        ORDER BY random() LIMIT {n_opportunities}
+    """
+    tables = {
+        "matrix": f"{BENCHMARK_SCHEMA}.traveltime_matrix_{size}",
+        "gravity": f"{BENCHMARK_SCHEMA}.gravity_opportunities_{size}",
+        "closest_average": f"{BENCHMARK_SCHEMA}.closest_average_opportunities_{size}",
+        "connectivity": f"{BENCHMARK_SCHEMA}.reference_area_{size}",
+        "reachable_area": f"{BENCHMARK_SCHEMA}.reachable_area_{size}",
+    }
+
+    await async_session.execute(
+        text(f"CREATE SCHEMA IF NOT EXISTS {BENCHMARK_SCHEMA};")
+    )
+    await create_table(
+        async_session,
+        tables["matrix"],
+        "orig_id h3index, h3_3 int, traveltime smallint, dest_id h3index[]",
+        f"""
+        SELECT cell, {h3_3}, traveltime, ARRAY(SELECT h3_grid_ring_unsafe(cell, traveltime))
+        FROM h3_grid_disk({center}, {radius}) cell, generate_series(0, {MAX_TRAVELTIME}) traveltime
+        """,
+    )
+    await create_table(
+        async_session,
+        tables["gravity"],
+        "id uuid, h3_index h3index, max_traveltime smallint, sensitivity float, potential float, h3_3 int",
+        f"""
+        SELECT basic.uuid_generate_v7(), cell, 20, 300000, 1 + random() * 9, {h3_3}
+        FROM ({random_cells}) opportunity
+        """,
+    )
+    await create_table(
+        async_session,
+        tables["closest_average"],
+        "id uuid, h3_index h3index, max_traveltime smallint, num_destinations int, h3_3 int",
+        f"""
+        SELECT basic.uuid_generate_v7(), cell, 20, 3, {h3_3}
+        FROM ({random_cells}) opportunity
+        """,
+    )
+    await create_table(
+        async_session,
+        tables["connectivity"],
+        "id uuid, h3_index h3index, h3_3 int",
+        f"""
+        SELECT basic.uuid_generate_v7(), cell, {h3_3}
+        FROM h3_grid_disk({center}, {radius // 2}) cell
+        """,
+    )
+
+    # Build the reachable area per origin like build_traveltime_matrix_tables
+    result = await async_session.execute(
+        text(f"SELECT to_regclass('{tables['reachable_area']}') IS NOT NULL;")
+    )
+    if not result.scalar():
+        await async_session.execute(
+            text(
+                f"CREATE TABLE {tables['reachable_area']} (orig_id h3index, reachable_cells int[], h3_3 int);"
+            )
+        )
+        await async_session.execute(
+            text(
+                f"SELECT create_distributed_table('{tables['reachable_area']}', 'h3_3');"
+            )
+        )
+        result = await async_session.execute(
+            text(f"SELECT DISTINCT h3_3 FROM {tables['matrix']};")
+        )
+        for partition in [row[0] for row in result.fetchall()]:
+            await async_session.execute(
+                text(
+                    f"""SELECT basic.insert_traveltime_matrix_reachable_area(
+                        '{tables['matrix']}', '{tables['reachable_area']}', {partition}
+                    )"""
+                )
+            )
+        await async_session.commit()
+
+    await async_session.execute(
+        text(
+            f"""
+            CREATE TABLE IF NOT EXISTS {BENCHMARK_SCHEMA}.result (
+                layer_id uuid, geom geometry, text_attr1 text, float_attr1 float
+            );
+            """
+        )
+    )
+    await async_session.commit()
+    return tables
+
+
+async def run_benchmark(async_session, query: str, result_layer_id: str, **record):
+    """Run a heatmap query and record its wall time, rows and plan."""
+
+    result_table = f"{BENCHMARK_SCHEMA}.result"
+    start = time.perf_counter()
+    await async_session.execute(text(query))
+    await async_session.commit()
+    wall_time = time.perf_counter() - start
+
+    result = await async_session.execute(
+        text(
+            f"SELECT COUNT(*) FROM {result_table} WHERE layer_id = '{result_layer_id}';"
+        )
+    )
+    rows = result.scalar()
+
+    # Execute once more to get the plan with actual timings and row counts
+    result = await async_session.execute(
+        text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}")
+    )
+    plan = result.scalar()
+    await async_session.execute(
+        text(f"DELETE FROM {result_table} WHERE layer_id = '{result_layer_id}';")
+    )
+    await async_session.commit()
+
+    results.append(record | {"wall_time": wall_time, "rows": rows, "plan": plan})
+    assert rows > 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", list(SIZES))
+@pytest.mark.parametrize(
+    "impedance_function",
+    [
+        ImpedanceFunctionType.gaussian,
+        ImpedanceFunctionType.linear,
+        ImpedanceFunctionType.exponential,
+        ImpedanceFunctionType.power,
+    ],
+)
+async def test_heatmap_gravity_benchmark(
+    db_session, monkeypatch, size, impedance_function
+):
+    if size not in BENCHMARK_SIZES:
+        pytest.skip(f"Size {size} not selected")
+    tables = await create_benchmark_tables(db_session, size)
+    monkeypatch.setitem(
+        TRAVELTIME_MATRIX_TABLE, ActiveRoutingHeatmapType.walking, tables["matrix"]
+    )
+
+    params = IHeatmapGravityActive(
+        routing_type=ActiveRoutingHeatmapType.walking,
+        impedance_function=impedance_function,
+        opportunities=[
+            {
+                "opportunity_layer_project_id": 1,
+                "max_traveltime": 20,
+                "sensitivity": 300000,
+            }
+        ],
+    )
+    result_layer_id = str(uuid4())
+    crud = CRUDHeatmapGravity(None, None, db_session, None, None)
+    await run_benchmark(
+        db_session,
+        crud.build_query(
+            params=params,
+            opportunity_table=tables["gravity"],
+            max_traveltime=20,
+            max_sensitivity=1000000,
+            result_table=f"{BENCHMARK_SCHEMA}.result",
+            result_layer_id=result_layer_id,
+        ),
+        result_layer_id,
+        heatmap="gravity",
+        size=size,
+        impedance_function=impedance_function.value,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", list(SIZES))
+async def test_heatmap_closest_average_benchmark(db_session, monkeypatch, size):
+    if size not in BENCHMARK_SIZES:
+        pytest.skip(f"Size {size} not selected")
+    tables = await create_benchmark_tables(db_session, size)
+    monkeypatch.setitem(
+        TRAVELTIME_MATRIX_TABLE, ActiveRoutingHeatmapType.walking, tables["matrix"]
+    )
+
+    params = IHeatmapClosestAverageActive(
+        routing_type=ActiveRoutingHeatmapType.walking,
+        opportunities=[
+            {
+                "opportunity_layer_project_id": 1,
+                "max_traveltime": 20,
+                "number_of_destinations": 3,
+            }
+        ],
+    )
+    result_layer_id = str(uuid4())
+    crud = CRUDHeatmapClosestAverage(None, None, db_session, None, None)
+    await run_benchmark(
+        db_session,
+        crud.build_query(
+            params=params,
+            opportunity_table=tables["closest_average"],
+            result_table=f"{BENCHMARK_SCHEMA}.result",
+            result_layer_id=result_layer_id,
+        ),
+        result_layer_id,
+        heatmap="closest_average",
+        size=size,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", list(SIZES))
+@pytest.mark.parametrize("use_reachable_area", [False, True])
+async def test_heatmap_connectivity_benchmark(
+    db_session, monkeypatch, size, use_reachable_area
+):
+    if size not in BENCHMARK_SIZES:
+        pytest.skip(f"Size {size} not selected")
+    tables = await create_benchmark_tables(db_session, size)
+    monkeypatch.setitem(
+        TRAVELTIME_MATRIX_TABLE, ActiveRoutingHeatmapType.walking, tables["matrix"]
+    )
+
+    params = IHeatmapConnectivityActive(
+        routing_type=ActiveRoutingHeatmapType.walking,
+        reference_area_layer_project_id=1,
+        max_traveltime=20,
+    )
+    result_layer_id = str(uuid4())
+    crud = CRUDHeatmapConnectivity(None, None, db_session, None, None)
+    await run_benchmark(
+        db_session,
+        crud.build_query(
+            params=params,
+            reference_area_table=tables["connectivity"],
+            result_table=f"{BENCHMARK_SCHEMA}.result",
+            result_layer_id=result_layer_id,
+            reachable_area_table=(
+                tables["reachable_area"] if use_reachable_area else None
+            ),
+        ),
+        result_layer_id,
+        heatmap="connectivity",
+        size=size,
+        use_reachable_area=use_reachable_area,
+    )
@@ -0,0 +1,194 @@
+"""Benchmarks of the in-process heatmap engine on synthetic travel time matrices.
+
+The benchmarks are skipped unless enabled, e.g.:
+
+    HEATMAP_ENGINE_BENCHMARK=1 pytest tests/benchmark/test_heatmap_engine_benchmark.py
+
+The closest-average benchmark compares the bounded selection of the closest
+opportunities with sorting all reachable opportunities like the SQL query. The
+mean wall time of each run is written to the file set by
+HEATMAP_ENGINE_BENCHMARK_OUTPUT.
+"""
+
+import json
+import os
+import timeit
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import pytest
+from numba import njit
+
+from src.core.heatmap import compute_closest_average, get_cell_opportunities
+from src.schemas.heatmap import ImpedanceFunctionType
+from tests.unit.test_heatmap import (
+    create_inverse_rows,
+    create_matrix,
+    create_matrix_rows,
+    create_opportunities,
+    run_heatmap_gravity,
+)
+
+BENCHMARK_OUTPUT = os.environ.get(
+    "HEATMAP_ENGINE_BENCHMARK_OUTPUT", "heatmap_engine_benchmark.json"
+)
+NUMBER = 3
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("HEATMAP_ENGINE_BENCHMARK"),
+    reason="Heatmap engine benchmark not enabled",
+)
+
+results = []
+
+
+@pytest.fixture(scope="module", autouse=True)
+def write_results():
+    yield
+    with open(BENCHMARK_OUTPUT, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+
+
+@njit
+def compute_closest_average_sort(
+    cell_origin,
+    origin_start,
+    origin_end,
+    traveltimes,
+    bucket_offsets,
+    destinations,
+    cell_opportunity_offsets,
+    cell_opportunities,
+    opportunity_group,
+    opportunity_max_traveltime,
+    group_category,
+    category_num_destinations,
+):
+    """Same as compute_closest_average, but sorting all reachable opportunities.
+
+    This follows the SQL query, which aggregates the traveltime of every opportunity
+    reaching a cell in order before keeping the closest ones.
+    """
+
+    max_traveltime = opportunity_max_traveltime.max()
+    values = np.full(len(cell_origin), np.nan, dtype=np.float64)
+    found = np.zeros(len(category_num_destinations), dtype=np.int64)
+    stamp = np.full(len(group_category), -1, dtype=np.int64)
+    reachable_traveltime = np.empty(len(group_category), dtype=np.float64)
+    reachable_category = np.empty(len(group_category), dtype=np.int64)
+
+    for i in range(len(cell_origin)):
+        origin = cell_origin[i]
+        if origin < 0:
+            continue
+        n_reachable = 0
+        for bucket in range(origin_start[origin], origin_end[origin]):
+            traveltime = traveltimes[bucket]
+            if traveltime > max_traveltime:
+                break
+            for k in range(bucket_offsets[bucket], bucket_offsets[bucket + 1]):
+                cell = destinations[k]
+                for j in range(
+                    cell_opportunity_offsets[cell], cell_opportunity_offsets[cell + 1]
+                ):
+                    opportunity = cell_opportunities[j]
+                    group = opportunity_group[opportunity]
+                    if (
+                        stamp[group] == i
+                        or traveltime > opportunity_max_traveltime[opportunity]
+                    ):
+                        continue
+                    stamp[group] = i
+                    reachable_traveltime[n_reachable] = traveltime
+                    reachable_category[n_reachable] = group_category[group]
+                    n_reachable += 1
+
+        found[:] = 0
+        n_found = 0
+        total_traveltime = 0.0
+        for j in np.argsort(reachable_traveltime[:n_reachable], kind="mergesort"):
+            category = reachable_category[j]
+            if found[category] < category_num_destinations[category]:
+                found[category] += 1
+                n_found += 1
+                total_traveltime += reachable_traveltime[j]
+        if n_found > 0:
+            values[i] = total_traveltime / n_found
+
+    return values
+
+
+@pytest.mark.parametrize(
+    "impedance_function",
+    [ImpedanceFunctionType.gaussian, ImpedanceFunctionType.linear],
+)
+def test_heatmap_gravity_benchmark(impedance_function):
+    cells, rows = create_matrix_rows(n_origins=2000, n_cells=4000)
+    opportunities = create_opportunities(cells, n_opportunities=20000)
+    matrix = create_matrix(rows)
+
+    # Compile before measuring
+    run_heatmap_gravity(matrix, opportunities[:1], impedance_function, 30)
+    elapsed = timeit.timeit(
+        lambda: run_heatmap_gravity(matrix, opportunities, impedance_function, 30),
+        number=NUMBER,
+    )
+    results.append(
+        {
+            "tool": "heatmap_gravity",
+            "impedance_function": impedance_function,
+            "wall_time": elapsed / NUMBER,
+        }
+    )
+
+
+@pytest.mark.parametrize("num_destinations", [1, 5, 20])
+def test_heatmap_closest_average_benchmark(num_destinations):
+    cells, rows = create_matrix_rows(n_origins=2000, n_cells=4000)
+    opportunities = create_opportunities(cells, n_opportunities=20000)
+    inverse_matrix = create_matrix(create_inverse_rows(rows))
+
+    # Select the closest opportunities of all cells of the inverse matrix
+    group, groups = pd.factorize(opportunities["id"])
+    category_num_destinations, group_category = np.unique(
+        np.full(len(groups), num_destinations), return_inverse=True
+    )
+    cell_opportunity_offsets, cell_opportunities = get_cell_opportunities(
+        inverse_matrix.cells, opportunities["h3_index"].to_numpy()
+    )
+    args = (
+        np.arange(len(inverse_matrix.origins)),
+        inverse_matrix.origin_start,
+        inverse_matrix.origin_end,
+        inverse_matrix.traveltimes,
+        inverse_matrix.bucket_offsets,
+        inverse_matrix.destinations,
+        cell_opportunity_offsets,
+        cell_opportunities,
+        group.astype(np.int64),
+        opportunities["max_traveltime"].to_numpy(dtype=np.float64),
+        group_category.astype(np.int64).reshape(-1),
+        category_num_destinations.astype(np.int64),
+    )
+
+    values = {}
+    wall_time = {}
+    for selection, compute in [
+        ("bounded", compute_closest_average),
+        ("sort", compute_closest_average_sort),
+    ]:
+        # Compile before measuring
+        values[selection] = compute(*args)
+        elapsed = timeit.timeit(partial(compute, *args), number=NUMBER)
+        wall_time[selection] = elapsed / NUMBER
+        results.append(
+            {
+                "tool": "heatmap_closest_average",
+                "selection": selection,
+                "num_destinations": num_destinations,
+                "wall_time": wall_time[selection],
+            }
+        )
+    np.testing.assert_allclose(values["bounded"], values["sort"])
+    assert wall_time["bounded"] < wall_time["sort"]
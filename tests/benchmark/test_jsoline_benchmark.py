@@ -0,0 +1,48 @@
+"""Benchmarks of tracing jsolines on synthetic travel time surfaces.
+
+The benchmarks are skipped unless enabled, e.g.:
+
+    JSOLINE_BENCHMARK=1 pytest tests/benchmark/test_jsoline_benchmark.py
+
+The mean wall time per number of steps is written to the file set by
+JSOLINE_BENCHMARK_OUTPUT.
+"""
+
+import json
+import os
+import timeit
+
+import numpy as np
+import pytest
+
+from tests.unit.test_jsoline import create_surface, run_jsolines
+
+BENCHMARK_OUTPUT = os.environ.get("JSOLINE_BENCHMARK_OUTPUT", "jsoline_benchmark.json")
+NUMBER = 3
+
+pytestmark = pytest.mark.skipif(
+    not os.environ.get("JSOLINE_BENCHMARK"), reason="Jsoline benchmark not enabled"
+)
+
+results = []
+
+
+@pytest.fixture(scope="module", autouse=True)
+def write_results():
+    yield
+    with open(BENCHMARK_OUTPUT, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+@pytest.mark.parametrize("steps", [10, 30, 60])
+def test_jsolines_benchmark(steps):
+    width, height = 400, 400
+    surface = create_surface(width, height, noise=1.0)
+    cutoffs = np.arange(start=60 / steps, stop=61, step=60 / steps)
+
+    # Compile before measuring
+    run_jsolines(surface, width, height, cutoffs[:1])
+    elapsed = timeit.timeit(
+        lambda: run_jsolines(surface, width, height, cutoffs), number=NUMBER
+    )
+    results.append({"steps": steps, "wall_time": elapsed / NUMBER})
@@ -0,0 +1,65 @@
+"""Benchmarks of decoding and encoding R5 travel time grids.
+
+The benchmarks are skipped unless enabled, e.g.:
+
+    R5_GRID_BENCHMARK=1 pytest tests/benchmark/test_r5_grid_benchmark.py
+
+The mean wall time of each function is written to the file set by
+R5_GRID_BENCHMARK_OUTPUT.
+"""
+
+import json
+import os
+import timeit
+
+import pytest
+
+from src.utils import decode_r5_grid, encode_r5_grid
+from tests.unit.test_r5_grid import R5_GRID_FIXTURE
+
+BENCHMARK_OUTPUT = os.environ.get("R5_GRID_BENCHMARK_OUTPUT", "r5_grid_benchmark.json")
+NUMBER = 20
+
+pytestmark = [
+    pytest.mark.skipif(
+        not os.environ.get("R5_GRID_BENCHMARK"), reason="R5 grid benchmark not enabled"
+    ),
+    pytest.mark.skipif(
+        not os.path.exists(R5_GRID_FIXTURE), reason="R5 grid fixture not available."
+    ),
+]
+
+results = []
+
+
+@pytest.fixture(scope="module", autouse=True)
+def write_results():
+    yield
+    with open(BENCHMARK_OUTPUT, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+@pytest.fixture(scope="module")
+def grid_bin():
+    with open(R5_GRID_FIXTURE, mode="rb") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("percentile", [None, 5])
+def test_r5_grid_decode_benchmark(grid_bin, percentile):
+    elapsed = timeit.timeit(
+        lambda: decode_r5_grid(grid_bin, percentile=percentile), number=NUMBER
+    )
+    results.append(
+        {
+            "function": "decode_r5_grid",
+            "percentile": percentile,
+            "wall_time": elapsed / NUMBER,
+        }
+    )
+
+
+def test_r5_grid_encode_benchmark(grid_bin):
+    decoded = decode_r5_grid(grid_bin)
+    elapsed = timeit.timeit(lambda: encode_r5_grid(decoded), number=NUMBER)
+    results.append({"function": "encode_r5_grid", "wall_time": elapsed / NUMBER})
@@ -0,0 +1,63 @@
+import pytest
+from pydantic import ValidationError
+
+from src.schemas.heatmap import HeatmapDelta, IHeatmapConnectivityActive
+
+
+def test_heatmap_delta_valid():
+    # Test with valid h3 indexes
+    try:
+        HeatmapDelta(
+            previous_result_id=1,
+            changed_h3_indexes=["8a1f8d2a4a7ffff", "8a1f8d2a4b07fff"],
+        )
+    except ValidationError:
+        pytest.fail("ValidationError was raised unexpectedly!")
+
+
+def test_heatmap_delta_invalid_h3_index():
+    # Test with a value that is not a h3 index
+    with pytest.raises(ValidationError):
+        HeatmapDelta(previous_result_id=1, changed_h3_indexes=["8a1f8d2a4b07fff'--"])
+
+
+def test_heatmap_delta_no_changed_cells():
+    # Test without changed cells
+    with pytest.raises(ValidationError):
+        HeatmapDelta(previous_result_id=1, changed_h3_indexes=[])
+
+
+def test_heatmap_output_resolution_valid():
+    # Test with a coarser resolution than the walking matrix
+    try:
+        IHeatmapConnectivityActive(
+            routing_type="walking",
+            reference_area_layer_project_id=1,
+            max_traveltime=10,
+            output_resolution=8,
+        )
+    except ValidationError:
+        pytest.fail("ValidationError was raised unexpectedly!")
+
+
+def test_heatmap_output_resolution_finer_than_matrix():
+    # Test with a finer resolution than the walking matrix
+    with pytest.raises(ValidationError):
+        IHeatmapConnectivityActive(
+            routing_type="walking",
+            reference_area_layer_project_id=1,
+            max_traveltime=10,
+            output_resolution=11,
+        )
+
+
+def test_heatmap_output_resolution_delta():
+    # Test delta mode with a coarser resolution
+    with pytest.raises(ValidationError):
+        IHeatmapConnectivityActive(
+            routing_type="walking",
+            reference_area_layer_project_id=1,
+            max_traveltime=10,
+            output_resolution=8,
+            delta={"previous_result_id": 1, "changed_h3_indexes": ["8a1f8d2a4a7ffff"]},
+        )
@@ -0,0 +1,290 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.core.heatmap import (
+    TravelTimeMatrix,
+    delete_traveltime_matrix_versions,
+    get_h3_3,
+    get_reached_cells,
+    heatmap_closest_average,
+    heatmap_gravity,
+)
+from src.schemas.heatmap import ImpedanceFunctionType
+
+MAX_SENSITIVITY = 1000000
+
+
+def create_matrix_rows(n_origins=50, n_cells=400, max_traveltime=30, seed=42):
+    """Rows of a synthetic travel time matrix table (orig_id, traveltime, dest_id)."""
+
+    rng = np.random.default_rng(seed)
+    cells = np.sort(rng.choice(2**40, size=n_cells, replace=False)) + 2**50
+    rows = []
+    for origin in rng.choice(cells, size=n_origins, replace=False):
+        # Assign every reachable destination to a single traveltime
+        reachable = rng.choice(cells, size=rng.integers(1, n_cells // 2), replace=False)
+        traveltime = rng.integers(0, max_traveltime + 1, size=len(reachable))
+        for value in np.unique(traveltime):
+            rows.append((origin, value, reachable[traveltime == value]))
+    rng.shuffle(rows)
+    return cells, rows
+
+
+def create_matrix(rows):
+    return TravelTimeMatrix.from_rows(
+        orig_ids=[row[0] for row in rows],
+        traveltimes=[row[1] for row in rows],
+        dest_counts=[len(row[2]) for row in rows],
+        dest_ids=np.concatenate([row[2] for row in rows]),
+    )
+
+
+def create_inverse_rows(rows):
+    """Rows of the inverse travel time matrix table (dest_id, traveltime, orig_id)."""
+
+    inverse = pd.DataFrame(
+        [(dest, row[1], row[0]) for row in rows for dest in row[2]],
+        columns=["dest_id", "traveltime", "orig_id"],
+    )
+    return [
+        (dest_id, traveltime, group["orig_id"].to_numpy())
+        for (dest_id, traveltime), group in inverse.groupby(["dest_id", "traveltime"])
+    ]
+
+
+def create_opportunities(cells, n_opportunities=200, seed=42):
+    """Opportunities where some cover multiple cells like polygons do."""
+
+    rng = np.random.default_rng(seed)
+    opportunities = pd.DataFrame(
+        {
+            "id": rng.integers(0, n_opportunities // 2, size=n_opportunities),
+            "h3_index": rng.choice(cells, size=n_opportunities),
+        }
+    )
+    groups = opportunities["id"].unique()
+    parameters = pd.DataFrame(
+        {
+            "id": groups,
+            "max_traveltime": rng.integers(5, 31, size=len(groups)),
+            "sensitivity": rng.uniform(100000, 500000, size=len(groups)),
+            "potential": rng.uniform(1, 10, size=len(groups)),
+            "num_destinations": rng.choice([1, 3, 5], size=len(groups)),
+        }
+    )
+    return opportunities.merge(parameters, on="id")
+
+
+def heatmap_gravity_sql(rows, opportunities, impedance_function, max_traveltime):
+    """Reference implementation following the SQL query of CRUDHeatmapGravity."""
+
+    matrix = pd.DataFrame(
+        [(row[0], row[1], dest) for row in rows for dest in row[2]],
+        columns=["orig_id", "traveltime", "dest_id"],
+    )
+    sub_matrix = opportunities.merge(matrix, left_on="h3_index", right_on="orig_id")
+    sub_matrix = sub_matrix[sub_matrix["traveltime"] <= sub_matrix["max_traveltime"]]
+    grouped = sub_matrix.groupby(
+        ["id", "dest_id", "sensitivity", "potential"], as_index=False
+    )["traveltime"].min()
+
+    t = grouped["traveltime"].astype(float) / max_traveltime
+    s = grouped["sensitivity"] / MAX_SENSITIVITY
+    if impedance_function == ImpedanceFunctionType.gaussian:
+        weight = np.exp(-(t**2) / s)
+    elif impedance_function == ImpedanceFunctionType.linear:
+        weight = 1 - t
+    elif impedance_function == ImpedanceFunctionType.exponential:
+        weight = np.exp(-s * t)
+    else:
+        weight = t ** (-s)
+    grouped["accessibility"] = weight * grouped["potential"]
+    return grouped.groupby("dest_id")["accessibility"].sum()
+
+
+def run_heatmap_gravity(matrix, opportunities, impedance_function, max_traveltime):
+    group, groups = pd.factorize(opportunities["id"])
+    parameters = opportunities.groupby("id").first().loc[groups]
+    return heatmap_gravity(
+        matrix,
+        opportunity_h3_index=opportunities["h3_index"].to_numpy(),
+        opportunity_group=group,
+        opportunity_max_traveltime=opportunities["max_traveltime"].to_numpy(),
+        group_sensitivity=parameters["sensitivity"].to_numpy(),
+        group_potential=parameters["potential"].to_numpy(),
+        impedance_function=impedance_function,
+        max_traveltime=max_traveltime,
+        max_sensitivity=MAX_SENSITIVITY,
+    )
+
+
+def heatmap_closest_average_sql(rows, opportunities):
+    """Reference implementation following the SQL query of CRUDHeatmapClosestAverage."""
+
+    matrix = pd.DataFrame(
+        [(row[0], row[1], dest) for row in rows for dest in row[2]],
+        columns=["orig_id", "traveltime", "dest_id"],
+    )
+    sub_matrix = opportunities.merge(matrix, left_on="h3_index", right_on="orig_id")
+    sub_matrix = sub_matrix[sub_matrix["traveltime"] <= sub_matrix["max_traveltime"]]
+    grouped = sub_matrix.groupby(["id", "dest_id", "num_destinations"], as_index=False)[
+        "traveltime"
+    ].min()
+
+    # Keep the closest opportunities per number of destinations
+    grouped = grouped.sort_values("traveltime", kind="stable")
+    rank = grouped.groupby(["dest_id", "num_destinations"]).cumcount()
+    closest = grouped[rank < grouped["num_destinations"]]
+    return closest.groupby("dest_id")["traveltime"].mean()
+
+
+def run_heatmap_closest_average(matrix, inverse_matrix, opportunities):
+    group, groups = pd.factorize(opportunities["id"])
+    parameters = opportunities.groupby("id").first().loc[groups]
+    return heatmap_closest_average(
+        inverse_matrix,
+        get_reached_cells(
+            matrix,
+            opportunity_h3_index=opportunities["h3_index"].to_numpy(),
+            opportunity_max_traveltime=opportunities["max_traveltime"].to_numpy(),
+        ),
+        opportunity_h3_index=opportunities["h3_index"].to_numpy(),
+        opportunity_group=group,
+        opportunity_max_traveltime=opportunities["max_traveltime"].to_numpy(),
+        group_num_destinations=parameters["num_destinations"].to_numpy(),
+    )
+
+
+@pytest.mark.parametrize(
+    "impedance_function",
+    [
+        ImpedanceFunctionType.gaussian,
+        ImpedanceFunctionType.linear,
+        ImpedanceFunctionType.exponential,
+    ],
+)
+def test_heatmap_gravity_matches_sql(impedance_function):
+    cells, rows = create_matrix_rows()
+    opportunities = create_opportunities(cells)
+    max_traveltime = opportunities["max_traveltime"].max()
+
+    expected = heatmap_gravity_sql(
+        rows, opportunities, impedance_function, max_traveltime
+    )
+    h3_index, accessibility = run_heatmap_gravity(
+        create_matrix(rows), opportunities, impedance_function, max_traveltime
+    )
+
+    np.testing.assert_array_equal(h3_index, expected.index.to_numpy())
+    np.testing.assert_allclose(accessibility, expected.to_numpy(), rtol=1e-12)
+
+
+def test_heatmap_gravity_aggregated_opportunities():
+    cells, rows = create_matrix_rows()
+    opportunities = create_opportunities(cells[:50], n_opportunities=400)
+    opportunities["max_traveltime"] = 30
+    opportunities["sensitivity"] = 300000
+    max_traveltime = 30
+
+    # Merge opportunities covering a single cell like aggregate_opportunity_table
+    cell_count = opportunities.groupby("id")["h3_index"].transform("count")
+    single_cell = opportunities[cell_count == 1]
+    aggregated = pd.concat(
+        [
+            single_cell.groupby(
+                ["h3_index", "max_traveltime", "sensitivity"], as_index=False
+            )["potential"]
+            .sum()
+            .assign(id=lambda df: -1 - df.index),
+            opportunities[cell_count > 1],
+        ]
+    )
+    assert len(aggregated) < len(opportunities)
+
+    expected = heatmap_gravity_sql(
+        rows, opportunities, ImpedanceFunctionType.gaussian, max_traveltime
+    )
+    result = heatmap_gravity_sql(
+        rows, aggregated, ImpedanceFunctionType.gaussian, max_traveltime
+    )
+    np.testing.assert_array_equal(result.index, expected.index)
+    np.testing.assert_allclose(result.to_numpy(), expected.to_numpy(), rtol=1e-12)
+
+
+def test_traveltime_matrix_partitions(tmp_path):
+    cells, rows = create_matrix_rows()
+    opportunities = create_opportunities(cells)
+    matrix = create_matrix(rows)
+
+    # Split the matrix by origin into two partitions and combine them again
+    origins = np.unique([row[0] for row in rows])
+    partitions = []
+    for i, partition_origins in enumerate(np.array_split(origins, 2)):
+        path = str(tmp_path / str(i))
+        create_matrix([row for row in rows if row[0] in set(partition_origins)]).save(
+            path
+        )
+        partitions.append(TravelTimeMatrix.load(path))
+    combined = TravelTimeMatrix.concatenate(partitions[::-1])
+
+    for result, expected in zip(
+        run_heatmap_gravity(
+            combined, opportunities, ImpedanceFunctionType.gaussian, 30
+        ),
+        run_heatmap_gravity(matrix, opportunities, ImpedanceFunctionType.gaussian, 30),
+        strict=True,
+    ):
+        np.testing.assert_allclose(result, expected)
+
+
+def test_traveltime_matrix_versions(tmp_path):
+    cells, rows = create_matrix_rows()
+    for version in ["1_1", "1_2"]:
+        create_matrix(rows).save(str(tmp_path / version / "0"))
+
+    # Only the partitions of the current version of the matrix table are kept
+    delete_traveltime_matrix_versions(str(tmp_path), "1_2")
+    assert [path.name for path in tmp_path.iterdir()] == ["1_2"]
+    assert len(TravelTimeMatrix.load(str(tmp_path / "1_2" / "0")).origins) > 0
+
+
+def test_heatmap_gravity_unknown_origin():
+    cells, rows = create_matrix_rows()
+    opportunities = create_opportunities(cells)
+    opportunities["h3_index"] = 1
+
+    h3_index, accessibility = run_heatmap_gravity(
+        create_matrix(rows), opportunities, ImpedanceFunctionType.linear, 30
+    )
+    assert len(h3_index) == len(accessibility) == 0
+
+
+@pytest.mark.parametrize("n_opportunities", [2, 20, 200, 1000])
+def test_heatmap_closest_average_matches_sql(n_opportunities):
+    cells, rows = create_matrix_rows()
+    opportunities = create_opportunities(cells, n_opportunities=n_opportunities)
+
+    expected = heatmap_closest_average_sql(rows, opportunities)
+    h3_index, traveltime = run_heatmap_closest_average(
+        create_matrix(rows), create_matrix(create_inverse_rows(rows)), opportunities
+    )
+
+    np.testing.assert_array_equal(h3_index, expected.index.to_numpy())
+    np.testing.assert_allclose(traveltime, expected.to_numpy(), rtol=1e-12)
+
+
+def test_heatmap_closest_average_unknown_origin():
+    cells, rows = create_matrix_rows()
+    opportunities = create_opportunities(cells)
+    opportunities["h3_index"] = 1
+
+    h3_index, traveltime = run_heatmap_closest_average(
+        create_matrix(rows), create_matrix(create_inverse_rows(rows)), opportunities
+    )
+    assert len(h3_index) == len(traveltime) == 0
+
+
+def test_h3_3_of_cell_and_parent():
+    # A resolution 10 cell and its parent at resolution 3
+    assert get_h3_3([0x8A1FB46622DFFFF, 0x831FB4FFFFFFFFF]).tolist() == [0x1FB4] * 2
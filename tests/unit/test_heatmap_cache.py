@@ -0,0 +1,74 @@
+import asyncio
+from uuid import uuid4
+
+from src.core.heatmap_cache import HeatmapResultCache
+
+
+def test_heatmap_cache_key_is_normalized():
+    params = {"routing_type": "walking", "opportunities": [{"max_traveltime": 10}]}
+
+    assert HeatmapResultCache.get_key(params=params) == HeatmapResultCache.get_key(
+        params=dict(reversed(params.items()))
+    )
+    assert HeatmapResultCache.get_key(params=params) != HeatmapResultCache.get_key(
+        params=params | {"routing_type": "bicycle"}
+    )
+
+
+def test_heatmap_cache_hit_and_eviction():
+    cache = HeatmapResultCache(max_entries=2)
+    result_layer_ids = [uuid4() for _ in range(3)]
+
+    assert cache.get("a") is None
+    for key, layer_id in zip(["a", "b", "c"], result_layer_ids, strict=True):
+        cache.put(key, layer_id, "user_data.polygon_1", input_layer_ids=[])
+        # Keep the first entry recently used
+        cache.get("a")
+
+    assert cache.get("a")["layer_id"] == str(result_layer_ids[0])
+    assert cache.get("b") is None
+    assert cache.get("c")["layer_id"] == str(result_layer_ids[2])
+    assert cache.stats()["entries"] == 2
+
+
+def test_heatmap_cache_invalidation():
+    cache = HeatmapResultCache(max_entries=10)
+    input_layer_id, result_layer_id = uuid4(), uuid4()
+    cache.put("a", result_layer_id, "user_data.polygon_1", [input_layer_id])
+    cache.put("b", uuid4(), "user_data.polygon_1", [uuid4()])
+
+    # Inserted layers and unrelated layers keep the entries
+    cache.handle_notification(None, 0, "layer_changes", f"INSERT:{input_layer_id}")
+    cache.handle_notification(None, 0, "layer_changes", f"UPDATE:{uuid4().hex}")
+    assert cache.stats()["entries"] == 2
+
+    cache.handle_notification(None, 0, "layer_changes", f"UPDATE:{input_layer_id.hex}")
+    assert cache.get("a") is None
+    cache.put("a", result_layer_id, "user_data.polygon_1", [input_layer_id])
+    cache.handle_notification(None, 0, "layer_changes", f"DELETE:{result_layer_id}")
+    assert cache.get("a") is None
+    assert cache.get("b") is not None
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_heatmap_cache_disabled():
+    cache = HeatmapResultCache(max_entries=0)
+    cache.put("a", uuid4(), "user_data.polygon_1", [])
+
+    assert not cache.enabled
+    assert cache.get("a") is None
+
+
+def test_heatmap_cache_listener_interrupted():
+    cache = HeatmapResultCache(max_entries=10)
+    cache.put("a", uuid4(), "user_data.polygon_1", [])
+
+    # The cache is bypassed while layer changes may be missed
+    cache.listener.task = object()
+    assert cache.get("a") is None
+    cache.put("b", uuid4(), "user_data.polygon_1", [])
+    assert cache.stats()["entries"] == 1
+
+    # The entries are cleared once the listener is connected again
+    asyncio.run(cache.handle_connect(None))
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,66 @@
+import asyncio
+from uuid import uuid4
+
+from src.core.config import settings
+from src.core.job_profiler import (
+    JobProfiler,
+    current_job_profiler,
+    normalize_statement,
+    run_in_executor,
+)
+
+
+def test_normalize_statement():
+    first = normalize_statement(
+        "SELECT * FROM user_data.point_3fa85f6457174562b3fc2c963f66afa6\n"
+        "WHERE id = 1 AND name = 'a'"
+    )
+    second = normalize_statement(
+        "SELECT *  FROM user_data.point_0fa85f6457174562b3fc2c963f66afa0 "
+        "WHERE id = 22 AND name = 'b'"
+    )
+    assert first == second
+    assert first == "SELECT * FROM user_data.point_? WHERE id = ? AND name = ?"
+
+
+def test_job_profiler_record(monkeypatch):
+    monkeypatch.setattr(settings, "JOB_PROFILING_MAX_ENTRIES", 2)
+    profiler = JobProfiler(uuid4())
+    profiler.record(profiler.statements, "a", 1.0, rows=10, plan={"plan": 1})
+    profiler.record(profiler.statements, "a", 2.0, rows=5, plan={"plan": 2})
+    profiler.record(profiler.statements, "b", 4.0, rows=-1)
+    profiler.record(profiler.statements, "c", 0.5)
+
+    # The entries with the largest wall time are kept
+    statements = profiler.dict()["statements"]
+    assert [statement["name"] for statement in statements] == ["b", "a"]
+    assert statements[1]["count"] == 2
+    assert statements[1]["wall_time"] == 3.0
+    assert statements[1]["max_wall_time"] == 2.0
+    assert statements[1]["rows"] == 15
+    # The plan of the slowest execution is kept
+    assert statements[1]["plan"] == {"plan": 2}
+    assert "rows" not in statements[0]
+
+
+def test_run_in_executor_records_cpu_time():
+    def add(a, b):
+        return a + b
+
+    async def run():
+        # Functions of jobs that aren't profiled aren't recorded
+        assert await run_in_executor(None, add, 1, b=2) == 3
+
+        profiler = JobProfiler(uuid4())
+        token = current_job_profiler.set(profiler)
+        try:
+            assert await run_in_executor(None, add, 1, b=2) == 3
+        finally:
+            current_job_profiler.reset(token)
+        return profiler
+
+    functions = asyncio.run(run()).dict()["functions"]
+    assert len(functions) == 1
+    assert functions[0]["name"] == "add"
+    assert functions[0]["count"] == 1
+    assert functions[0]["cpu_time"] >= 0
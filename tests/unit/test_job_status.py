@@ -0,0 +1,133 @@
+import asyncio
+import json
+from uuid import uuid4
+
+import pytest
+
+from src.core import notification_listener
+from src.core.job_cancellation import job_cancellation
+from src.core.job_status import JOB_STATUS_CHANNEL, JobStatusBroker
+
+
+def notify(broker: JobStatusBroker, user_id, **event):
+    payload = json.dumps({"user_id": str(user_id)} | event)
+    broker.handle_notification(None, 0, "job_status", payload)
+
+
+def test_job_status_fan_out():
+    broker = JobStatusBroker(max_queue_size=10)
+    user_id, other_user_id = uuid4(), uuid4()
+
+    with broker.subscribe(user_id) as queue, broker.subscribe(str(user_id)) as queue2:
+        assert broker.stats() == {"users": 1, "subscribers": 2}
+        notify(broker, user_id, id="a", status_simple="running")
+        notify(broker, other_user_id, id="b", status_simple="running")
+
+        assert queue.qsize() == queue2.qsize() == 1
+        assert queue.get_nowait()["id"] == "a"
+
+    # Subscribers are removed when they disconnect
+    assert broker.stats() == {"users": 0, "subscribers": 0}
+    notify(broker, user_id, id="a", status_simple="finished")
+
+
+def test_job_status_slow_subscriber():
+    broker = JobStatusBroker(max_queue_size=2)
+    user_id = uuid4()
+
+    with broker.subscribe(user_id) as queue:
+        for status in ["pending", "running", "finished"]:
+            notify(broker, user_id, id="a", status_simple=status)
+
+        # The oldest events are dropped
+        assert queue.get_nowait()["status_simple"] == "running"
+        assert queue.get_nowait()["status_simple"] == "finished"
+
+
+def test_job_status_cancels_killed_jobs():
+    broker = JobStatusBroker(max_queue_size=10)
+    job_id = uuid4()
+
+    async def run_step():
+        step = asyncio.ensure_future(asyncio.sleep(10))
+        with job_cancellation.register(job_id, step):
+            notify(broker, uuid4(), id=str(job_id), status_simple="running")
+            assert not job_cancellation.is_cancelled(job_id)
+            notify(broker, uuid4(), id=str(job_id), status_simple="killed")
+            assert job_cancellation.is_cancelled(job_id)
+            with pytest.raises(asyncio.CancelledError):
+                await step
+
+    asyncio.run(run_step())
+    assert not job_cancellation.is_cancelled(job_id)
+    assert not job_cancellation.cancel(job_id)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.termination_listeners = []
+        self.listeners = {}
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    async def execute(self, query):
+        pass
+
+    def is_closed(self):
+        return self.closed
+
+    def terminate(self):
+        if not self.closed:
+            self.closed = True
+            for callback in self.termination_listeners:
+                callback(self)
+
+    async def close(self):
+        self.terminate()
+
+
+def test_job_status_listener_reconnects(monkeypatch):
+    broker = JobStatusBroker(max_queue_size=10)
+    broker.listener.min_backoff = 0.01
+    connections = []
+
+    async def connect(dsn):
+        # Fail the first attempt, as if the database was not reachable yet
+        if not connections:
+            connections.append(None)
+            raise OSError("Connection refused")
+        connections.append(FakeConnection())
+        return connections[-1]
+
+    monkeypatch.setattr(
+        notification_listener.asyncpg, "connect", connect, raising=False
+    )
+
+    async def wait_connected():
+        while not broker.connected:
+            await asyncio.sleep(0.01)
+
+    async def run():
+        broker.listen("postgresql://")
+        await asyncio.wait_for(wait_connected(), timeout=1)
+        assert len(connections) == 2
+        assert JOB_STATUS_CHANNEL in connections[-1].listeners
+
+        with broker.subscribe(uuid4()) as queue:
+            # Streams end when the connection is lost, and the listener reconnects
+            connections[-1].terminate()
+            assert await asyncio.wait_for(queue.get(), timeout=1) is None
+            await asyncio.wait_for(wait_connected(), timeout=1)
+            assert len(connections) == 3
+            assert broker.listener.disconnects == 1
+
+        await broker.close()
+        assert not broker.connected
+        assert connections[-1].is_closed()
+
+    asyncio.run(run())
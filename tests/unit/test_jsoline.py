@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+import shapely
+
+from src.jsoline import get_contour, grid_cells, jsolines
+
+
+def create_surface(width=80, height=60, noise=0.0, lake=False):
+    """Radial travel time surface around the center of the grid."""
+
+    rng = np.random.default_rng(42)
+    y, x = np.mgrid[0:height, 0:width]
+    center_x, center_y = width / 2, height / 2
+    surface = np.hypot(x - center_x, y - center_y) + rng.normal(
+        0, noise, size=(height, width)
+    )
+    if lake:
+        # Unreachable area creating a hole in the isochrones
+        surface[np.hypot(x - center_x - 8, y - center_y) < 4] = 200
+    return np.clip(surface, 0, 65535).astype(np.uint16).ravel()
+
+
+def run_jsolines(surface, width, height, cutoffs, **kwargs):
+    return jsolines(surface, width, height, 68000, 44000, 9, cutoffs=cutoffs, **kwargs)
+
+
+def test_jsolines_nested_isochrones():
+    width, height = 80, 60
+    cutoffs = np.arange(5, 26, 5)
+    isochrones = run_jsolines(
+        create_surface(width, height), width, height, cutoffs, return_incremental=True
+    )
+
+    full = isochrones["full"]
+    assert list(full["minute"]) == list(cutoffs)
+    assert all(geom.is_valid and not geom.is_empty for geom in full.geometry)
+    areas = [geom.area for geom in full.geometry]
+    assert areas == sorted(areas)
+    assert full.geometry[0].within(full.geometry[len(cutoffs) - 1].buffer(1e-9))
+    assert len(isochrones["incremental"]) == len(cutoffs)
+
+
+def test_jsolines_holes():
+    width, height = 80, 60
+    isochrones = run_jsolines(
+        create_surface(width, height, lake=True), width, height, np.array([20])
+    )
+
+    polygons = list(isochrones["full"].geometry[0].geoms)
+    assert len(polygons) == 1
+    assert len(polygons[0].interiors) == 1
+
+
+def test_jsolines_unsorted_cutoffs():
+    width, height = 80, 60
+    surface = create_surface(width, height, noise=1.5)
+    cutoffs = np.array([10.0, 20.0, 30.0])
+
+    ordered = run_jsolines(surface, width, height, cutoffs)["full"]
+    unordered = run_jsolines(surface, width, height, cutoffs[::-1])["full"]
+
+    for i in range(len(cutoffs)):
+        assert ordered.geometry[i].equals(unordered.geometry[len(cutoffs) - 1 - i])
+
+
+@pytest.mark.parametrize("interpolation", [True, False])
+def test_jsolines_matches_contour(interpolation):
+    width, height = 40, 30
+    surface = create_surface(width, height, noise=2.0)
+    cutoff = 12
+
+    # A cell of the contouring grid contains a line if it is neither empty nor full
+    contour = get_contour(surface, width, height, cutoff)
+    isochrones = run_jsolines(
+        surface, width, height, np.array([cutoff]), interpolation=interpolation
+    )
+
+    assert np.any((contour != 0) & (contour != 15))
+    assert not isochrones["full"].geometry[0].is_empty
+
+
+def test_jsolines_only_incremental():
+    width, height = 80, 60
+    surface = create_surface(width, height)
+    cutoffs = np.arange(5, 26, 5)
+
+    both = run_jsolines(surface, width, height, cutoffs, return_incremental=True)
+    incremental = run_jsolines(
+        surface,
+        width,
+        height,
+        cutoffs,
+        return_incremental=True,
+        return_full=False,
+    )
+
+    assert list(incremental.keys()) == ["incremental"]
+    assert all(
+        a.equals(b)
+        for a, b in zip(
+            incremental["incremental"].geometry,
+            both["incremental"].geometry,
+            strict=True,
+        )
+    )
+
+
+def test_jsolines_empty_cutoff():
+    width, height = 80, 60
+    isochrones = run_jsolines(
+        create_surface(width, height), width, height, np.array([0, 10])
+    )
+
+    assert isochrones["full"].geometry[0].is_empty
+    assert isochrones["full"].geometry[0].geom_type == "MultiPolygon"
+    assert not isochrones["full"].geometry[1].is_empty
+
+
+def test_grid_cells():
+    width, height = 80, 60
+    surface = create_surface(width, height, noise=1.5, lake=True)
+    travel_time = 20
+    cells = grid_cells(surface, width, height, 68000, 44000, 9, travel_time)
+
+    # Runs of pixels with the same value are merged into a single cell
+    assert len(cells) < np.count_nonzero(surface <= travel_time)
+    assert cells["minute"].max() <= travel_time
+    assert all(geom.is_valid and geom.geom_type == "Polygon" for geom in cells.geometry)
+
+    # Cells do not overlap and cover the reachable part of the isochrone
+    isochrone = run_jsolines(surface, width, height, np.array([travel_time]))["full"]
+    union = shapely.union_all(cells.geometry.values)
+    assert union.area == pytest.approx(cells.geometry.area.sum())
+    assert union.intersection(isochrone.geometry[0]).area > 0.9 * isochrone.area[0]
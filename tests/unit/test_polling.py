@@ -0,0 +1,65 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from src.utils import get_retry_after, poll_endpoint, polling_metrics
+
+
+def create_endpoint(status_codes, headers=None):
+    """Endpoint returning the given status codes one after another."""
+
+    status_codes = iter(status_codes)
+
+    async def request():
+        return SimpleNamespace(status_code=next(status_codes), headers=headers or {})
+
+    return request
+
+
+def test_poll_endpoint_backoff():
+    start = time.monotonic()
+    response = asyncio.run(
+        poll_endpoint(create_endpoint([202, 202, 202, 201]), endpoint="test_backoff")
+    )
+
+    assert response.status_code == 201
+    # The first polls follow each other within milliseconds
+    assert time.monotonic() - start < 1
+    assert polling_metrics["test_backoff"]["polls"] == 4
+
+
+def test_poll_endpoint_retry_after():
+    start = time.monotonic()
+    asyncio.run(
+        poll_endpoint(
+            create_endpoint([202, 200], headers={"Retry-After": "0.3"}),
+            endpoint="test_retry_after",
+        )
+    )
+
+    assert time.monotonic() - start >= 0.3
+
+
+def test_poll_endpoint_timeout():
+    with pytest.raises(TimeoutError):
+        asyncio.run(
+            poll_endpoint(
+                create_endpoint([202] * 100), endpoint="test_timeout", timeout=0.2
+            )
+        )
+
+    assert polling_metrics["test_timeout"]["timeouts"] == 1
+    assert polling_metrics["test_timeout"]["errors"] == 0
+
+
+def test_get_retry_after():
+    assert get_retry_after(SimpleNamespace(headers={})) is None
+    assert get_retry_after(SimpleNamespace(headers={"Retry-After": "2"})) == 2
+    assert (
+        get_retry_after(
+            SimpleNamespace(headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        )
+        == 0
+    )
@@ -0,0 +1,76 @@
+import os
+
+import numpy as np
+
+from src.core.r5_cache import R5GridCache, read_r5_grid
+from src.utils import decode_r5_grid, encode_r5_grid
+
+
+def create_grid_bin(width=30, height=20, depth=5):
+    rng = np.random.default_rng(42)
+    return encode_r5_grid(
+        {
+            "version": 0,
+            "zoom": 9,
+            "west": 68000,
+            "north": 44000,
+            "width": width,
+            "height": height,
+            "depth": depth,
+            "data": rng.integers(0, 121, size=width * height * depth, dtype=np.int32),
+        }
+    )
+
+
+def test_r5_cache_key_is_normalized():
+    cache = R5GridCache(cache_dir="", max_size=1)
+    payload = {"fromLat": 48.1, "fromLon": 11.5, "bundleId": "a", "percentiles": [5]}
+
+    assert cache.get_key(payload) == cache.get_key(dict(reversed(payload.items())))
+    assert cache.get_key(payload) != cache.get_key(payload | {"bundleId": "b"})
+    assert cache.get_key(payload) != cache.get_key(payload | {"workerVersion": "v8"})
+
+
+def test_r5_cache_hit_and_miss(tmp_path):
+    cache = R5GridCache(cache_dir=str(tmp_path), max_size=1024**2)
+    grid_bin = create_grid_bin()
+    key = cache.get_key({"fromLat": 48.1, "fromLon": 11.5})
+
+    assert cache.get(key) is None
+    path = cache.put(key, grid_bin)
+    assert cache.get(key) == path
+
+    # Cached grids are decoded from a memory map
+    np.testing.assert_array_equal(
+        read_r5_grid(path, percentile=5)["data"],
+        decode_r5_grid(grid_bin, percentile=5)["data"],
+    )
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["entries"] == 1 and stats["size"] == len(grid_bin)
+
+
+def test_r5_cache_evicts_least_recently_used(tmp_path):
+    grid_bin = create_grid_bin()
+    cache = R5GridCache(cache_dir=str(tmp_path), max_size=2 * len(grid_bin))
+
+    paths = []
+    for i in range(2):
+        paths.append(cache.put(str(i), grid_bin))
+        os.utime(paths[-1], (i, i))
+    # Use the oldest grid so that the second one is evicted first
+    cache.get("0")
+    cache.put("2", grid_bin)
+
+    assert cache.get("0") is not None
+    assert cache.get("1") is None
+    assert cache.get("2") is not None
+    assert cache.stats()["size"] <= cache.max_size
+
+
+def test_r5_cache_disabled(tmp_path):
+    cache = R5GridCache(cache_dir=str(tmp_path), max_size=0)
+
+    assert cache.put("0", create_grid_bin()) is None
+    assert cache.get("0") is None
+    assert os.listdir(tmp_path) == []
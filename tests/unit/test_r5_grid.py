@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+
+from src.core.config import settings
+from src.utils import (
+    R5_TRAVEL_TIME_PERCENTILES,
+    compute_r5_surface,
+    decode_r5_grid,
+    encode_r5_grid,
+)
+
+R5_GRID_FIXTURE = os.path.join(
+    settings.TEST_DATA_DIR, "isochrone", "public_transport_calculation.bin"
+)
+
+
+def create_grid(width=60, height=40, depth=5):
+    rng = np.random.default_rng(42)
+    return {
+        "version": 0,
+        "zoom": 9,
+        "west": 68000,
+        "north": 44000,
+        "width": width,
+        "height": height,
+        "depth": depth,
+        "data": rng.integers(0, 121, size=width * height * depth, dtype=np.int32),
+    }
+
+
+def test_r5_grid_roundtrip():
+    grid = create_grid()
+    decoded = decode_r5_grid(encode_r5_grid(grid))
+
+    for key in ("zoom", "west", "north", "width", "height", "depth"):
+        assert decoded[key] == grid[key]
+    np.testing.assert_array_equal(decoded["data"], grid["data"])
+
+
+@pytest.mark.parametrize("percentile", R5_TRAVEL_TIME_PERCENTILES)
+def test_r5_grid_decode_single_percentile(percentile):
+    grid = create_grid()
+    grid_bin = encode_r5_grid(grid)
+
+    full = decode_r5_grid(grid_bin)
+    single = decode_r5_grid(grid_bin, percentile=percentile)
+
+    assert single["data"].size == grid["width"] * grid["height"]
+    np.testing.assert_array_equal(
+        compute_r5_surface(single, percentile), compute_r5_surface(full, percentile)
+    )
+    with pytest.raises(ValueError):
+        compute_r5_surface(single, 50 if percentile != 50 else 5)
+
+
+def test_r5_grid_decode_into_preallocated_array():
+    grid = create_grid(depth=1)
+    out = np.empty(grid["width"] * grid["height"], dtype=np.int32)
+
+    decoded = decode_r5_grid(memoryview(encode_r5_grid(grid)), out=out)
+
+    assert np.shares_memory(decoded["data"], out)
+    np.testing.assert_array_equal(out, grid["data"])
+
+
+def test_r5_grid_invalid_type():
+    with pytest.raises(ValueError):
+        decode_r5_grid(b"NOTAGRID" + bytes(64))
+
+
+@pytest.mark.skipif(
+    not os.path.exists(R5_GRID_FIXTURE), reason="R5 grid fixture not available."
+)
+def test_r5_grid_fixture_roundtrip():
+    with open(R5_GRID_FIXTURE, mode="rb") as file:
+        grid_bin = file.read()
+
+    # Decoding must be lossless with respect to the encoder
+    decoded = decode_r5_grid(grid_bin)
+    np.testing.assert_array_equal(
+        decode_r5_grid(encode_r5_grid(decoded))["data"], decoded["data"]
+    )
@@ -0,0 +1,61 @@
+import asyncio
+import math
+
+import pytest
+from shapely.geometry import box
+
+from src.core.r5_region import R5RegionIndex, get_r5_bounds
+
+
+def create_index():
+    index = R5RegionIndex(table_name="basic.region_mapping_pt", refresh_interval=300)
+    index.set_regions(
+        regions=[
+            {"r5_region_id": "west", "r5_bundle_id": "a", "r5_host": "r5-west"},
+            {"r5_region_id": "east", "r5_bundle_id": "b", "r5_host": "r5-east"},
+        ],
+        geometries=[box(8, 47, 11, 50), box(10, 47, 13, 50)],
+    )
+    return index
+
+
+def test_r5_region_index_query():
+    index = create_index()
+
+    regions = index.query(lats=[48.0, 48.0, 49.0], lons=[9.0, 12.0, 10.5])
+
+    # Points within both regions get the first region like the database lookup
+    assert [region["r5_region_id"] for region in regions] == ["west", "east", "west"]
+    assert not index.is_stale
+
+
+def test_r5_region_index_point_outside():
+    index = create_index()
+
+    assert index.query(lats=[48.0, 30.0], lons=[9.0, 9.0]) is None
+
+
+def test_r5_region_index_load_error():
+    class FailingSession:
+        async def execute(self, statement):
+            raise ConnectionError("connection lost")
+
+    index = R5RegionIndex(table_name="basic.region_mapping_pt", refresh_interval=300)
+
+    # The regions are looked up in the database if the index can't be loaded
+    regions = asyncio.run(index.get_regions(FailingSession(), lats=[48.0], lons=[9.0]))
+    assert regions is None
+    assert index.is_stale
+
+
+@pytest.mark.parametrize("lat", [0.0, 48.1, 70.0])
+def test_r5_bounds(lat):
+    bounds = get_r5_bounds(lat, 11.5)
+
+    # 100 km correspond to about 0.9 degrees of latitude
+    assert bounds["north"] - lat == pytest.approx(0.8993, abs=1e-3)
+    assert lat - bounds["south"] == pytest.approx(0.8993, abs=1e-3)
+    assert bounds["east"] - 11.5 == pytest.approx(
+        0.8993 / math.cos(math.radians(lat)), rel=1e-3
+    )
+    assert bounds["east"] - 11.5 == pytest.approx(11.5 - bounds["west"])